@@ -0,0 +1,76 @@
+import numpy as np  # type: ignore
+import argparse
+import time
+from typing import Callable, Dict
+from utils.vec3 import Vec3, Point3
+from utils.ray import RayList
+from utils.hittable_list import HittableList
+from utils.camera import Camera
+from utils.grid import make_grid
+from utils.rtweekend import random_float_list
+from bench_ray_sort import secondary_rays
+from main import random_scene, three_ball_scene, ray_color
+
+
+def time_call(f: Callable[[], object], repeat: int) -> float:
+    start = time.time()
+    for _ in range(repeat):
+        f()
+    return (time.time() - start) / repeat
+
+
+def bench_scene(world: HittableList, cam: Camera, length: int,
+                max_depth: int, repeat: int) -> Dict[str, float]:
+    primary: RayList = cam.get_ray(
+        random_float_list(length), random_float_list(length)
+    )
+    secondary = secondary_rays(world, cam, length)
+    return {
+        "primary": time_call(
+            lambda: world.hit(primary, 0.001, np.inf), repeat
+        ),
+        "secondary": time_call(
+            lambda: world.hit(secondary, 0.001, np.inf), repeat
+        ),
+        "ray_color": time_call(
+            lambda: ray_color(primary, world, max_depth), repeat
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the flat HittableList with the UniformGrid "
+                    "on the example scenes."
+    )
+    parser.add_argument("--rays", type=int, default=16384)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cam = Camera(
+        Point3(13, 2, 3), Point3(0, 0, 0), Vec3(0, 1, 0),
+        20, 16 / 9, 0.1, 10
+    )
+    for scene in (three_ball_scene, random_scene):
+        world = scene()
+        start = time.time()
+        grid = make_grid(world)
+        build = time.time() - start
+
+        print(f"{scene.__name__}: {len(world.objects)} objects, "
+              f"grid {tuple(grid.objects[0].resolution.tolist())} "
+              f"built in {build:.3f} s")
+        print(f"{'':>10} {'list':>9} {'grid':>9} {'speedup':>8}")
+        result_list = bench_scene(world, cam, args.rays, args.depth,
+                                  args.repeat)
+        result_grid = bench_scene(grid, cam, args.rays, args.depth,
+                                  args.repeat)
+        for key in result_list:
+            print(f"{key:>10} {result_list[key]:>8.3f}s "
+                  f"{result_grid[key]:>8.3f}s "
+                  f"{result_list[key] / result_grid[key]:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import numpy as np  # type: ignore
+import argparse
+import time
+from typing import Tuple
+from utils.vec3 import Vec3, Point3, Vec3List
+from utils.ray import RayList
+from utils.hittable import HitRecordList
+from utils.hittable_list import HittableList
+from utils.camera import Camera
+from utils.rtweekend import random_float_list
+from utils.ray_sort import ray_order, permute
+from main import random_scene, three_ball_scene
+
+
+def secondary_rays(world: HittableList, cam: Camera, length: int) \
+        -> RayList:
+    # Diffuse bounces off the first hits of random camera rays
+    r = cam.get_ray(random_float_list(length), random_float_list(length))
+    rec: HitRecordList = world.hit(r, 0.001, np.inf)
+    hit = Vec3List.from_array(rec.material != 0)
+    normal = Vec3List(np.where(hit.e, rec.normal.e, 0))
+    direction = normal + Vec3.random_unit_vector(length)
+    return RayList(
+        Vec3List(np.where(hit.e, rec.p.e, 0)),
+        Vec3List(np.where(hit.e, direction.e, 0))
+    )
+
+
+def time_hit(world: HittableList, r: RayList, repeat: int, sort: bool) \
+        -> Tuple[float, float]:
+    sort_time = 0.0
+    hit_time = 0.0
+    for _ in range(repeat):
+        start = time.time()
+        if sort:
+            order = ray_order(r)
+            sorted_r = permute(r, order)
+            inverse = np.empty_like(order)
+            inverse[order] = np.arange(len(order))
+        else:
+            sorted_r = r
+        sort_time += time.time() - start
+
+        start = time.time()
+        rec = world.hit(sorted_r, 0.001, np.inf)
+        hit_time += time.time() - start
+
+        start = time.time()
+        if sort:
+            rec.t[inverse]
+        sort_time += time.time() - start
+    return sort_time / repeat, hit_time / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time secondary ray intersection with and without "
+                    "coherence sorting over a range of batch sizes, to "
+                    "look for the size where sorting starts to pay off."
+    )
+    parser.add_argument("--scene", choices=("random", "three_ball"),
+                        default="random")
+    parser.add_argument("--accel", choices=("list", "grid"),
+                        default="list")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    scene = random_scene if args.scene == "random" else three_ball_scene
+    world = scene(args.accel)
+    cam = Camera(
+        Point3(13, 2, 3), Point3(0, 0, 0), Vec3(0, 1, 0),
+        20, 16 / 9, 0.1, 10
+    )
+
+    print(f"{'rays':>8} {'unsorted':>10} {'sort':>10} {'sorted hit':>11} "
+          f"{'speedup':>8}")
+    for length in (256, 1024, 4096, 16384, 65536):
+        r = secondary_rays(world, cam, length)
+        _, base = time_hit(world, r, args.repeat, False)
+        sort, hit = time_hit(world, r, args.repeat, True)
+        print(f"{length:>8} {base:>9.4f}s {sort:>9.4f}s {hit:>10.4f}s "
+              f"{base / (sort + hit):>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,36 @@
 import numpy as np  # type: ignore
+import argparse
 import multiprocessing
+import os
 import time
 from joblib import Parallel, delayed  # type: ignore
-from typing import List, Optional, Dict, Tuple
+from typing import List, Optional, Dict, Tuple, Union
 from utils.vec3 import Vec3, Point3, Color, Vec3List
 from utils.img import Img
 from utils.ray import RayList, Ray
 from utils.sphere import Sphere
 from utils.hittable import Hittable, HitRecordList, HitRecord
 from utils.hittable_list import HittableList
-from utils.rtweekend import random_float, random_float_list
+from utils.grid import make_grid
+from utils.box import BoxSet
+from utils.aarect import RectSet
+from utils.mesh import TriangleMesh
+from utils.environment import EnvironmentMap
+from utils.denoise import atrous
+from utils.aov import (
+    AOV_CHANNELS, new_aovs, record_hits, accumulate, finish, save_aovs
+)
+from utils.checkpoint import Checkpoint
+from utils.rtweekend import random_float, random_float_list, seed
 from utils.camera import Camera
-from utils.material import Material, Lambertian, Metal, Dielectric
+from utils.material import (
+    Material, Lambertian, Metal, Dielectric, DiffuseLight
+)
+from utils.stats import traversal_stats
+from utils.ray_sort import ray_order, permute, unpermute
 
 
-def three_ball_scene() -> HittableList:
+def three_ball_scene(accel: str = "list") -> HittableList:
     world = HittableList()
     world.add(Sphere(
         Point3(0, 0, -1), 0.5, Lambertian(Color(0.1, 0.2, 0.5), 1)
@@ -32,10 +48,10 @@ def three_ball_scene() -> HittableList:
     world.add(Sphere(
         Point3(-1, 0, -1), -0.45, material_dielectric
     ))
-    return world
+    return make_grid(world) if accel == "grid" else world
 
 
-def random_scene() -> HittableList:
+def random_scene(accel: str = "list") -> HittableList:
     world = HittableList()
 
     ground_material = Lambertian(Color(0.5, 0.5, 0.5), 1)
@@ -75,7 +91,71 @@ def random_scene() -> HittableList:
     material_3 = Metal(Color(0.7, 0.6, 0.5), 0, 5)
     world.add(Sphere(Point3(4, 1, 0), 1, material_3))
 
-    return world
+    return make_grid(world) if accel == "grid" else world
+
+
+def box_scene(accel: str = "list") -> HittableList:
+    world = HittableList()
+    world.add(Sphere(
+        Point3(0, -1000, 0), 1000, Lambertian(Color(0.5, 0.5, 0.5), 1)
+    ))
+
+    # A block of random height columns, like the floor of final_scene
+    ground = Lambertian(Color(0.48, 0.83, 0.53), 2)
+    boxes: List[Tuple[Point3, Point3]] = list()
+    for i in range(-10, 10):
+        for j in range(-10, 10):
+            boxes.append((
+                Point3(i*0.5, 0, j*0.5),
+                Point3(i*0.5 + 0.5, random_float(0.05, 0.6), j*0.5 + 0.5)
+            ))
+    world.add(BoxSet(boxes, [ground] * len(boxes)))
+
+    world.add(Sphere(Point3(0, 1.6, 0), 1, Dielectric(1.5, 3)))
+    world.add(Sphere(
+        Point3(-3, 1.6, -1), 1, Metal(Color(0.7, 0.6, 0.5), 0, 4)
+    ))
+    return make_grid(world) if accel == "grid" else world
+
+
+def cornell_box(accel: str = "list") -> HittableList:
+    world = HittableList()
+
+    red = Lambertian(Color(0.65, 0.05, 0.05), 1)
+    white = Lambertian(Color(0.73, 0.73, 0.73), 2)
+    green = Lambertian(Color(0.12, 0.45, 0.15), 3)
+    light = DiffuseLight(Color(15, 15, 15), 4)
+
+    # The walls at 555 are seen from inside the box, their negative side,
+    # so they are flipped
+    walls = RectSet()
+    walls.add_yz(0, 555, 0, 555, 555, green, flip=True)
+    walls.add_yz(0, 555, 0, 555, 0, red)
+    walls.add_xz(213, 343, 227, 332, 554, light)
+    walls.add_xz(0, 555, 0, 555, 0, white)
+    walls.add_xz(0, 555, 0, 555, 555, white, flip=True)
+    walls.add_xy(0, 555, 0, 555, 555, white, flip=True)
+    world.add(walls)
+
+    # No rotations in this engine, so the boxes stay axis-aligned
+    world.add(BoxSet(
+        [(Point3(265, 0, 295), Point3(430, 330, 460)),
+         (Point3(130, 0, 65), Point3(295, 165, 230))],
+        [white, white]
+    ))
+    return make_grid(world) if accel == "grid" else world
+
+
+def mesh_scene(path: str, accel: str = "list") -> HittableList:
+    world = HittableList()
+    world.add(Sphere(
+        Point3(0, -1000, 0), 1000, Lambertian(Color(0.5, 0.5, 0.5), 1)
+    ))
+    world.add(TriangleMesh.from_obj(
+        path, Lambertian(Color(0.8, 0.3, 0.2), 2),
+        os.path.splitext(path)[0] + ".rtm"
+    ))
+    return make_grid(world) if accel == "grid" else world
 
 
 def compress(r: RayList, rec: HitRecordList) \
@@ -116,13 +196,19 @@ def decompress(r: RayList, a: Vec3List, idx: Optional[np.ndarray],
     return new_r, new_a
 
 
-def ray_color(r: RayList, world: HittableList, depth: int) -> Vec3List:
+def ray_color(r: RayList, world: HittableList, depth: int,
+              sort_rays: bool = False,
+              background: Optional[Union[Color, EnvironmentMap]] = None,
+              aovs: Optional[np.ndarray] = None) -> Vec3List:
     length = len(r)
     if not r.direction().e.any():
         return Vec3List.new_zero(length)
 
     # Calculate object hits
     rec_list: HitRecordList = world.hit(r, 0.001, np.inf)
+    # Output variables of the camera rays
+    if aovs is not None:
+        record_hits(aovs, r, rec_list, world.get_materials())
 
     # Useful empty arrays
     empty_vec3list = Vec3List.new_zero(length)
@@ -135,19 +221,29 @@ def ray_color(r: RayList, world: HittableList, depth: int) -> Vec3List:
     sky_condition = Vec3List.from_array(
         (unit_direction.length() > 0) & (rec_list.material == 0)
     )
-    t = (unit_direction.y() + 1) * 0.5
-    blue_bg = (
-        Vec3List.from_vec3(Color(1, 1, 1), length).mul_ndarray(1 - t)
-        + Vec3List.from_vec3(Color(0.5, 0.7, 1), length).mul_ndarray(t)
-    )
+    if background is None:
+        t = (unit_direction.y() + 1) * 0.5
+        blue_bg = (
+            Vec3List.from_vec3(Color(1, 1, 1), length).mul_ndarray(1 - t)
+            + Vec3List.from_vec3(Color(0.5, 0.7, 1), length).mul_ndarray(t)
+        )
+    elif isinstance(background, EnvironmentMap):
+        blue_bg = background.lookup(unit_direction)
+    else:
+        blue_bg = Vec3List.from_vec3(background, length)
     result_bg = Vec3List(
         np.where(sky_condition.e, blue_bg.e, empty_vec3list.e)
     )
+
+    # Light sources
+    materials: Dict[int, Material] = world.get_materials()
+    for mat in materials.values():
+        if mat.emissive:
+            result_bg += mat.emitted(rec_list)
     if depth <= 1:
         return result_bg
 
     # Per-material preparations
-    materials: Dict[int, Material] = world.get_materials()
     material_dict: Dict[int, Tuple[RayList, HitRecordList]] = dict()
     for mat_idx in materials:
         mat_condition = (rec_list.material == mat_idx)
@@ -184,18 +280,43 @@ def ray_color(r: RayList, world: HittableList, depth: int) -> Vec3List:
         )
         scattered_list += scattered
         attenuation_list += attenuation
-    result_hittable = (
-        attenuation_list * ray_color(scattered_list, world, depth-1)
-    )
+    if traversal_stats.enabled:
+        traversal_stats.add_bounces(scattered_list.dir.length_squared() > 0)
+    if sort_rays:
+        # Trace the bounce in a coherent order, then map colors back
+        order = ray_order(scattered_list)
+        if traversal_stats.enabled:
+            traversal_stats.push(order)
+        bounce_color = unpermute(ray_color(
+            permute(scattered_list, order), world, depth-1, sort_rays,
+            background
+        ), order)
+        if traversal_stats.enabled:
+            traversal_stats.pop()
+    else:
+        bounce_color = ray_color(
+            scattered_list, world, depth-1, sort_rays, background
+        )
+    result_hittable = attenuation_list * bounce_color
 
     return result_hittable + result_bg
 
 
 def scan_line(j: int, world: HittableList, cam: Camera,
               image_width: int, image_height: int,
-              samples_per_pixel: int, max_depth: int) -> Img:
+              samples_per_pixel: int, max_depth: int,
+              sort_rays: bool = False,
+              background: Optional[Union[Color, EnvironmentMap]] = None,
+              aovs: bool = False,
+              seed_key: Optional[Tuple[int, ...]] = None) \
+        -> Tuple[Img, Optional[np.ndarray]]:
+    # The row and, when asked for, its (1, w, AOV_SIZE) output variables.
+    # seed_key picks the random stream, for renders that can resume.
+    if seed_key is not None:
+        seed(*seed_key)
     img = Img(image_width, 1)
     row_pixel_color = Vec3List.from_vec3(Color(), image_width)
+    row_aovs = new_aovs(image_width, albedo=0) if aovs else None
 
     for s in range(samples_per_pixel):
         u: np.ndarray = (random_float_list(image_width)
@@ -203,20 +324,78 @@ def scan_line(j: int, world: HittableList, cam: Camera,
         v: np.ndarray = (random_float_list(image_width)
                          + j) / (image_height - 1)
         r: RayList = cam.get_ray(u, v)
-        row_pixel_color += ray_color(r, world, max_depth)
+        sample_aovs = new_aovs(image_width) if aovs else None
+        row_pixel_color += ray_color(
+            r, world, max_depth, sort_rays, background, sample_aovs
+        )
+        if row_aovs is not None:
+            accumulate(row_aovs, sample_aovs)
+
+    img.add_pixel_list(0, row_pixel_color, samples_per_pixel)
+    if row_aovs is None:
+        return img, None
+    return img, finish(row_aovs, samples_per_pixel)[np.newaxis]
+
+
+def scan_line_cost(j: int, world: HittableList, cam: Camera,
+                   image_width: int, image_height: int,
+                   samples_per_pixel: int, max_depth: int) -> np.ndarray:
+    # Per pixel: boxes tested, primitives tested, bounces taken
+    cost = np.zeros((image_width, 3), dtype=np.float32)
 
-    img.write_pixel_list(0, row_pixel_color, samples_per_pixel)
-    return img
+    for s in range(samples_per_pixel):
+        u: np.ndarray = (random_float_list(image_width)
+                         + np.arange(image_width)) / (image_width - 1)
+        v: np.ndarray = (random_float_list(image_width)
+                         + j) / (image_height - 1)
+        r: RayList = cam.get_ray(u, v)
+        traversal_stats.begin(image_width)
+        ray_color(r, world, max_depth)
+        cost += traversal_stats.end()
+
+    return (cost / samples_per_pixel)[np.newaxis]
+
+
+def save_cost(cost: np.ndarray, prefix: str) -> None:
+    np.save(f"{prefix}_cost.npy", cost)
+    for k, name in enumerate(["boxes", "primitives", "bounces"]):
+        img = Img(cost.shape[1], cost.shape[0])
+        img.set_false_color(cost[:, :, k])
+        img.save(f"{prefix}_{name}.png")
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true",
+                        help="add samples to the render in --checkpoint")
+    parser.add_argument("--checkpoint", default="./output_checkpoint",
+                        help="path prefix of the checkpoint files")
+    args = parser.parse_args()
+
     aspect_ratio = 16 / 9
     image_width = 256
     image_height = int(image_width / aspect_ratio)
-    samples_per_pixel = 20
+    samples_per_pixel = 20  # may be raised to extend a resumed render
+    samples_per_pass = 4  # samples added between checkpoints
     max_depth = 10
-
-    world: HittableList = three_ball_scene()
+    render_mode = "radiance"  # or "heatmap" for traversal cost
+    denoise_strength: float = 0  # above 0 filters the noise out
+    write_aovs = False  # albedo, normal, depth and ids to output_aovs.npz
+    exposure: float = 1  # applied when encoding, output.npy stays linear
+    sort_rays = False  # reorder bounces, no faster, see bench_ray_sort
+    accel = "list"  # or "grid" for a uniform grid over the spheres
+    # None for the sky gradient
+    background: Optional[Union[Color, EnvironmentMap]] = None
+    # HDR sky, float data as .npy or .pfm
+    # background = EnvironmentMap.from_file("./sky.npy")
+
+    # Random scenes come out the same when resuming
+    render_seed: int = Checkpoint.saved_seed(args.checkpoint) \
+        if args.resume else np.random.SeedSequence().entropy
+    seed(render_seed)
+
+    world: HittableList = three_ball_scene(accel)
+    # world = mesh_scene("./model.obj", accel)  # cached in model.rtm
 
     lookfrom = Point3(13, 2, 3)
     lookat = Point3(0, 0, 0)
@@ -224,6 +403,16 @@ def main() -> None:
     vfov = 20
     dist_to_focus: float = 10
     aperture: float = 0.1
+
+    # # Cornell box, lit only by its ceiling light
+    # aspect_ratio = 1
+    # image_height = image_width
+    # world = cornell_box(accel)
+    # background = Color(0, 0, 0)
+    # lookfrom = Point3(278, 278, -800)
+    # lookat = Point3(278, 278, 0)
+    # vfov = 40
+    # aperture = 0
     cam = Camera(
         lookfrom, lookat, vup, vfov, aspect_ratio, aperture, dist_to_focus
     )
@@ -232,13 +421,56 @@ def main() -> None:
     start_time = time.time()
 
     n_processer = multiprocessing.cpu_count()
-    img_list: List[Img] = Parallel(n_jobs=n_processer, verbose=10)(
-        delayed(scan_line)(
-            j, world, cam,
-            image_width, image_height,
-            samples_per_pixel, max_depth
-        ) for j in range(image_height-1, -1, -1)
-    )
+    if render_mode == "heatmap":
+        cost_list: List[np.ndarray] = Parallel(
+            n_jobs=n_processer, verbose=10
+        )(
+            delayed(scan_line_cost)(
+                j, world, cam,
+                image_width, image_height,
+                samples_per_pixel, max_depth
+            ) for j in range(image_height-1, -1, -1)
+        )
+        save_cost(np.concatenate(cost_list), "./output")
+        end_time = time.time()
+        print(f"\nDone. Total time: {round(end_time - start_time, 1)} s.")
+        return
+
+    # Only a radiance render touches the checkpoint, once the image size
+    # is final
+    settings = {
+        "width": image_width, "height": image_height,
+        "max_depth": max_depth, "samples_per_pass": samples_per_pass
+    }
+    checkpoint = Checkpoint.resume(args.checkpoint, settings) \
+        if args.resume \
+        else Checkpoint.create(args.checkpoint, settings, render_seed)
+
+    use_aovs = write_aovs or denoise_strength > 0
+    # Passes of samples_per_pass samples, each saved when it finishes.
+    # A stream per first sample and row keeps resumed passes fresh.
+    done = checkpoint.samples_done()
+    for first in range(done, samples_per_pixel, samples_per_pass):
+        samples = min(samples_per_pass, samples_per_pixel - first)
+        # AOVs come from the first pass that runs with them on
+        pass_aovs = use_aovs and not checkpoint.has_aovs()
+        line_list: List[Tuple[Img, Optional[np.ndarray]]] = Parallel(
+            n_jobs=n_processer, verbose=10
+        )(
+            delayed(scan_line)(
+                j, world, cam,
+                image_width, image_height,
+                samples, max_depth, sort_rays, background, pass_aovs,
+                (checkpoint.seed, first, j)
+            ) for j in range(image_height-1, -1, -1)
+        )
+        if pass_aovs:
+            checkpoint.save_aovs(np.concatenate([
+                line_aovs for _, line_aovs in line_list
+            ]))
+        checkpoint.add(np.concatenate([img.accum for img, _ in line_list]))
+        print(f"\nCheckpoint: {first + samples} of {samples_per_pixel} "
+              f"samples.")
 
     # # Profile prologue
     # import cProfile
@@ -248,9 +480,9 @@ def main() -> None:
     # pr = cProfile.Profile()
     # pr.enable()
 
-    # img_list: List[Img] = list()
+    # line_list: List[Tuple[Img, Optional[np.ndarray]]] = list()
     # for j in range(image_height-1, -1, -1):
-    #     img_list.append(
+    #     line_list.append(
     #         scan_line(
     #             j, world, cam,
     #             image_width, image_height,
@@ -267,9 +499,25 @@ def main() -> None:
     # print(s.getvalue())
 
     final_img = Img(image_width, image_height)
-    final_img.set_array(
-        np.concatenate([img.frame for img in img_list])
-    )
+    final_img.set_accumulation(np.array(checkpoint.accum))
+    # Linear sums and counts, to merge with or tone map later
+    final_img.save_linear("./output.npy")
+    color = final_img.linear()
+    aovs = checkpoint.load_aovs() if use_aovs else None
+    if use_aovs and aovs is None:
+        # A finished render resumed with AOVs newly turned on
+        print(f"\nNo AOVs in {args.checkpoint}, raise samples_per_pixel "
+              f"to record them. Not writing or denoising them.")
+    if aovs is not None:
+        if write_aovs:
+            save_aovs(aovs, "./output_aovs.npz")
+        if denoise_strength > 0:
+            color = atrous(
+                color, aovs[..., AOV_CHANNELS["albedo"]],
+                aovs[..., AOV_CHANNELS["normal"]],
+                aovs[..., AOV_CHANNELS["depth"]][..., 0], denoise_strength
+            )
+    final_img.encode(color, exposure)
 
     end_time = time.time()
     print(f"\nDone. Total time: {round(end_time - start_time, 1)} s.")
@@ -0,0 +1,36 @@
+from __future__ import annotations
+import numpy as np  # type: ignore
+from typing import Union
+from utils.vec3 import Point3
+from utils.ray import RayList
+
+
+class AABB:
+    def __init__(self, _min: Point3 = Point3(),
+                 _max: Point3 = Point3()) -> None:
+        self._min = _min
+        self._max = _max
+
+    def min(self) -> Point3:
+        return self._min
+
+    def max(self) -> Point3:
+        return self._max
+
+    def hit(self, r: RayList, t_min: float,
+            t_max: Union[float, np.ndarray]) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_dir = 1 / r.dir.e
+            t0 = (self._min.e - r.orig.e) * inv_dir
+            t1 = (self._max.e - r.orig.e) * inv_dir
+        # fmin / fmax skip the NaNs of a ray lying exactly in a slab plane
+        t_near = np.fmax(np.fmax.reduce(np.fmin(t0, t1), axis=1), t_min)
+        t_far = np.fmin(np.fmin.reduce(np.fmax(t0, t1), axis=1), t_max)
+        return t_far > t_near
+
+    @staticmethod
+    def surrounding_box(box0: AABB, box1: AABB) -> AABB:
+        return AABB(
+            Point3(*np.minimum(box0.min().e, box1.min().e)),
+            Point3(*np.maximum(box0.max().e, box1.max().e))
+        )
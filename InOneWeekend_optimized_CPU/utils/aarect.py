@@ -0,0 +1,172 @@
+import numpy as np  # type: ignore
+from typing import List, Optional, Union, Tuple, Dict
+from utils.vec3 import Point3, Vec3List
+from utils.ray import RayList
+from utils.material import Material
+from utils.hittable import Hittable, HitRecordList
+from utils.aabb import AABB
+from utils.stats import traversal_stats
+
+
+class RectSet(Hittable):
+    """
+    Axis-aligned rectangles packed into arrays, one group per plane
+    orientation, intersected with chunked rays x rects broadcasts.
+    A flipped rect reports its hits as back faces, like FlipFace.
+    """
+    # (first in-plane axis, second in-plane axis, normal axis)
+    AXES = {"xy": (0, 1, 2), "xz": (0, 2, 1), "yz": (1, 2, 0)}
+    CHUNK_SIZE = 2**18
+
+    def __init__(self) -> None:
+        # Per group rows of (a0, a1, b0, b1, k), material idx, flip flag
+        self.rects: Dict[str, List[Tuple[float, ...]]] = {
+            name: list() for name in self.AXES
+        }
+        self.rect_materials: Dict[str, List[int]] = {
+            name: list() for name in self.AXES
+        }
+        self.flips: Dict[str, List[bool]] = {
+            name: list() for name in self.AXES
+        }
+        self.materials: Dict[int, Material] = dict()
+        self.packed: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = \
+            dict()
+
+    def add(self, plane: str, a0: float, a1: float, b0: float, b1: float,
+            k: float, mat: Material, flip: bool = False) -> None:
+        if plane not in self.AXES:
+            print(f"Unknown rect plane {plane}.")
+            raise ValueError
+        self.rects[plane].append((a0, a1, b0, b1, k))
+        self.rect_materials[plane].append(mat.idx)
+        self.flips[plane].append(flip)
+        self.materials[mat.idx] = mat
+        self.packed.clear()
+
+    def add_xy(self, x0: float, x1: float, y0: float, y1: float, k: float,
+               mat: Material, flip: bool = False) -> None:
+        self.add("xy", x0, x1, y0, y1, k, mat, flip)
+
+    def add_xz(self, x0: float, x1: float, z0: float, z1: float, k: float,
+               mat: Material, flip: bool = False) -> None:
+        self.add("xz", x0, x1, z0, z1, k, mat, flip)
+
+    def add_yz(self, y0: float, y1: float, z0: float, z1: float, k: float,
+               mat: Material, flip: bool = False) -> None:
+        self.add("yz", y0, y1, z0, z1, k, mat, flip)
+
+    def __len__(self) -> int:
+        return sum(len(rects) for rects in self.rects.values())
+
+    def pack(self, plane: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if plane not in self.packed:
+            self.packed[plane] = (
+                np.array(self.rects[plane], dtype=np.float32).reshape(-1, 5),
+                np.array(self.rect_materials[plane], dtype=np.int32),
+                np.array(self.flips[plane], dtype=bool)
+            )
+        return self.packed[plane]
+
+    def get_materials(self) -> Dict[int, Material]:
+        return self.materials
+
+    def bounding_box(self) -> Optional[AABB]:
+        if len(self) == 0:
+            return None
+        lo = np.full(3, np.inf)
+        hi = np.full(3, -np.inf)
+        for plane, (axis_a, axis_b, axis_k) in self.AXES.items():
+            bounds = self.pack(plane)[0]
+            if len(bounds) == 0:
+                continue
+            # Pad the flat axis, as the scalar rects do
+            for axis, low, high in (
+                (axis_a, bounds[:, 0], bounds[:, 1]),
+                (axis_b, bounds[:, 2], bounds[:, 3]),
+                (axis_k, bounds[:, 4] - 0.0001, bounds[:, 4] + 0.0001),
+            ):
+                lo[axis] = min(lo[axis], low.min())
+                hi[axis] = max(hi[axis], high.max())
+        return AABB(Point3(*lo), Point3(*hi))
+
+    def closest(self, r: RayList, t_min: float, t_max: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Nearest t, plane number and rect index per ray, -1 on a miss
+        length = len(r)
+        orig = r.orig.e
+        direction = r.dir.e
+        with np.errstate(divide="ignore"):
+            inv_dir = 1 / direction
+        best_t = np.full(length, np.inf, dtype=np.float32)
+        best_plane = np.full(length, -1, dtype=np.int64)
+        best_rect = np.full(length, -1, dtype=np.int64)
+        chunk = max(1, self.CHUNK_SIZE // max(length, 1))
+
+        for p, (plane, (axis_a, axis_b, axis_k)) in enumerate(
+            self.AXES.items()
+        ):
+            bounds = self.pack(plane)[0]
+            for start in range(0, len(bounds), chunk):
+                a0, a1, b0, b1, k = bounds[start:start+chunk].T
+                with np.errstate(invalid="ignore"):
+                    t = (k - orig[:, axis_k, np.newaxis]) \
+                        * inv_dir[:, axis_k, np.newaxis]
+                    a = orig[:, axis_a, np.newaxis] \
+                        + t * direction[:, axis_a, np.newaxis]
+                    b = orig[:, axis_b, np.newaxis] \
+                        + t * direction[:, axis_b, np.newaxis]
+                    inside = (
+                        (t >= t_min)
+                        & (t <= np.minimum(best_t, t_max)[:, np.newaxis])
+                        & (a >= a0) & (a <= a1) & (b >= b0) & (b <= b1)
+                    )
+                t = np.where(inside, t, np.inf)
+                i = np.argmin(t, axis=1)
+                t_i = t[np.arange(length), i]
+                closer = t_i < best_t
+                best_t = np.where(closer, t_i, best_t)
+                best_plane = np.where(closer, p, best_plane)
+                best_rect = np.where(closer, start + i, best_rect)
+        return best_t, best_plane, best_rect
+
+    def hit(self, r: RayList, t_min: float, t_max: Union[float, np.ndarray]) \
+            -> HitRecordList:
+        if traversal_stats.enabled:
+            traversal_stats.add_primitive_tests(amount=len(self))
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+
+        result = HitRecordList.new(len(r))
+        best_t, best_plane, best_rect = self.closest(r, t_min, t_max)
+        for p, (plane, (_, _, axis_k)) in enumerate(self.AXES.items()):
+            idx = np.where(best_plane == p)[0]
+            if len(idx) == 0:
+                continue
+            _, materials, flips = self.pack(plane)
+            rect = best_rect[idx]
+            sub_r = RayList(
+                Vec3List(r.orig.get_ndarray(idx)),
+                Vec3List(r.dir.get_ndarray(idx))
+            )
+            t = best_t[idx]
+            outward_normal = Vec3List.new_zero(len(idx))
+            outward_normal.e[:, axis_k] = 1
+            sub_rec = HitRecordList(
+                sub_r.at(t), t, materials[rect]
+            ).set_face_normal(sub_r, outward_normal)
+
+            result.p.e[idx] = sub_rec.p.e
+            result.t[idx] = t
+            result.material[idx] = sub_rec.material
+            result.normal.e[idx] = sub_rec.normal.e
+            result.front_face[idx] = sub_rec.front_face ^ flips[rect]
+        return result
+
+    def occluded(self, r: RayList, t_min: float,
+                 t_max: Union[float, np.ndarray]) -> np.ndarray:
+        if traversal_stats.enabled:
+            traversal_stats.add_primitive_tests(amount=len(self))
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+        return self.closest(r, t_min, t_max)[1] >= 0
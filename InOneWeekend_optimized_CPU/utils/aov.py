@@ -0,0 +1,63 @@
+import numpy as np  # type: ignore
+from typing import Dict
+from utils.ray import RayList
+from utils.hittable import HitRecordList
+from utils.material import Material
+
+
+# Channels of the per-pixel output variables, taken at the first hit
+AOV_CHANNELS: Dict[str, slice] = {
+    "albedo": slice(0, 3),
+    "normal": slice(3, 6),
+    "depth": slice(6, 7),
+    "material_id": slice(7, 8),
+    "object_id": slice(8, 9),
+}
+AOV_SIZE = 9
+
+
+def new_aovs(length: int, albedo: float = 1) -> np.ndarray:
+    # What a miss leaves: the given albedo, no normal, no depth, id -1
+    aovs = np.zeros((length, AOV_SIZE), dtype=np.float32)
+    aovs[:, AOV_CHANNELS["albedo"]] = albedo
+    aovs[:, AOV_CHANNELS["depth"]] = np.inf
+    aovs[:, AOV_CHANNELS["material_id"]] = -1
+    aovs[:, AOV_CHANNELS["object_id"]] = -1
+    return aovs
+
+
+def record_hits(aovs: np.ndarray, r: RayList, rec: HitRecordList,
+                materials: Dict[int, Material]) -> None:
+    # Material 0 is a miss, its rows keep their defaults
+    hit = rec.material > 0
+    albedo_table = np.ones((max(materials, default=0) + 1, 3),
+                           dtype=np.float32)
+    for idx, mat in materials.items():
+        albedo_table[idx] = mat.albedo_value().e
+    aovs[hit, AOV_CHANNELS["albedo"]] = albedo_table[rec.material[hit]]
+    aovs[hit, AOV_CHANNELS["normal"]] = rec.normal.e[hit]
+    aovs[hit, 6] = rec.t[hit] * r.dir.length()[hit]
+    aovs[hit, 7] = rec.material[hit]
+    aovs[hit, 8] = rec.object_id[hit]
+
+
+def accumulate(total: np.ndarray, sample: np.ndarray) -> None:
+    # Albedo and normal are summed over the samples, depth and ids come
+    # from the nearest first hit
+    total[:, :6] += sample[:, :6]
+    nearer = sample[:, 6] < total[:, 6]
+    total[nearer, 6:] = sample[nearer, 6:]
+
+
+def finish(total: np.ndarray, samples_per_pixel: int) -> np.ndarray:
+    total[..., :6] /= samples_per_pixel
+    return total
+
+
+def save_aovs(aovs: np.ndarray, path: str) -> None:
+    # One float array per variable, depth and ids as (h, w)
+    np.savez(path, **{
+        name: np.squeeze(aovs[..., channels], axis=-1)
+        if channels.stop - channels.start == 1 else aovs[..., channels]
+        for name, channels in AOV_CHANNELS.items()
+    })
@@ -0,0 +1,144 @@
+import numpy as np  # type: ignore
+from typing import List, Optional, Union, Tuple, Dict
+from utils.vec3 import Point3, Vec3List
+from utils.ray import RayList
+from utils.material import Material
+from utils.hittable import Hittable, HitRecordList
+from utils.aabb import AABB
+from utils.stats import traversal_stats
+
+
+class BoxSet(Hittable):
+    """
+    Axis-aligned boxes kept as packed min / max arrays and intersected with
+    one broadcast slab test over rays x boxes. The boxes are handled in
+    chunks so the temporaries stay within CHUNK_SIZE entries.
+    """
+    CHUNK_SIZE = 2**18
+
+    def __init__(self, boxes: List[Tuple[Point3, Point3]],
+                 materials: List[Material]) -> None:
+        if len(boxes) != len(materials) or not boxes:
+            print("BoxSet needs one material per box.")
+            raise ValueError
+        self.lo: np.ndarray = np.array(
+            [np.minimum(p0.e, p1.e) for p0, p1 in boxes], dtype=np.float32
+        )
+        self.hi: np.ndarray = np.array(
+            [np.maximum(p0.e, p1.e) for p0, p1 in boxes], dtype=np.float32
+        )
+        self.material_idx = np.array([mat.idx for mat in materials],
+                                     dtype=np.int32)
+        self.materials: Dict[int, Material] = {
+            mat.idx: mat for mat in materials
+        }
+
+    def __len__(self) -> int:
+        return len(self.lo)
+
+    def get_materials(self) -> Dict[int, Material]:
+        return self.materials
+
+    def bounding_box(self) -> Optional[AABB]:
+        return AABB(Point3(*self.lo.min(axis=0)), Point3(*self.hi.max(axis=0)))
+
+    def slab(self, orig: np.ndarray, inv_dir: np.ndarray,
+             lo: np.ndarray, hi: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        # Entry and exit t of rays (n, 3) against boxes (m, 3): (n, m) each.
+        # One axis at a time, reducing over a length 3 axis is much slower.
+        t_near = np.full((len(orig), len(lo)), -np.inf, dtype=np.float32)
+        t_far = np.full((len(orig), len(lo)), np.inf, dtype=np.float32)
+        for k in range(3):
+            o = orig[:, k, np.newaxis]
+            inv = inv_dir[:, k, np.newaxis]
+            with np.errstate(invalid="ignore"):
+                t0 = (lo[np.newaxis, :, k] - o) * inv
+                t1 = (hi[np.newaxis, :, k] - o) * inv
+            # fmin / fmax skip the NaNs of a ray lying exactly in a plane
+            t_near = np.fmax(t_near, np.fmin(t0, t1))
+            t_far = np.fmin(t_far, np.fmax(t0, t1))
+        return t_near, t_far
+
+    def closest(self, r: RayList, t_min: float, t_max: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        # Nearest t in [t_min, t_max] and box index per ray, -1 on a miss
+        length = len(r)
+        with np.errstate(divide="ignore"):
+            inv_dir = 1 / r.dir.e
+        best_t = np.full(length, np.inf, dtype=np.float32)
+        best_box = np.full(length, -1, dtype=np.int64)
+        chunk = max(1, self.CHUNK_SIZE // max(length, 1))
+        for start in range(0, len(self), chunk):
+            t_near, t_far = self.slab(
+                r.orig.e, inv_dir,
+                self.lo[start:start+chunk], self.hi[start:start+chunk]
+            )
+            limit = np.minimum(best_t, t_max)[:, np.newaxis]
+            valid = t_near <= t_far
+            t = np.where(
+                valid & (t_min <= t_near) & (t_near <= limit), t_near,
+                np.where(valid & (t_min <= t_far) & (t_far <= limit),
+                         t_far, np.inf)
+            )
+            i = np.argmin(t, axis=1)
+            t_i = t[np.arange(length), i]
+            closer = t_i < best_t
+            best_t = np.where(closer, t_i, best_t)
+            best_box = np.where(closer, start + i, best_box)
+        return best_t, best_box
+
+    def hit(self, r: RayList, t_min: float, t_max: Union[float, np.ndarray]) \
+            -> HitRecordList:
+        if traversal_stats.enabled:
+            traversal_stats.add_primitive_tests(amount=len(self))
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+
+        result = HitRecordList.new(len(r))
+        best_t, best_box = self.closest(r, t_min, t_max)
+        idx = np.where(best_box >= 0)[0]
+        if len(idx) == 0:
+            return result
+
+        # Face of the hit from the slabs of each ray's own box: the last
+        # plane crossed on entry, or the first one on exit
+        box = best_box[idx]
+        sub_r = RayList(
+            Vec3List(r.orig.get_ndarray(idx)), Vec3List(r.dir.get_ndarray(idx))
+        )
+        t = best_t[idx]
+        point = sub_r.at(t)
+        direction = sub_r.dir.e
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_dir = 1 / direction
+            t0 = (self.lo[box] - sub_r.orig.e) * inv_dir
+            t1 = (self.hi[box] - sub_r.orig.e) * inv_dir
+        t_near = np.nan_to_num(np.fmin(t0, t1), nan=-np.inf)
+        t_far = np.nan_to_num(np.fmax(t0, t1), nan=np.inf)
+        entering = t == t_near.max(axis=1)
+        axis = np.where(
+            entering, np.argmax(t_near, axis=1), np.argmin(t_far, axis=1)
+        )
+        rows = np.arange(len(idx))
+        side = np.sign(direction[rows, axis])
+        outward_normal = Vec3List.new_zero(len(idx))
+        outward_normal.e[rows, axis] = np.where(entering, -side, side)
+
+        sub_rec = HitRecordList(
+            point, t, self.material_idx[box]
+        ).set_face_normal(sub_r, outward_normal)
+        result.p.e[idx] = sub_rec.p.e
+        result.t[idx] = t
+        result.material[idx] = sub_rec.material
+        result.normal.e[idx] = sub_rec.normal.e
+        result.front_face[idx] = sub_rec.front_face
+        return result
+
+    def occluded(self, r: RayList, t_min: float,
+                 t_max: Union[float, np.ndarray]) -> np.ndarray:
+        if traversal_stats.enabled:
+            traversal_stats.add_primitive_tests(amount=len(self))
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+        return self.closest(r, t_min, t_max)[1] >= 0
@@ -0,0 +1,89 @@
+import json
+import os
+import numpy as np  # type: ignore
+from typing import Dict, Optional
+
+
+class Checkpoint:
+    """
+    A render in progress. Its linear accumulation buffer (h, w, 4), the
+    layout of Img.accum, is memory-mapped from path.npy, so every pass
+    added is on disk once add() returns. path.json holds the settings
+    and the seed all passes draw from. How far the render got is read
+    off the buffer's own sample counts, so the two files can't disagree.
+    Files are written aside and renamed over the old ones, so a kill
+    leaves either the last pass or the one before it, never half a pass.
+    """
+    def __init__(self, path: str, accum: np.ndarray,
+                 settings: Dict[str, int]) -> None:
+        self.path = path
+        self.accum = accum
+        self.settings = settings
+        self.seed: int = settings["seed"]
+
+    @classmethod
+    def create(cls, path: str, settings: Dict[str, int],
+               seed: int) -> "Checkpoint":
+        settings = dict(settings, seed=seed)
+        # AOVs go first, a stale set must not outlive its render
+        if os.path.exists(path + "_aovs.npy"):
+            os.remove(path + "_aovs.npy")
+        accum = replace_buffer(
+            path, np.zeros((settings["height"], settings["width"], 4))
+        )
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(settings, f)
+        os.replace(path + ".json.tmp", path + ".json")
+        return cls(path, accum, settings)
+
+    @classmethod
+    def resume(cls, path: str, settings: Dict[str, int]) -> "Checkpoint":
+        with open(path + ".json") as f:
+            saved: Dict[str, int] = json.load(f)
+        changed = [
+            name for name, value in settings.items()
+            if saved.get(name) != value
+        ]
+        if changed:
+            print(f"Checkpoint {path} was rendered with other settings: "
+                  f"{', '.join(changed)}.")
+            raise ValueError
+        accum = np.lib.format.open_memmap(path + ".npy", mode="r")
+        return cls(path, accum, saved)
+
+    @staticmethod
+    def saved_seed(path: str) -> int:
+        # Known before the scene is built, so random scenes can match
+        with open(path + ".json") as f:
+            return json.load(f)["seed"]
+
+    def samples_done(self) -> int:
+        # Every pass covers the whole image, so all counts are equal
+        return int(self.accum[0, 0, 3])
+
+    def add(self, accum: np.ndarray) -> None:
+        self.accum = replace_buffer(self.path, self.accum + accum)
+
+    def save_aovs(self, aovs: np.ndarray) -> None:
+        with open(self.path + "_aovs.npy.tmp", "wb") as f:
+            np.save(f, aovs)
+        os.replace(self.path + "_aovs.npy.tmp", self.path + "_aovs.npy")
+
+    def has_aovs(self) -> bool:
+        return os.path.exists(self.path + "_aovs.npy")
+
+    def load_aovs(self) -> Optional[np.ndarray]:
+        if not self.has_aovs():
+            return None
+        return np.load(self.path + "_aovs.npy")
+
+
+def replace_buffer(path: str, accum: np.ndarray) -> np.ndarray:
+    # accum written to path.npy.tmp and renamed to path.npy, mapped
+    buffer = np.lib.format.open_memmap(
+        path + ".npy.tmp", mode="w+", dtype=np.float64, shape=accum.shape
+    )
+    buffer[...] = accum
+    buffer.flush()
+    os.replace(path + ".npy.tmp", path + ".npy")
+    return buffer
@@ -0,0 +1,80 @@
+import numpy as np  # type: ignore
+from typing import Tuple
+
+
+# B3 spline taps of the a-trous wavelet, spread 2**level pixels apart
+ATROUS_TAPS = np.array([1 / 16, 1 / 4, 3 / 8, 1 / 4, 1 / 16])
+
+
+def shifted(a: np.ndarray, dy: int, dx: int) -> np.ndarray:
+    # a moved so that pixel (y, x) holds a[y + dy, x + dx], edges repeated
+    h, w = a.shape[:2]
+    rows = np.clip(np.arange(h) + dy, 0, h - 1)
+    cols = np.clip(np.arange(w) + dx, 0, w - 1)
+    return a[rows][:, cols]
+
+
+def guide_depth(depth: np.ndarray) -> np.ndarray:
+    # Misses get a depth far beyond everything hit, so they never blend
+    # with geometry but still blend with each other
+    hit = np.isfinite(depth)
+    far = depth[hit].max() * 1e3 if hit.any() else 1
+    return np.where(hit, depth, far)
+
+
+def atrous(color: np.ndarray, albedo: np.ndarray, normal: np.ndarray,
+           depth: np.ndarray, strength: float = 1, levels: int = 5,
+           sigma_normal: float = 0.3, sigma_depth: float = 0.1,
+           eps: float = 1e-3) -> np.ndarray:
+    """
+    Edge-avoiding a-trous filter of a linear (h, w, 3) color, guided by
+    the first-hit albedo (h, w, 3), normal (h, w, 3) and depth (h, w).
+    Texture is divided out before filtering and put back after, so only
+    the lighting is smoothed. strength scales how different two lighting
+    values may be and still blend, 0 returns the color untouched.
+    """
+    if strength <= 0:
+        return color
+    albedo = np.maximum(albedo, eps)
+    lighting = color / albedo
+    depth = guide_depth(depth)
+
+    # Noise is relative to brightness, so compare lighting in log space
+    sigma_color = 0.5 * strength
+    for level in range(levels):
+        step = 2**level
+        log_lighting = np.log1p(np.maximum(lighting, 0))
+        total = np.zeros_like(lighting)
+        weight_sum = np.zeros(lighting.shape[:2], dtype=lighting.dtype)
+        for ky, wy in enumerate(ATROUS_TAPS):
+            for kx, wx in enumerate(ATROUS_TAPS):
+                dy, dx = (ky - 2) * step, (kx - 2) * step
+                q_lighting = shifted(lighting, dy, dx)
+                weight = wy * wx * edge_weight(
+                    (log_lighting, shifted(log_lighting, dy, dx)),
+                    (normal, shifted(normal, dy, dx)),
+                    (depth, shifted(depth, dy, dx)),
+                    sigma_color, sigma_normal, sigma_depth * step
+                )
+                total += q_lighting * weight[..., np.newaxis]
+                weight_sum += weight
+        lighting = total / weight_sum[..., np.newaxis]
+        # Finer detail was dealt with at the lower levels
+        sigma_color /= 2
+    return lighting * albedo
+
+
+def edge_weight(lighting: Tuple[np.ndarray, np.ndarray],
+                normal: Tuple[np.ndarray, np.ndarray],
+                depth: Tuple[np.ndarray, np.ndarray],
+                sigma_color: float, sigma_normal: float,
+                sigma_depth: float) -> np.ndarray:
+    color_distance = ((lighting[0] - lighting[1])**2).sum(axis=-1)
+    normal_distance = ((normal[0] - normal[1])**2).sum(axis=-1)
+    depth_distance = np.abs(depth[0] - depth[1]) \
+        / np.maximum(depth[0], 1e-6)
+    return np.exp(
+        -color_distance / sigma_color**2
+        - normal_distance / sigma_normal**2
+        - depth_distance / sigma_depth
+    )
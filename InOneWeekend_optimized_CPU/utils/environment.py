@@ -0,0 +1,44 @@
+import numpy as np  # type: ignore
+from PIL import Image  # type: ignore
+from utils.vec3 import Vec3List
+from utils.img import read_pfm
+
+
+class EnvironmentMap:
+    """
+    Linear radiance around the scene in an equirectangular (h, w, 3) float
+    array, +y at the top row and the longitude running along the columns.
+    A whole batch of directions is looked up with one gather.
+    """
+    def __init__(self, data: np.ndarray, scale: float = 1) -> None:
+        data = np.asarray(data, dtype=np.float32)
+        if data.ndim != 3 or data.shape[2] != 3:
+            print("Environment map needs an (h, w, 3) array.")
+            raise ValueError
+        self.data = data * np.float32(scale)
+        self.height, self.width, _ = self.data.shape
+
+    @classmethod
+    def from_file(cls, filename: str, scale: float = 1) \
+            -> "EnvironmentMap":
+        # Float data as .npy or .pfm, anything else is an 8-bit image
+        # stored with the gamma 2 encoding Img.save writes
+        if filename.endswith(".npy"):
+            return cls(np.load(filename), scale)
+        if filename.endswith(".pfm"):
+            return cls(read_pfm(filename), scale)
+        data = np.asarray(Image.open(filename).convert("RGB")) / 255
+        return cls(data**2, scale)
+
+    def lookup(self, directions: Vec3List) -> Vec3List:
+        # Nearest pixel for each unit direction
+        unit = directions.e
+        phi = np.arctan2(unit[:, 2], unit[:, 0])
+        theta = np.arcsin(np.clip(unit[:, 1], -1, 1))
+        u = 1 - (phi + np.pi) / (2 * np.pi)
+        v = (theta + np.pi/2) / np.pi
+        i = np.clip((u * self.width).astype(np.int64), 0, self.width - 1)
+        j = np.clip(
+            ((1 - v) * self.height).astype(np.int64), 0, self.height - 1
+        )
+        return Vec3List(self.data[j, i])
@@ -0,0 +1,288 @@
+import numpy as np  # type: ignore
+from typing import List, Optional, Union, Tuple, Dict
+from utils.vec3 import Point3, Vec3List
+from utils.ray import RayList
+from utils.material import Material
+from utils.hittable import Hittable, HitRecordList
+from utils.hittable_list import HittableList
+from utils.sphere import Sphere
+from utils.aabb import AABB
+from utils.stats import traversal_stats
+
+
+class UniformGrid(Hittable):
+    """
+    Spheres binned into a regular grid of cells, traversed by all rays of a
+    batch in lockstep with a 3D-DDA. Each step tests the spheres of every
+    ray's current cell at once. A per-batch mailbox skips spheres a ray
+    has already tested in an earlier cell.
+    Spheres much larger than the typical one (ground planes) and any other
+    hittables are kept in a plain list next to the grid.
+    """
+    DENSITY = 3
+    MAX_RESOLUTION = 64
+    LARGE_RADIUS_RATIO = 20
+
+    @classmethod
+    def grid_spheres(cls, objects: List[Hittable]) -> List[Sphere]:
+        # The spheres that go into the cells, all but the very large ones
+        spheres = [obj for obj in objects if isinstance(obj, Sphere)]
+        if not spheres:
+            return spheres
+        median = np.median([abs(obj.radius) for obj in spheres])
+        return [
+            obj for obj in spheres
+            if abs(obj.radius) <= cls.LARGE_RADIUS_RATIO * median
+        ]
+
+    def __init__(self, objects: List[Hittable],
+                 resolution: Optional[Tuple[int, int, int]] = None) -> None:
+        self.rest = HittableList()
+        self.materials: Dict[int, Material] = dict()
+
+        spheres = self.grid_spheres(objects)
+        for obj in objects:
+            self.materials.update(obj.get_materials())
+            if not any(obj is sphere for sphere in spheres):
+                self.rest.add(obj)
+        if not spheres:
+            print("UniformGrid needs at least one sphere.")
+            raise ValueError
+
+        self.center = np.array([obj.center.e for obj in spheres])
+        self.radius = np.array([obj.radius for obj in spheres],
+                               dtype=np.float32)
+        self.material_idx = np.array([obj.material.idx for obj in spheres],
+                                     dtype=np.int32)
+
+        abs_radius = np.abs(self.radius)[:, np.newaxis]
+        box_min = self.center - abs_radius
+        box_max = self.center + abs_radius
+        self.lo: np.ndarray = box_min.min(axis=0)
+        self.hi: np.ndarray = box_max.max(axis=0)
+        self.grid_box = AABB(Point3(*self.lo), Point3(*self.hi))
+
+        if resolution is None:
+            resolution = self.auto_resolution(len(spheres))
+        self.resolution = np.array(resolution, dtype=np.int64)
+        self.cell_size: np.ndarray = (self.hi - self.lo) / self.resolution
+
+        # Cell contents in CSR form: the spheres of flat cell i are
+        # cell_items[cell_start[i]:cell_start[i+1]]
+        cell_lo = self.cell_of(box_min)
+        cell_hi = self.cell_of(box_max)
+        cells: List[np.ndarray] = list()
+        items: List[np.ndarray] = list()
+        for i in range(len(spheres)):
+            ix, iy, iz = np.meshgrid(
+                *[np.arange(cell_lo[i, k], cell_hi[i, k] + 1)
+                  for k in range(3)],
+                indexing="ij"
+            )
+            flat = self.flat_index(
+                np.stack([ix.ravel(), iy.ravel(), iz.ravel()], axis=1)
+            )
+            cells.append(flat)
+            items.append(np.full(len(flat), i))
+        cell_array = np.concatenate(cells)
+        order = np.argsort(cell_array, kind="stable")
+        self.cell_items: np.ndarray = np.concatenate(items)[order]
+        self.cell_start: np.ndarray = np.searchsorted(
+            cell_array[order], np.arange(self.resolution.prod() + 1)
+        )
+
+    def auto_resolution(self, n: int) -> Tuple[int, int, int]:
+        # About DENSITY cells per primitive, as close to cubic as possible
+        extent = np.maximum(self.hi - self.lo, 1e-6)
+        cells_per_unit = np.cbrt(self.DENSITY * n / extent.prod())
+        resolution = np.clip(
+            np.round(extent * cells_per_unit), 1, self.MAX_RESOLUTION
+        )
+        return tuple(int(n) for n in resolution)
+
+    def cell_of(self, p: np.ndarray) -> np.ndarray:
+        cell = np.floor((p - self.lo) / self.cell_size).astype(np.int64)
+        return np.clip(cell, 0, self.resolution - 1)
+
+    def flat_index(self, cell: np.ndarray) -> np.ndarray:
+        return (
+            cell[:, 0] * self.resolution[1] + cell[:, 1]
+        ) * self.resolution[2] + cell[:, 2]
+
+    def get_materials(self) -> Dict[int, Material]:
+        return self.materials
+
+    def bounding_box(self) -> Optional[AABB]:
+        rest_box = self.rest.bounding_box()
+        if not self.rest.objects:
+            return self.grid_box
+        if rest_box is None:
+            return None
+        return AABB.surrounding_box(self.grid_box, rest_box)
+
+    def hit(self, r: RayList, t_min: float, t_max: Union[float, np.ndarray]) \
+            -> HitRecordList:
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+
+        t, sphere = self.traverse(r, t_min, t_max, False)
+        rec = HitRecordList.new_from_t(t_max.astype(np.float32))
+        idx = np.where(sphere >= 0)[0]
+        if len(idx) > 0:
+            sub_r = RayList(
+                Vec3List(r.orig.get_ndarray(idx)),
+                Vec3List(r.dir.get_ndarray(idx))
+            )
+            t = t[idx].astype(np.float32)
+            point = sub_r.at(t)
+            sphere = sphere[idx]
+            outward_normal = Vec3List(
+                (point.e - self.center[sphere])
+                / self.radius[sphere][:, np.newaxis]
+            )
+            sub_rec = HitRecordList(
+                point, t, self.material_idx[sphere]
+            ).set_face_normal(sub_r, outward_normal)
+            rec.p.e[idx] = sub_rec.p.e
+            rec.t[idx] = t
+            rec.material[idx] = sub_rec.material
+            rec.normal.e[idx] = sub_rec.normal.e
+            rec.front_face[idx] = sub_rec.front_face
+
+        if self.rest.objects:
+            rec.update(self.rest.hit(r, t_min, rec.t))
+        return rec
+
+    def occluded(self, r: RayList, t_min: float,
+                 t_max: Union[float, np.ndarray]) -> np.ndarray:
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+
+        blocked = self.traverse(r, t_min, t_max, True)[1] >= 0
+        if self.rest.objects and not blocked.all():
+            idx = np.where(~blocked)[0]
+            sub_r = RayList(
+                Vec3List(r.orig.get_ndarray(idx)),
+                Vec3List(r.dir.get_ndarray(idx))
+            )
+            if traversal_stats.enabled:
+                traversal_stats.push(idx)
+            blocked[idx] = self.rest.occluded(sub_r, t_min, t_max[idx])
+            if traversal_stats.enabled:
+                traversal_stats.pop()
+        return blocked
+
+    def traverse(self, r: RayList, t_min: float, t_max: np.ndarray,
+                 any_hit: bool) -> Tuple[np.ndarray, np.ndarray]:
+        # Closest t and sphere index per ray, -1 where nothing was hit
+        length = len(r)
+        best_t = np.full(length, np.inf)
+        best_sphere = np.full(length, -1, dtype=np.int64)
+
+        if traversal_stats.enabled:
+            traversal_stats.add_box_tests()
+        active = np.where(
+            (r.dir.length_squared() > 0)
+            & self.grid_box.hit(r, t_min, t_max)
+        )[0]
+        if len(active) == 0:
+            return best_t, best_sphere
+
+        orig = r.orig.e[active].astype(np.float64)
+        direction = r.dir.e[active].astype(np.float64)
+        t_limit = t_max[active]
+
+        # Set up the DDA at the point where each ray enters the grid
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_dir = 1 / direction
+            t0 = (self.lo - orig) * inv_dir
+            t1 = (self.hi - orig) * inv_dir
+        t_enter = np.fmax(np.fmax.reduce(np.fmin(t0, t1), axis=1), t_min)
+        cell = self.cell_of(orig + direction * t_enter[:, np.newaxis])
+        step = np.sign(direction).astype(np.int64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_delta = np.where(
+                step != 0, self.cell_size * np.abs(inv_dir), np.inf
+            )
+            boundary = self.lo + (cell + (step > 0)) * self.cell_size
+            t_next = np.where(
+                step != 0, (boundary - orig) * inv_dir, np.inf
+            )
+
+        mailbox = np.zeros((len(active), len(self.radius)), dtype=np.bool)
+        ray_t = np.full(len(active), np.inf)
+        ray_sphere = np.full(len(active), -1, dtype=np.int64)
+        alive = np.arange(len(active))
+
+        while len(alive) > 0:
+            # Gather (ray, sphere) pairs of every live ray's current cell
+            flat = self.flat_index(cell[alive])
+            start = self.cell_start[flat]
+            count = self.cell_start[flat + 1] - start
+            pair_ray = np.repeat(alive, count)
+            offset = np.arange(count.sum()) - np.repeat(
+                np.cumsum(count) - count, count
+            )
+            pair_sphere = self.cell_items[np.repeat(start, count) + offset]
+            fresh = ~mailbox[pair_ray, pair_sphere]
+            pair_ray = pair_ray[fresh]
+            pair_sphere = pair_sphere[fresh]
+            mailbox[pair_ray, pair_sphere] = True
+
+            if traversal_stats.enabled:
+                traversal_stats.add_at(0, active[alive])
+                traversal_stats.add_at(1, active[pair_ray])
+
+            if len(pair_ray) > 0:
+                t = self.intersect(
+                    orig[pair_ray], direction[pair_ray], pair_sphere,
+                    t_min, np.minimum(ray_t, t_limit)[pair_ray]
+                )
+                np.minimum.at(ray_t, pair_ray, t)
+                closest = (t < np.inf) & (t == ray_t[pair_ray])
+                ray_sphere[pair_ray[closest]] = pair_sphere[closest]
+
+            # Step every live ray into its next cell along the nearest axis
+            axis = np.argmin(t_next[alive], axis=1)
+            t_exit = t_next[alive, axis]
+            cell[alive, axis] += step[alive, axis]
+            t_next[alive, axis] += t_delta[alive, axis]
+
+            done = (
+                (ray_t[alive] <= t_exit)
+                | (t_exit > t_limit[alive])
+                | (cell[alive, axis] < 0)
+                | (cell[alive, axis] >= self.resolution[axis])
+            )
+            if any_hit:
+                done |= ray_t[alive] < np.inf
+            alive = alive[~done]
+
+        best_t[active] = ray_t
+        best_sphere[active] = ray_sphere
+        return best_t, best_sphere
+
+    def intersect(self, orig: np.ndarray, direction: np.ndarray,
+                  sphere: np.ndarray, t_min: float, t_max: np.ndarray) \
+            -> np.ndarray:
+        # Nearest root in (t_min, t_max) per pair, inf where there is none
+        oc = orig - self.center[sphere]
+        a = (direction * direction).sum(axis=1)
+        half_b = (oc * direction).sum(axis=1)
+        c = (oc * oc).sum(axis=1) - self.radius[sphere]**2
+        discriminant = half_b**2 - a*c
+        root = np.sqrt(np.maximum(discriminant, 0))
+        t_0 = (-half_b - root) / a
+        t_1 = (-half_b + root) / a
+        t = np.where((t_min < t_1) & (t_1 < t_max), t_1, np.inf)
+        t = np.where((t_min < t_0) & (t_0 < t_max), t_0, t)
+        return np.where(discriminant > 0, t, np.inf)
+
+
+def make_grid(world: HittableList,
+              resolution: Optional[Tuple[int, int, int]] = None) \
+        -> HittableList:
+    # Scenes without spheres, like the Cornell box, stay a plain list
+    if not UniformGrid.grid_spheres(world.objects):
+        return world
+    return HittableList(UniformGrid(world.objects, resolution))
@@ -1,9 +1,10 @@
 from __future__ import annotations
 import numpy as np  # type: ignore
 from abc import ABC, abstractmethod
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Dict
 from utils.vec3 import Vec3, Point3, Vec3List
 from utils.ray import Ray, RayList
+from utils.aabb import AABB
 
 import typing
 if typing.TYPE_CHECKING:
@@ -28,12 +29,17 @@ class HitRecord:
 class HitRecordList:
     def __init__(self, point: Vec3List, t: np.ndarray, mat: np.ndarray,
                  normal: Vec3List = Vec3List.new_zero(0),
-                 front_face: np.ndarray = np.array([])) -> None:
+                 front_face: np.ndarray = np.array([]),
+                 object_id: Optional[np.ndarray] = None) -> None:
         self.p = point
         self.t = t
         self.material = mat
         self.normal = normal
         self.front_face = front_face
+        # Index of the hit object in the HittableList that reported it,
+        # -1 until a list does
+        self.object_id = np.full(len(t), -1, dtype=np.int32) \
+            if object_id is None else object_id
 
     def set_face_normal(self, r: RayList, outward_normal: Vec3List) \
             -> HitRecordList:
@@ -87,6 +93,7 @@ class HitRecordList:
             np.where(change_3.e, new.normal.e, self.normal.e)
         )
         self.front_face = np.where(change, new.front_face, self.front_face)
+        self.object_id = np.where(change, new.object_id, self.object_id)
         return self
 
     @staticmethod
@@ -120,3 +127,15 @@ class Hittable(ABC):
     def hit(self, r: RayList, t_min: float, t_max: Union[float, np.ndarray]) \
             -> HitRecordList:
         return NotImplemented
+
+    @abstractmethod
+    def bounding_box(self) -> Optional[AABB]:
+        return NotImplemented
+
+    def get_materials(self) -> Dict[int, Material]:
+        return {self.material.idx: self.material}
+
+    def occluded(self, r: RayList, t_min: float,
+                 t_max: Union[float, np.ndarray]) -> np.ndarray:
+        # Any hit in (t_min, t_max) will do, override to skip the record
+        return self.hit(r, t_min, t_max).t > 0
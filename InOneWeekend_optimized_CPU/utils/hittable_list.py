@@ -4,24 +4,47 @@ from utils.vec3 import Vec3List
 from utils.ray import RayList
 from utils.material import Material
 from utils.hittable import Hittable, HitRecordList
+from utils.aabb import AABB
+from utils.stats import traversal_stats
 
 
 class HittableList(Hittable):
     def __init__(self, obj: Optional[Hittable] = None) -> None:
         self.objects: List[Hittable] = list()
         self.materials: Dict[int, Material] = dict()
+        self.box: Optional[AABB] = None
         if obj is not None:
             self.add(obj)
 
     def add(self, obj: Hittable) -> None:
         self.objects.append(obj)
-        if obj.material.idx < 0:
-            raise ValueError
-        if obj.material.idx not in self.materials:
-            self.materials[obj.material.idx] = obj.material
+        for idx, mat in obj.get_materials().items():
+            if idx < 0:
+                raise ValueError
+            if idx not in self.materials:
+                self.materials[idx] = mat
+        box = obj.bounding_box()
+        if box is None or len(self.objects) == 1:
+            self.box = box
+        elif self.box is not None:
+            self.box = AABB.surrounding_box(self.box, box)
 
     def clear(self) -> None:
         self.objects.clear()
+        self.box = None
+
+    def bounding_box(self) -> Optional[AABB]:
+        return self.box
+
+    def candidates(self, r: RayList, t_min: float, t_max: np.ndarray) \
+            -> np.ndarray:
+        # Rays missing the list's box skip every per-object test
+        condition = r.dir.length_squared() > 0
+        if self.box is not None:
+            if traversal_stats.enabled:
+                traversal_stats.add_box_tests()
+            condition &= self.box.hit(r, t_min, t_max)
+        return condition
 
     def get_materials(self) -> Dict[int, Material]:
         return self.materials
@@ -33,19 +56,54 @@ class HittableList(Hittable):
         else:
             closest_so_far = t_max
 
-        r, closest_so_far = self.compress(r, closest_so_far)
+        condition = self.candidates(r, t_min, closest_so_far)
+        if not condition.any():
+            self.idx = None
+            return HitRecordList.new_from_t(closest_so_far)
+        r, closest_so_far = self.compress(r, closest_so_far, condition)
+        counting = traversal_stats.enabled and self.idx is not None
+        if counting:
+            traversal_stats.push(self.idx)
 
         rec = HitRecordList.new_from_t(closest_so_far)
-        for obj in self.objects:
+        for k, obj in enumerate(self.objects):
             temp_rec_list: HitRecordList = obj.hit(r, t_min, closest_so_far)
+            temp_rec_list.object_id = np.full(len(r), k, dtype=np.int32)
             rec.update(temp_rec_list)
             closest_so_far = rec.t
 
+        if counting:
+            traversal_stats.pop()
         return self.decompress(rec)
 
-    def compress(self, r: RayList, closest_so_far: np.ndarray) \
-            -> Tuple[RayList, np.ndarray]:
-        condition = r.dir.length_squared() > 0
+    def occluded(self, r: RayList, t_min: float,
+                 t_max: Union[float, np.ndarray]) -> np.ndarray:
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+
+        # Rays leave the batch as soon as one object blocks them
+        condition = self.candidates(r, t_min, t_max)
+        blocked = ~condition
+        for obj in self.objects:
+            idx = np.where(~blocked)[0]
+            if len(idx) == 0:
+                break
+            if len(idx) == len(r):
+                blocked = obj.occluded(r, t_min, t_max)
+                continue
+            if traversal_stats.enabled:
+                traversal_stats.push(idx)
+            sub_r = RayList(
+                Vec3List(r.orig.get_ndarray(idx)),
+                Vec3List(r.dir.get_ndarray(idx))
+            )
+            blocked[idx] = obj.occluded(sub_r, t_min, t_max[idx])
+            if traversal_stats.enabled:
+                traversal_stats.pop()
+        return blocked & condition
+
+    def compress(self, r: RayList, closest_so_far: np.ndarray,
+                 condition: np.ndarray) -> Tuple[RayList, np.ndarray]:
         full_rate = condition.sum() / len(r)
         if full_rate > 0.6:
             self.idx = None
@@ -70,4 +128,5 @@ class HittableList(Hittable):
         new_rec.material[self.idx] = rec.material[old_idx]
         new_rec.normal.e[self.idx] = rec.normal.e[old_idx]
         new_rec.front_face[self.idx] = rec.front_face[old_idx]
+        new_rec.object_id[self.idx] = rec.object_id[old_idx]
         return new_rec
@@ -1,17 +1,60 @@
 from __future__ import annotations
 import numpy as np  # type: ignore
 from PIL import Image  # type: ignore
-from typing import List
+from typing import List, Optional
 from utils.vec3 import Color, Vec3List
 
 
+# Black - blue - green - yellow - red ramp for false color images
+HEAT_STOPS = np.array([0, 0.25, 0.5, 0.75, 1])
+HEAT_COLORS = np.array([
+    [0, 0, 0], [0, 0, 1], [0, 1, 0], [1, 1, 0], [1, 0, 0]
+], dtype=np.float32)
+
+
+def write_pfm(path: str, data: np.ndarray) -> None:
+    # Little-endian float32 rows, stored bottom to top
+    h, w = data.shape[:2]
+    color = data.ndim == 3
+    with open(path, "wb") as f:
+        f.write(f"{'PF' if color else 'Pf'}\n{w} {h}\n-1.0\n".encode())
+        f.write(np.ascontiguousarray(
+            data[::-1], dtype="<f4"
+        ).tobytes())
+
+
+def read_pfm(path: str) -> np.ndarray:
+    with open(path, "rb") as f:
+        kind = f.readline().strip()
+        if kind not in (b"PF", b"Pf"):
+            print(f"{path} is not a PFM file.")
+            raise ValueError
+        w, h = (int(n) for n in f.readline().split())
+        scale = float(f.readline())
+        dtype = "<f4" if scale < 0 else ">f4"
+        data = np.frombuffer(f.read(), dtype=dtype)
+    shape = (h, w, 3) if kind == b"PF" else (h, w)
+    return data.reshape(shape)[::-1].astype(np.float32)
+
+
 class Img:
+    """
+    Radiance is accumulated linearly, as per pixel color sums and sample
+    counts in accum (h, w, 4), so renders can be saved, merged and
+    extended losslessly. The sums are float64, float32 would lose the
+    late samples of a long render. frame holds what save() writes,
+    filled by encode() or set_array().
+    """
     def __init__(self, w: int, h: int) -> None:
         self.frame: np.ndarray = np.empty((h, w, 3), dtype=np.float32)
+        self.accum: np.ndarray = np.zeros((h, w, 4), dtype=np.float64)
 
     def set_array(self, array: np.ndarray) -> None:
         self.frame = array
 
+    def set_accumulation(self, accum: np.ndarray) -> None:
+        self.accum = accum
+
     def write_pixel(self, w: int, h: int, pixel_color: Color,
                     samples_per_pixel: int) -> None:
         color: Color = pixel_color / samples_per_pixel
@@ -23,6 +66,61 @@ class Img:
         gamma: float = 2
         self.frame[h] = np.clip(color, 0, 0.999) ** (1 / gamma)
 
+    def add_pixel_list(self, h: int, pixel_color_list: Vec3List,
+                       samples: int) -> None:
+        # pixel_color_list holds the sums over the samples
+        self.accum[h, :, :3] += pixel_color_list.e
+        self.accum[h, :, 3] += samples
+
+    def merge(self, other: Img) -> None:
+        self.accum += other.accum
+
+    def linear(self) -> np.ndarray:
+        # Mean radiance, black where nothing was sampled yet
+        count = self.accum[..., 3:]
+        return (
+            self.accum[..., :3] / np.where(count > 0, count, 1)
+        ).astype(np.float32)
+
+    def encode(self, color: Optional[np.ndarray] = None,
+               exposure: float = 1) -> None:
+        # Tone map linear color (the accumulated mean by default) into
+        # frame: exposure, clamp and gamma 2
+        if color is None:
+            color = self.linear()
+        gamma: float = 2
+        self.frame = np.clip(color * exposure, 0, 0.999) ** (1 / gamma)
+
+    def save_linear(self, path: str) -> None:
+        # .npy keeps the sums and counts, .pfm only the mean radiance
+        if path.endswith(".pfm"):
+            write_pfm(path, self.linear())
+        else:
+            np.save(path, self.accum)
+
+    @staticmethod
+    def load_linear(path: str) -> Img:
+        # A .pfm comes back as one sample per pixel, gray as equal RGB
+        if path.endswith(".pfm"):
+            color = read_pfm(path)
+            if color.ndim == 2:
+                color = np.repeat(color[..., np.newaxis], 3, axis=-1)
+            accum = np.concatenate(
+                [color, np.ones(color.shape[:2] + (1,))], axis=-1
+            )
+        else:
+            accum = np.load(path)
+        img = Img(accum.shape[1], accum.shape[0])
+        img.set_accumulation(accum)
+        return img
+
+    def set_false_color(self, values: np.ndarray) -> None:
+        peak = values.max()
+        scaled = values / peak if peak > 0 else values
+        self.frame = np.stack([
+            np.interp(scaled, HEAT_STOPS, HEAT_COLORS[:, c]) for c in range(3)
+        ], axis=-1)
+
     def save(self, path: str, show: bool = False) -> None:
         im = Image.fromarray(np.uint8(self.frame * 255))
         im.save(path)
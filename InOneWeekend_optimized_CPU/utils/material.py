@@ -5,9 +5,12 @@ from utils.ray import RayList
 from utils.vec3 import Vec3, Color, Vec3List
 from utils.hittable import HitRecordList
 from utils.rtweekend import random_float_list
+from utils.onb import ONBList
 
 
 class Material(ABC):
+    emissive = False
+
     @abstractmethod
     def __init__(self, idx: int) -> None:
         self.idx = idx
@@ -17,24 +20,50 @@ class Material(ABC):
             -> Tuple[RayList, Vec3List]:
         return NotImplemented
 
+    def albedo_value(self) -> Color:
+        # Surface color, the texture a denoiser keeps sharp
+        return Color(1, 1, 1)
+
+    def sample(self, r_in: RayList, rec: HitRecordList) \
+            -> Optional[Tuple[Vec3List, np.ndarray, Vec3List]]:
+        # Scattered directions with their pdf and bsdf value (times the
+        # cosine), all zero where nothing scatters. None when the material
+        # only has scatter().
+        return None
+
+    def scatter_sample(self, r_in: RayList, rec: HitRecordList) \
+            -> Tuple[RayList, Vec3List]:
+        # scatter() for materials implementing sample()
+        direction, pdf, f = self.sample(r_in, rec)
+        condition = pdf > 0
+        scattered = RayList(rec.p.mul_ndarray(condition), direction)
+        attenuation = f.div_ndarray(np.where(condition, pdf, 1))
+        return scattered, attenuation
+
 
 class Lambertian(Material):
     def __init__(self, a: Color, idx: int) -> None:
         self.albedo = a
         self.idx = idx
 
+    def albedo_value(self) -> Color:
+        return self.albedo
+
     def scatter(self, r_in: RayList, rec: HitRecordList) \
             -> Tuple[RayList, Vec3List]:
-        condition = (rec.t > 0) & rec.front_face
+        return self.scatter_sample(r_in, rec)
 
-        scatter_direction = rec.normal + Vec3.random_unit_vector(len(r_in))
-        scattered = RayList(
-            rec.p.mul_ndarray(condition),
-            scatter_direction.mul_ndarray(condition)
+    def sample(self, r_in: RayList, rec: HitRecordList) \
+            -> Optional[Tuple[Vec3List, np.ndarray, Vec3List]]:
+        direction = ONBList(rec.normal).local(
+            Vec3.random_cosine_direction(len(r_in))
         )
-        attenuation = Vec3List.from_array(condition) * self.albedo
+        cosine = direction @ rec.normal
+        condition = (rec.t > 0) & rec.front_face & (cosine > 0)
 
-        return scattered, attenuation
+        pdf = np.where(condition, cosine / np.pi, 0)
+        f = Vec3List.from_array(pdf) * self.albedo
+        return direction.mul_ndarray(condition), pdf, f
 
 
 class Hemisphere(Material):
@@ -42,18 +71,23 @@ class Hemisphere(Material):
         self.albedo = a
         self.idx = idx
 
+    def albedo_value(self) -> Color:
+        return self.albedo
+
     def scatter(self, r_in: RayList, rec: HitRecordList) \
             -> Tuple[RayList, Vec3List]:
-        condition = (rec.t > 0) & rec.front_face
+        return self.scatter_sample(r_in, rec)
 
-        scatter_direction = Vec3.random_in_hemisphere(rec.normal)
-        scattered = RayList(
-            rec.p.mul_ndarray(condition),
-            scatter_direction.mul_ndarray(condition)
-        )
-        attenuation = Vec3List.from_array(condition) * self.albedo
+    def sample(self, r_in: RayList, rec: HitRecordList) \
+            -> Optional[Tuple[Vec3List, np.ndarray, Vec3List]]:
+        # Uniform directions weighted by a flat albedo / 2 pi, which
+        # keeps the plain albedo as attenuation
+        condition = (rec.t > 0) & rec.front_face
+        direction = Vec3.random_in_hemisphere(rec.normal).unit_vector()
 
-        return scattered, attenuation
+        pdf = np.where(condition, 1 / (2 * np.pi), 0)
+        f = Vec3List.from_array(pdf) * self.albedo
+        return direction.mul_ndarray(condition), pdf, f
 
 
 class Metal(Material):
@@ -62,6 +96,9 @@ class Metal(Material):
         self.fuzz = f if f < 1 else 1
         self.idx = idx
 
+    def albedo_value(self) -> Color:
+        return self.albedo
+
     def scatter(self, r_in: RayList, rec: HitRecordList) \
             -> Tuple[RayList, Vec3List]:
         condition = (rec.t > 0) & rec.front_face
@@ -125,3 +162,19 @@ class Dielectric(Material):
         r0 = (1 - ref_idx) / (1 + ref_idx)
         r0 **= 2
         return r0 + (1 - r0) * ((1 - cosine) ** 5)
+
+
+class DiffuseLight(Material):
+    emissive = True
+
+    def __init__(self, emit: Color, idx: int) -> None:
+        self.emit = emit
+        self.idx = idx
+
+    def scatter(self, r_in: RayList, rec: HitRecordList) \
+            -> Tuple[RayList, Vec3List]:
+        return RayList.new_zero(len(r_in)), Vec3List.new_zero(len(r_in))
+
+    def emitted(self, rec: HitRecordList) -> Vec3List:
+        condition = (rec.t > 0) & (rec.material == self.idx)
+        return Vec3List.from_array(condition) * self.emit
@@ -0,0 +1,410 @@
+from __future__ import annotations
+import os
+import struct
+import numpy as np  # type: ignore
+from typing import List, Optional, Union, Tuple
+from utils.vec3 import Point3, Vec3List
+from utils.ray import RayList
+from utils.material import Material
+from utils.hittable import Hittable, HitRecordList
+from utils.aabb import AABB
+from utils.stats import traversal_stats
+
+
+def load_obj(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                                 np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Read a Wavefront OBJ file into packed arrays: vertices, normals, uvs
+    and the (m, 3) vertex, normal and uv indices of each triangle, -1 where
+    a face has no normal or uv. Polygons are split into triangle fans.
+    """
+    vertices: List[List[float]] = list()
+    normals: List[List[float]] = list()
+    uvs: List[List[float]] = list()
+    corners: List[List[int]] = list()
+
+    def index(token: str, count: int) -> int:
+        # OBJ counts from 1, negative values count back from the end
+        if not token:
+            return -1
+        i = int(token)
+        return i - 1 if i > 0 else count + i
+
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "v":
+                vertices.append([float(x) for x in fields[1:4]])
+            elif fields[0] == "vn":
+                normals.append([float(x) for x in fields[1:4]])
+            elif fields[0] == "vt":
+                uvs.append([float(x) for x in fields[1:3]])
+            elif fields[0] == "f":
+                polygon: List[List[int]] = list()
+                for field in fields[1:]:
+                    parts = (field.split("/") + ["", ""])[:3]
+                    polygon.append([
+                        index(parts[0], len(vertices)),
+                        index(parts[2], len(normals)),
+                        index(parts[1], len(uvs)),
+                    ])
+                for k in range(1, len(polygon) - 1):
+                    corners.extend(
+                        (polygon[0], polygon[k], polygon[k+1])
+                    )
+
+    if not corners:
+        print(f"No faces in {path}.")
+        raise ValueError
+    face_data = np.array(corners, dtype=np.int32).reshape(-1, 3, 3)
+    return (
+        np.array(vertices, dtype=np.float32).reshape(-1, 3),
+        np.array(normals, dtype=np.float32).reshape(-1, 3),
+        np.array(uvs, dtype=np.float32).reshape(-1, 2),
+        np.ascontiguousarray(face_data[:, :, 0]),
+        np.ascontiguousarray(face_data[:, :, 1]),
+        np.ascontiguousarray(face_data[:, :, 2]),
+    )
+
+
+class TriangleMesh(Hittable):
+    """
+    Triangles kept as packed vertex and index arrays with a BVH of their
+    own. A batch of rays walks the BVH together: each node gets the subset
+    of rays that reached it, and a leaf runs Moller-Trumbore on that subset
+    against all of its triangles at once.
+    The faces are stored in BVH order, leaves cover contiguous ranges.
+    """
+    LEAF_SIZE = 32
+    EPSILON = 1e-8
+
+    def __init__(self, vertices: np.ndarray, faces: np.ndarray,
+                 mat: Material,
+                 normals: Optional[np.ndarray] = None,
+                 normal_faces: Optional[np.ndarray] = None,
+                 uvs: Optional[np.ndarray] = None,
+                 uv_faces: Optional[np.ndarray] = None,
+                 bvh: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+                 = None) -> None:
+        self.material = mat
+        self.vertices = vertices
+        self.faces = faces
+        self.normals = np.zeros((0, 3), dtype=np.float32) \
+            if normals is None else normals
+        self.normal_faces = np.full(faces.shape, -1, dtype=np.int32) \
+            if normal_faces is None else normal_faces
+        self.uvs = np.zeros((0, 2), dtype=np.float32) \
+            if uvs is None else uvs
+        self.uv_faces = np.full(faces.shape, -1, dtype=np.int32) \
+            if uv_faces is None else uv_faces
+
+        # Nodes: box min, box max and (first child or first face,
+        # face count, split axis). Leaves have a non-zero face count.
+        if bvh is None:
+            bvh = self.build_bvh()
+        self.node_lo, self.node_hi, self.node_data = bvh
+        self.smooth = bool((self.normal_faces >= 0).all()) \
+            and len(self.normals) > 0
+
+    @staticmethod
+    def from_obj(path: str, mat: Material,
+                 cache_path: Optional[str] = None) -> TriangleMesh:
+        # With a cache path, reuse the binary mesh unless the OBJ is newer
+        if cache_path is not None and os.path.exists(cache_path) \
+                and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+            return load_mesh(cache_path, mat)
+
+        vertices, normals, uvs, faces, normal_faces, uv_faces = \
+            load_obj(path)
+        mesh = TriangleMesh(
+            vertices, faces, mat, normals, normal_faces, uvs, uv_faces
+        )
+        if cache_path is not None:
+            save_mesh(mesh, cache_path)
+        return mesh
+
+    def __len__(self) -> int:
+        return len(self.faces)
+
+    def build_bvh(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Median split along the widest centroid extent. Reorders the faces.
+        corners = self.vertices[self.faces]
+        tri_lo = corners.min(axis=1)
+        tri_hi = corners.max(axis=1)
+        centroid = corners.mean(axis=1)
+        order = np.arange(len(self.faces))
+
+        node_lo: List[np.ndarray] = [tri_lo.min(axis=0)]
+        node_hi: List[np.ndarray] = [tri_hi.max(axis=0)]
+        node_data: List[List[int]] = [[0, len(order), 0]]
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            start, count, _ = node_data[node]
+            if count <= self.LEAF_SIZE:
+                continue
+            items = order[start:start+count]
+            extent = centroid[items].max(axis=0) - centroid[items].min(axis=0)
+            axis = int(np.argmax(extent))
+            half = count // 2
+            split = np.argpartition(centroid[items, axis], half)
+            order[start:start+count] = items[split]
+
+            left = len(node_data)
+            node_data[node] = [left, 0, axis]
+            for child_start, child_count in ((start, half),
+                                             (start + half, count - half)):
+                child_items = order[child_start:child_start+child_count]
+                node_lo.append(tri_lo[child_items].min(axis=0))
+                node_hi.append(tri_hi[child_items].max(axis=0))
+                node_data.append([child_start, child_count, 0])
+                stack.append(len(node_data) - 1)
+
+        self.faces = self.faces[order]
+        self.normal_faces = self.normal_faces[order]
+        self.uv_faces = self.uv_faces[order]
+        return (
+            np.array(node_lo, dtype=np.float32),
+            np.array(node_hi, dtype=np.float32),
+            np.array(node_data, dtype=np.int32),
+        )
+
+    def bounding_box(self) -> Optional[AABB]:
+        return AABB(Point3(*self.node_lo[0]), Point3(*self.node_hi[0]))
+
+    def box_hit(self, node: int, orig: np.ndarray, inv_dir: np.ndarray,
+                t_min: float, t_max: np.ndarray) -> np.ndarray:
+        with np.errstate(invalid="ignore"):
+            t0 = (self.node_lo[node] - orig) * inv_dir
+            t1 = (self.node_hi[node] - orig) * inv_dir
+        t_near = np.fmax(np.fmax.reduce(np.fmin(t0, t1), axis=1), t_min)
+        t_far = np.fmin(np.fmin.reduce(np.fmax(t0, t1), axis=1), t_max)
+        return t_near <= t_far
+
+    def edges(self, faces: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # First vertex and the two edges from it, gathered on demand so a
+        # memory-mapped mesh is never copied whole
+        corners = self.vertices[faces]
+        return (
+            corners[:, 0],
+            corners[:, 1] - corners[:, 0],
+            corners[:, 2] - corners[:, 0],
+        )
+
+    def intersect(self, orig: np.ndarray, direction: np.ndarray,
+                  start: int, count: int, t_min: float,
+                  t_max: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Moller-Trumbore for rays (n, 3) x faces[start:start+count],
+        # returns the nearest t (inf on a miss), face, u and v per ray
+        v0, e1, e2 = self.edges(self.faces[start:start+count])
+        dx, dy, dz = (direction[:, k, np.newaxis] for k in range(3))
+        e1x, e1y, e1z = e1.T
+        e2x, e2y, e2z = e2.T
+
+        px = dy*e2z - dz*e2y
+        py = dz*e2x - dx*e2z
+        pz = dx*e2y - dy*e2x
+        det = e1x*px + e1y*py + e1z*pz
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_det = 1 / det
+            sx, sy, sz = (orig[:, k, np.newaxis] - v0[:, k] for k in range(3))
+            u = (sx*px + sy*py + sz*pz) * inv_det
+            qx = sy*e1z - sz*e1y
+            qy = sz*e1x - sx*e1z
+            qz = sx*e1y - sy*e1x
+            v = (dx*qx + dy*qy + dz*qz) * inv_det
+            t = (e2x*qx + e2y*qy + e2z*qz) * inv_det
+            valid = (
+                (np.abs(det) > self.EPSILON)
+                & (u >= 0) & (v >= 0) & (u + v <= 1)
+                & (t >= t_min) & (t <= t_max[:, np.newaxis])
+            )
+        t = np.where(valid, t, np.inf)
+        i = np.argmin(t, axis=1)
+        rows = np.arange(len(orig))
+        return t[rows, i], start + i, u[rows, i], v[rows, i]
+
+    def traverse(self, r: RayList, t_min: float, t_max: np.ndarray,
+                 any_hit: bool = False) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        length = len(r)
+        orig = r.orig.e
+        direction = r.dir.e
+        with np.errstate(divide="ignore"):
+            inv_dir = 1 / direction
+        best_t = np.full(length, np.inf, dtype=np.float32)
+        best_face = np.full(length, -1, dtype=np.int64)
+        best_u = np.zeros(length, dtype=np.float32)
+        best_v = np.zeros(length, dtype=np.float32)
+
+        stack: List[Tuple[int, np.ndarray]] = [
+            (0, np.where(r.dir.length_squared() > 0)[0])
+        ]
+        while stack:
+            node, idx = stack.pop()
+            if any_hit:
+                idx = idx[best_face[idx] < 0]
+            if len(idx) == 0:
+                continue
+            limit = np.minimum(best_t[idx], t_max[idx])
+            if traversal_stats.enabled:
+                traversal_stats.add_box_tests(idx)
+            idx = idx[self.box_hit(
+                node, orig[idx], inv_dir[idx], t_min, limit
+            )]
+            if len(idx) == 0:
+                continue
+
+            first, count, axis = self.node_data[node]
+            if count == 0:
+                # Visit the child nearer along the rays' mean direction first
+                if direction[idx, axis].sum() >= 0:
+                    stack.extend(((first + 1, idx), (first, idx)))
+                else:
+                    stack.extend(((first, idx), (first + 1, idx)))
+                continue
+
+            if traversal_stats.enabled:
+                traversal_stats.add_primitive_tests(idx, amount=int(count))
+            t, face, u, v = self.intersect(
+                orig[idx], direction[idx], first, count, t_min,
+                np.minimum(best_t[idx], t_max[idx])
+            )
+            closer = t < best_t[idx]
+            idx = idx[closer]
+            best_t[idx] = t[closer]
+            best_face[idx] = face[closer]
+            best_u[idx] = u[closer]
+            best_v[idx] = v[closer]
+        return best_t, best_face, best_u, best_v
+
+    def hit(self, r: RayList, t_min: float, t_max: Union[float, np.ndarray]) \
+            -> HitRecordList:
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+
+        result = HitRecordList.new(len(r))
+        best_t, best_face, best_u, best_v = self.traverse(r, t_min, t_max)
+        idx = np.where(best_face >= 0)[0]
+        if len(idx) == 0:
+            return result
+
+        face = best_face[idx]
+        sub_r = RayList(
+            Vec3List(r.orig.get_ndarray(idx)), Vec3List(r.dir.get_ndarray(idx))
+        )
+        t = best_t[idx]
+        if self.smooth:
+            u = best_u[idx, np.newaxis]
+            v = best_v[idx, np.newaxis]
+            n = self.normals[self.normal_faces[face]]
+            normal = (1 - u - v) * n[:, 0] + u * n[:, 1] + v * n[:, 2]
+        else:
+            _, e1, e2 = self.edges(self.faces[face])
+            normal = np.cross(e1, e2)
+        outward_normal = Vec3List(normal).unit_vector()
+
+        sub_rec = HitRecordList(
+            sub_r.at(t), t, np.full(len(idx), self.material.idx)
+        ).set_face_normal(sub_r, outward_normal)
+        result.p.e[idx] = sub_rec.p.e
+        result.t[idx] = t
+        result.material[idx] = sub_rec.material
+        result.normal.e[idx] = sub_rec.normal.e
+        result.front_face[idx] = sub_rec.front_face
+        return result
+
+    def occluded(self, r: RayList, t_min: float,
+                 t_max: Union[float, np.ndarray]) -> np.ndarray:
+        if isinstance(t_max, (int, float, np.floating)):
+            t_max = np.full(len(r), t_max)
+        return self.traverse(r, t_min, t_max, any_hit=True)[1] >= 0
+
+
+# Binary mesh file: a little-endian header, then the blocks below in this
+# order, each starting on a BLOCK_ALIGN boundary. Block shapes come from
+# the header counts; a node count of 0 means the BVH was left out.
+MESH_MAGIC = b"RTMESH\x00\x01"
+MESH_HEADER = struct.Struct("<8s6q")
+BLOCK_ALIGN = 64
+MESH_BLOCKS = (
+    # name, dtype, columns, header count
+    ("vertices", "<f4", 3, 0),
+    ("normals", "<f4", 3, 1),
+    ("uvs", "<f4", 2, 2),
+    ("faces", "<i4", 3, 3),
+    ("normal_faces", "<i4", 3, 3),
+    ("uv_faces", "<i4", 3, 3),
+    ("node_lo", "<f4", 3, 4),
+    ("node_hi", "<f4", 3, 4),
+    ("node_data", "<i4", 3, 4),
+)
+
+
+def block_offsets(counts: Tuple[int, ...]) -> List[int]:
+    offsets: List[int] = list()
+    offset = MESH_HEADER.size
+    for _, dtype, columns, count in MESH_BLOCKS:
+        offset = -(-offset // BLOCK_ALIGN) * BLOCK_ALIGN
+        offsets.append(offset)
+        offset += counts[count] * columns * np.dtype(dtype).itemsize
+    return offsets
+
+
+def save_mesh(mesh: TriangleMesh, path: str,
+              include_bvh: bool = True) -> None:
+    counts = (
+        len(mesh.vertices), len(mesh.normals), len(mesh.uvs), len(mesh),
+        len(mesh.node_data) if include_bvh else 0
+    )
+    with open(path, "wb") as f:
+        f.write(MESH_HEADER.pack(MESH_MAGIC, *counts, 0))
+        for (name, dtype, _, count), offset in zip(
+            MESH_BLOCKS, block_offsets(counts)
+        ):
+            if counts[count] == 0:
+                continue
+            f.write(b"\x00" * (offset - f.tell()))
+            f.write(np.ascontiguousarray(
+                getattr(mesh, name), dtype=dtype
+            ).tobytes())
+
+
+def load_mesh(path: str, mat: Material) -> TriangleMesh:
+    """
+    Map a mesh saved by save_mesh without parsing or copying it. The
+    blocks are read-only views of the file, so worker processes mapping
+    the same file share its pages.
+    """
+    with open(path, "rb") as f:
+        header = f.read(MESH_HEADER.size)
+    if len(header) < MESH_HEADER.size \
+            or MESH_HEADER.unpack(header)[0] != MESH_MAGIC:
+        print(f"{path} is not a mesh file.")
+        raise ValueError
+    counts = MESH_HEADER.unpack(header)[1:6]
+
+    blocks = dict()
+    for (name, dtype, columns, count), offset in zip(
+        MESH_BLOCKS, block_offsets(counts)
+    ):
+        if counts[count] == 0:
+            blocks[name] = np.zeros((0, columns), dtype=dtype)
+            continue
+        blocks[name] = np.memmap(
+            path, dtype=dtype, mode="r", offset=offset,
+            shape=(counts[count], columns)
+        )
+
+    bvh = None
+    if counts[4] > 0:
+        bvh = (blocks["node_lo"], blocks["node_hi"], blocks["node_data"])
+    return TriangleMesh(
+        blocks["vertices"], blocks["faces"], mat,
+        blocks["normals"], blocks["normal_faces"],
+        blocks["uvs"], blocks["uv_faces"], bvh
+    )
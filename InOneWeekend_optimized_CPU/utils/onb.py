@@ -0,0 +1,23 @@
+import numpy as np  # type: ignore
+from utils.vec3 import Vec3List
+
+
+class ONBList:
+    """
+    One orthonormal basis around each vector of a Vec3List, for turning
+    directions sampled around the z axis into directions around normals.
+    """
+    def __init__(self, n: Vec3List) -> None:
+        self.w = n.unit_vector()
+        a = np.zeros_like(self.w.e)
+        helper_y = np.abs(self.w.x()) > 0.9
+        a[helper_y, 1] = 1
+        a[~helper_y, 0] = 1
+        self.v = Vec3List(np.cross(self.w.e, a)).unit_vector()
+        self.u = Vec3List(np.cross(self.w.e, self.v.e))
+
+    def local(self, a: Vec3List) -> Vec3List:
+        return (
+            self.u.mul_ndarray(a.x()) + self.v.mul_ndarray(a.y())
+            + self.w.mul_ndarray(a.z())
+        )
@@ -0,0 +1,63 @@
+import numpy as np  # type: ignore
+from utils.vec3 import Vec3List
+from utils.ray import RayList
+
+
+# Coherence sorting, kept for experiments. bench_ray_sort.py finds no
+# batch size where it pays off, with the flat list or the grid. The list
+# tests every ray against every sphere and the grid steps all rays in
+# lockstep, so ray order changes neither the work done nor, with scene
+# arrays this small, its memory locality. The sort is pure overhead.
+MORTON_BITS = 10
+
+
+def spread_bits(a: np.ndarray) -> np.ndarray:
+    # Insert two zero bits between each of the lower 10 bits
+    a = a.astype(np.uint32) & 0x000003ff
+    a = (a | (a << 16)) & 0xff0000ff
+    a = (a | (a << 8)) & 0x0300f00f
+    a = (a | (a << 4)) & 0x030c30c3
+    a = (a | (a << 2)) & 0x09249249
+    return a
+
+
+def morton_code(p: np.ndarray) -> np.ndarray:
+    lo = p.min(axis=0)
+    extent = p.max(axis=0) - lo
+    extent = np.where(extent > 0, extent, 1)
+    q = ((p - lo) / extent * (2**MORTON_BITS - 1)).astype(np.uint32)
+    return (
+        (spread_bits(q[:, 0]) << 2)
+        | (spread_bits(q[:, 1]) << 1)
+        | spread_bits(q[:, 2])
+    ).astype(np.uint64)
+
+
+def ray_sort_key(r: RayList) -> np.ndarray:
+    # Direction octant in the high bits, origin Morton code in the low ones
+    octant = (
+        ((r.dir.e[:, 0] < 0) << 2)
+        | ((r.dir.e[:, 1] < 0) << 1)
+        | (r.dir.e[:, 2] < 0)
+    ).astype(np.uint64)
+    key = (octant << 3*MORTON_BITS) | morton_code(r.orig.e)
+    # Terminated rays gather at the end, out of the way
+    dead = r.dir.length_squared() == 0
+    return np.where(dead, np.uint64(1 << (3*MORTON_BITS + 3)), key)
+
+
+def ray_order(r: RayList) -> np.ndarray:
+    return np.argsort(ray_sort_key(r), kind="stable")
+
+
+def permute(r: RayList, order: np.ndarray) -> RayList:
+    return RayList(
+        Vec3List(r.orig.get_ndarray(order)),
+        Vec3List(r.dir.get_ndarray(order))
+    )
+
+
+def unpermute(a: Vec3List, order: np.ndarray) -> Vec3List:
+    result = Vec3List.new_empty(len(a))
+    result.e[order] = a.e
+    return result
@@ -1,9 +1,11 @@
 import numpy as np  # type: ignore
-from typing import Optional, Union, List
+from typing import Optional, Union, Tuple
 from utils.vec3 import Vec3, Point3, Vec3List
 from utils.ray import RayList
 from utils.hittable import Hittable, HitRecordList
 from utils.material import Material
+from utils.aabb import AABB
+from utils.stats import traversal_stats
 
 
 class Sphere(Hittable):
@@ -14,44 +16,79 @@ class Sphere(Hittable):
 
     def hit(self, r: RayList, t_min: float, t_max: Union[float, np.ndarray]) \
             -> HitRecordList:
-        if isinstance(t_max, (int, float, np.floating)):
-            t_max_list = np.full(len(r), t_max)
-        else:
-            t_max_list = t_max
-
-        oc: Vec3List = r.origin() - self.center
-        a: np.ndarray = r.direction().length_squared()
-        half_b: np.ndarray = oc @ r.direction()
-        c: np.ndarray = oc.length_squared() - self.radius**2
-        discriminant_list: np.ndarray = half_b**2 - a*c
+        if traversal_stats.enabled:
+            traversal_stats.add_primitive_tests()
 
-        discriminant_condition = discriminant_list > 0
-        if not discriminant_condition.any():
-            return HitRecordList.new(len(r))
+        result = HitRecordList.new(len(r))
+        idx, t = self.candidates(r, t_min, t_max)
+        if len(idx) == 0:
+            return result
 
-        positive_discriminant_list = (
-            discriminant_list * discriminant_condition
+        # Attributes only for the few rays that actually hit
+        sub_r = RayList(
+            Vec3List(r.orig.get_ndarray(idx)), Vec3List(r.dir.get_ndarray(idx))
         )
-        root = np.sqrt(positive_discriminant_list)
-        non_zero_a = a - (a == 0)
-        t_0 = (-half_b - root) / non_zero_a
-        t_1 = (-half_b + root) / non_zero_a
+        point = sub_r.at(t)
+        outward_normal = (point - self.center) / self.radius
+        sub_rec = HitRecordList(
+            point, t, np.full(len(idx), self.material.idx)
+        ).set_face_normal(sub_r, outward_normal)
 
-        t_0_condition = (
-            (t_min < t_0) & (t_0 < t_max_list) & discriminant_condition
-        )
-        t_1_condition = (
-            (t_min < t_1) & (t_1 < t_max_list)
-            & (~t_0_condition) & discriminant_condition
-        )
-        t = np.where(t_0_condition, t_0, 0)
-        t = np.where(t_1_condition, t_1, t)
+        result.p.e[idx] = sub_rec.p.e
+        result.t[idx] = t
+        result.material[idx] = self.material.idx
+        result.normal.e[idx] = sub_rec.normal.e
+        result.front_face[idx] = sub_rec.front_face
+        return result
 
-        point = r.at(t)
-        outward_normal = (point - self.center) / self.radius
+    def candidates(self, r: RayList, t_min: float,
+                   t_max: Union[float, np.ndarray]) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        # Indices of the rays hitting the sphere in (t_min, t_max) and
+        # their nearest t. The discriminant is taken column by column over
+        # the whole batch, the roots only for the rays passing within the
+        # radius of the center.
+        orig = r.orig.e
+        direction = r.dir.e
+        ox = orig[:, 0] - self.center.e[0]
+        oy = orig[:, 1] - self.center.e[1]
+        oz = orig[:, 2] - self.center.e[2]
+        dx, dy, dz = direction[:, 0], direction[:, 1], direction[:, 2]
+        a: np.ndarray = dx*dx + dy*dy + dz*dz
+        half_b: np.ndarray = ox*dx + oy*dy + oz*dz
+        c: np.ndarray = ox*ox + oy*oy + oz*oz - self.radius**2
+        discriminant_list: np.ndarray = half_b**2 - a*c
 
-        result = HitRecordList(
-            point, t, np.full(len(r), self.material.idx)
-        ).set_face_normal(r, outward_normal)
+        idx = np.where(discriminant_list > 0)[0]
+        if len(idx) == 0:
+            return idx, discriminant_list[idx]
+        if not isinstance(t_max, (int, float, np.floating)):
+            t_max = t_max[idx]
 
-        return result
+        a = a[idx]
+        half_b = half_b[idx]
+        root = np.sqrt(discriminant_list[idx])
+        t_0 = (-half_b - root) / a
+        t_1 = (-half_b + root) / a
+        t = np.where((t_min < t_0) & (t_0 < t_max), t_0, 0)
+        t = np.where((t == 0) & (t_min < t_1) & (t_1 < t_max), t_1, t)
+
+        hit = t > 0
+        return idx[hit], t[hit]
+
+    def bounding_box(self) -> Optional[AABB]:
+        # Hollow glass spheres use a negative radius
+        radius_vec = Vec3(*[abs(self.radius)]*3)
+        return AABB(
+            self.center - radius_vec,
+            self.center + radius_vec
+        )
+
+    def occluded(self, r: RayList, t_min: float,
+                 t_max: Union[float, np.ndarray]) -> np.ndarray:
+        if traversal_stats.enabled:
+            traversal_stats.add_primitive_tests()
+
+        blocked = np.zeros(len(r), dtype=np.bool)
+        blocked[self.candidates(r, t_min, t_max)[0]] = True
+        return blocked
@@ -0,0 +1,55 @@
+import numpy as np  # type: ignore
+from typing import List, Optional
+
+
+class TraversalStats:
+    """
+    Per-ray counters bumped by the hittables during traversal.
+    They stay disabled until begin() arms them for a batch of rays.
+    Hittables working on a compressed subset of the batch push its indices,
+    so that the counts still land on the original rays.
+    """
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        self.counters: np.ndarray = np.zeros((0, 3), dtype=np.int32)
+        self.idx_stack: List[np.ndarray] = list()
+
+    def begin(self, length: int) -> None:
+        self.enabled = True
+        # columns: box tests, primitive tests, bounces
+        self.counters = np.zeros((length, 3), dtype=np.int32)
+        self.idx_stack = [np.arange(length)]
+
+    def end(self) -> np.ndarray:
+        self.enabled = False
+        return self.counters
+
+    def push(self, idx: np.ndarray) -> None:
+        self.idx_stack.append(self.idx_stack[-1][idx])
+
+    def pop(self) -> None:
+        self.idx_stack.pop()
+
+    def add_box_tests(self, mask: Optional[np.ndarray] = None) -> None:
+        self.add(0, mask)
+
+    def add_primitive_tests(self, mask: Optional[np.ndarray] = None,
+                            amount: int = 1) -> None:
+        self.add(1, mask, amount)
+
+    def add_bounces(self, mask: Optional[np.ndarray] = None) -> None:
+        self.add(2, mask)
+
+    def add(self, column: int, mask: Optional[np.ndarray],
+            amount: int = 1) -> None:
+        idx = self.idx_stack[-1]
+        if mask is not None:
+            idx = idx[mask]
+        self.counters[idx, column] += amount
+
+    def add_at(self, column: int, idx: np.ndarray) -> None:
+        # One count per entry of idx, repeated indices included
+        np.add.at(self.counters[:, column], self.idx_stack[-1][idx], 1)
+
+
+traversal_stats = TraversalStats()
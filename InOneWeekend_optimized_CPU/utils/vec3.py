@@ -147,6 +147,17 @@ class Vec3:
             in_unit_sphere @ normal > 0, in_unit_sphere.e, -in_unit_sphere.e
         ))
 
+    @staticmethod
+    def random_cosine_direction(size: int) -> Vec3List:
+        # Around +z with density cos(theta) / pi
+        r1 = random_float_list(size)
+        r2 = random_float_list(size)
+        phi = 2 * np.pi * r1
+        return Vec3List(np.transpose(np.array([
+            np.cos(phi) * np.sqrt(r2), np.sin(phi) * np.sqrt(r2),
+            np.sqrt(1 - r2)
+        ])))
+
     @staticmethod
     def random_in_unit_disk(size: int) -> np.ndarray:
         r = np.sqrt(random_float_list(size))
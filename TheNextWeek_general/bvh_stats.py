@@ -0,0 +1,159 @@
+import numpy as np  # type: ignore
+import argparse
+from collections import Counter
+from typing import List, Dict, Optional
+import scenes
+from utils.hittable import Hittable, FlipFace, Translate, RotateY, Instance
+from utils.hittable_list import HittableList
+from utils.constant_medium import ConstantMedium
+from utils.box import Box
+from utils.bvh import BVHNode
+from utils.compact_bvh import CompactBVH
+from utils.leaf_group import LeafGroup
+from utils.aabb import AABB
+from utils.camera import Camera
+from utils.rtweekend import random_float
+from utils.stats import traversal_stats
+
+
+class BVHReport:
+    def __init__(self, root: BVHNode, time0: float, time1: float,
+                 traversal_cost: float = 1, intersection_cost: float = 1) \
+            -> None:
+        self.time0 = time0
+        self.time1 = time1
+        self.traversal_cost = traversal_cost
+        self.intersection_cost = intersection_cost
+
+        self.node_count: int = 0
+        self.leaf_depths: List[int] = list()
+        self.leaf_sizes: Counter = Counter()
+        self.overlaps: List[float] = list()
+        self.leaf_types: Counter = Counter()
+        self.geometry_types: Counter = Counter()
+
+        self.root_area: float = root.box.surface_area()
+        self.sah_cost: float = 0
+        self.walk(root, 0)
+
+    def walk(self, node: BVHNode, depth: int) -> None:
+        self.node_count += 1
+        area_ratio = node.box.surface_area() / self.root_area
+        self.sah_cost += self.traversal_cost * area_ratio
+
+        children = [node.left] if node.left is node.right \
+            else [node.left, node.right]
+        primitives = [c for c in children if not isinstance(c, BVHNode)]
+        if primitives:
+            size = sum(
+                len(obj) if isinstance(obj, LeafGroup) else 1
+                for obj in primitives
+            )
+            self.leaf_depths.append(depth)
+            self.leaf_sizes[size] += 1
+            self.sah_cost += self.intersection_cost * area_ratio * size
+            for obj in primitives:
+                self.leaf_types[type(obj).__name__] += 1
+                self.count_geometry(obj)
+
+        if len(children) == 2:
+            box_left = node.left.bounding_box(self.time0, self.time1)
+            box_right = node.right.bounding_box(self.time0, self.time1)
+            overlap: Optional[AABB] = AABB.overlap_box(box_left, box_right)
+            self.overlaps.append(
+                0 if overlap is None
+                else overlap.surface_area() / node.box.surface_area()
+            )
+
+        for child in children:
+            if isinstance(child, BVHNode):
+                self.walk(child, depth + 1)
+
+    def count_geometry(self, obj: Hittable) -> None:
+        # Look through wrappers and nested structures down to the shapes
+        if isinstance(obj, (FlipFace, Translate, RotateY, Instance)):
+            self.count_geometry(obj.obj)
+        elif isinstance(obj, ConstantMedium):
+            self.geometry_types[type(obj).__name__] += 1
+            self.count_geometry(obj.boundary)
+        elif isinstance(obj, Box):
+            self.geometry_types[type(obj).__name__] += 1
+        elif isinstance(obj, (HittableList, LeafGroup)):
+            for o in obj.objects:
+                self.count_geometry(o)
+        elif isinstance(obj, BVHNode):
+            self.count_geometry(obj.left)
+            if obj.right is not obj.left:
+                self.count_geometry(obj.right)
+        else:
+            self.geometry_types[type(obj).__name__] += 1
+
+    def show(self) -> None:
+        depths = np.array(self.leaf_depths)
+        print(f"Nodes:              {self.node_count}")
+        print(f"Leaves:             {len(depths)}")
+        print(f"Depth:              max {depths.max()}, "
+              f"mean leaf {depths.mean():.2f}")
+        print("Leaf sizes:         " + ", ".join(
+            f"{size}: {n}" for size, n in sorted(self.leaf_sizes.items())
+        ))
+        print(f"SAH cost:           {self.sah_cost:.2f}")
+        print(f"Overlap ratio:      mean {np.mean(self.overlaps):.3f}, "
+              f"max {np.max(self.overlaps):.3f}")
+        print("Leaf entries:       " + ", ".join(
+            f"{name} {n}" for name, n in self.leaf_types.most_common()
+        ))
+        print("Geometry:           " + ", ".join(
+            f"{name} {n}" for name, n in self.geometry_types.most_common()
+        ))
+
+
+def sample_rays(world: Hittable, cam: Camera, n_rays: int) \
+        -> Dict[str, float]:
+    traversal_stats.reset()
+    hits = 0
+    for _ in range(n_rays):
+        r = cam.get_ray(random_float(), random_float())
+        if world.hit(r, 0.001, np.inf) is not None:
+            hits += 1
+    return {
+        "box": traversal_stats.box_tests / n_rays,
+        "primitive": traversal_stats.primitive_tests / n_rays,
+        "hit_rate": hits / n_rays,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Report BVH quality and per-ray traversal cost of a scene."
+    )
+    parser.add_argument("scene", nargs="?", default="final_scene",
+                        help="scene function name in scenes.py")
+    parser.add_argument("--rays", type=int, default=1000,
+                        help="number of sampled camera rays")
+    parser.add_argument("--compact", type=int, choices=(8, 16),
+                        help="also measure a CompactBVH with this many bits")
+    args = parser.parse_args()
+
+    time0 = 0
+    time1 = 1
+    world, cam = getattr(scenes, args.scene)(1, time0, time1)
+
+    print(f"Scene: {args.scene}")
+    BVHReport(world, time0, time1).show()
+
+    result = sample_rays(world, cam, args.rays)
+    print(f"Per camera ray:     {result['box']:.1f} box tests, "
+          f"{result['primitive']:.1f} primitive tests, "
+          f"{result['hit_rate']:.0%} hit")
+
+    if args.compact is not None:
+        compact = CompactBVH(world, time0, time1, args.compact)
+        result = sample_rays(compact, cam, args.rays)
+        print(f"CompactBVH ({args.compact} bit): {compact.nbytes()} bytes, "
+              f"{result['box']:.1f} box tests, "
+              f"{result['primitive']:.1f} primitive tests per ray")
+
+
+if __name__ == "__main__":
+    main()
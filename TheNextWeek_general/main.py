@@ -1,86 +1,269 @@
 import numpy as np  # type: ignore
+import argparse
 import multiprocessing
 import time
 from joblib import Parallel, delayed  # type: ignore
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 import scenes
 from utils.vec3 import Vec3, Point3, Color
 from utils.img import Img
 from utils.ray import Ray
-from utils.hittable import HitRecord
-from utils.rtweekend import random_float
+from utils.hittable import Hittable, HitRecord
+from utils.rtweekend import random_float, seed
 from utils.camera import Camera
-from utils.bvh import BVHNode
+from utils.light_list import LightList, mis_weight
+from utils.environment import EnvironmentMap
+from utils.denoise import atrous
+from utils.aov import (
+    AOV_CHANNELS, assign_ids, new_aovs, record_hit, accumulate, finish,
+    save_aovs
+)
+from utils.checkpoint import Checkpoint
+from utils.stats import traversal_stats
 
 
-def ray_color(r: Ray, background: Color, world: BVHNode, depth: int) -> Color:
+def ray_color(r: Ray, background: Union[Color, EnvironmentMap],
+              world: Hittable, depth: int,
+              lights: Optional[LightList] = None,
+              scatter_pdf: float = 0,
+              aov: Optional[np.ndarray] = None) -> Color:
     # Bounce limit
     if depth <= 0:
         return Color(0, 0, 0)
 
     rec: Optional[HitRecord] = world.hit(r, 0.001, np.inf)
+    # Output variables of a camera ray, a miss leaves the defaults
+    if aov is not None and rec is not None:
+        record_hit(aov, r, rec)
 
     # Ray hits nothing
     if rec is None:
-        return background
+        if not isinstance(background, EnvironmentMap):
+            return background
+        sky = background.value(r.direction())
+        if scatter_pdf > 0 and lights is not None \
+                and lights.environment is background:
+            sky = sky * mis_weight(
+                scatter_pdf, lights.pdf_value(r.origin(), r.direction())
+            )
+        return sky
 
+    # Lights sampled at the previous hit share their emission with its
+    # light sample. scatter_pdf is 0 after a camera or specular ray.
     emitted = rec.material.emitted(rec.u, rec.v, rec.p)
-    scatter_result = rec.material.scatter(r, rec)
+    if scatter_pdf > 0 and lights is not None \
+            and lights.covers(rec.material):
+        emitted = emitted * mis_weight(
+            scatter_pdf, lights.pdf_value(r.origin(), r.direction())
+        )
 
-    # No scattered ray (could be emissive material)
-    if scatter_result is None:
-        return emitted
+    # Sampled materials bring their pdf, the others only scatter()
+    sample = rec.material.sample(r, rec)
+    if sample is not None:
+        direction, pdf, f = sample
+        scattered = Ray(rec.p, direction, r.time())
+        attenuation = f / pdf
+    else:
+        scatter_result = rec.material.scatter(r, rec)
+        # No scattered ray (could be emissive material)
+        if scatter_result is None:
+            return emitted
+        scattered, attenuation = scatter_result
+        pdf = 0
 
-    scattered, attenuation = scatter_result
+    # Direct light from an explicit light sample. The bounce below adds
+    # the BSDF half of its MIS pair, so the last bounce takes none.
+    direct = None if lights is None or depth <= 1 \
+        else lights.sample_direct(r, rec, world)
+    if direct is not None:
+        emitted = emitted + direct
+
+    traversal_stats.bounces += 1
+    next_pdf = 0 if direct is None else pdf
     return (emitted + (
-        attenuation * ray_color(scattered, background, world, depth-1)
+        attenuation * ray_color(
+            scattered, background, world, depth-1, lights, next_pdf
+        )
     ))
 
 
-def scan_line(j: int, background: Color, world: BVHNode, cam: Camera,
+def scan_line(j: int, background: Union[Color, EnvironmentMap],
+              world: Hittable, cam: Camera,
               image_width: int, image_height: int, samples_per_pixel: int,
-              max_depth: int) -> Img:
+              max_depth: int, lights: Optional[LightList] = None,
+              aovs: bool = False,
+              seed_key: Optional[Tuple[int, ...]] = None) \
+        -> Tuple[Img, Optional[np.ndarray]]:
+    # The row and, when asked for, its (1, w, AOV_SIZE) output variables.
+    # seed_key picks the random stream, for renders that can resume.
+    if seed_key is not None:
+        seed(*seed_key)
     img = Img(image_width, 1)
+    row_aovs = new_aovs(image_width, albedo=0) if aovs else None
     for i in range(image_width):
         pixel_color = Color(0, 0, 0)
         for s in range(samples_per_pixel):
             u: float = (i + random_float()) / (image_width - 1)
             v: float = (j + random_float()) / (image_height - 1)
             r: Ray = cam.get_ray(u, v)
-            pixel_color += ray_color(r, background, world, max_depth)
-        img.write_pixel(i, 0, pixel_color, samples_per_pixel)
+            sample_aov = new_aovs(1) if aovs else None
+            pixel_color += ray_color(
+                r, background, world, max_depth, lights, aov=sample_aov
+            )
+            if row_aovs is not None:
+                accumulate(row_aovs[i:i+1], sample_aov)
+        img.add_pixel(i, 0, pixel_color, samples_per_pixel)
+    print(f"Scanlines remaining: {j} ", end="\r")
+    if row_aovs is None:
+        return img, None
+    return img, finish(row_aovs, samples_per_pixel)[np.newaxis]
+
+
+def scan_line_cost(j: int, background: Union[Color, EnvironmentMap],
+                   world: Hittable, cam: Camera, image_width: int,
+                   image_height: int, samples_per_pixel: int,
+                   max_depth: int) -> np.ndarray:
+    # Per pixel: BVH nodes visited, primitives tested, bounces taken
+    cost = np.zeros((1, image_width, 3), dtype=np.float64)
+    for i in range(image_width):
+        traversal_stats.reset()
+        for s in range(samples_per_pixel):
+            u: float = (i + random_float()) / (image_width - 1)
+            v: float = (j + random_float()) / (image_height - 1)
+            r: Ray = cam.get_ray(u, v)
+            ray_color(r, background, world, max_depth)
+        cost[0][i] = np.array(traversal_stats.snapshot()) / samples_per_pixel
     print(f"Scanlines remaining: {j} ", end="\r")
-    return img
+    return cost
+
+
+def save_cost(cost: np.ndarray, prefix: str) -> None:
+    np.save(f"{prefix}_cost.npy", cost)
+    for k, name in enumerate(["nodes", "primitives", "bounces"]):
+        img = Img(cost.shape[1], cost.shape[0])
+        img.set_false_color(cost[:, :, k])
+        img.save(f"{prefix}_{name}.png")
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true",
+                        help="add samples to the render in --checkpoint")
+    parser.add_argument("--checkpoint", default="./output_checkpoint",
+                        help="path prefix of the checkpoint files")
+    args = parser.parse_args()
+
     aspect_ratio = 1
     image_width = 256
     image_height = int(image_width / aspect_ratio)
-    samples_per_pixel = 20
+    samples_per_pixel = 20  # may be raised to extend a resumed render
+    samples_per_pass = 4  # samples added between checkpoints
     max_depth = 10
     time0 = 0
     time1 = 1
+    render_mode = "radiance"  # or "heatmap" for traversal cost
+    denoise_strength: float = 0  # above 0 filters the noise out
+    write_aovs = False  # albedo, normal, depth and ids to output_aovs.npz
+    exposure: float = 1  # applied when encoding, output.npy stays linear
+
+    # Random scenes come out the same when resuming
+    render_seed: int = Checkpoint.saved_seed(args.checkpoint) \
+        if args.resume else np.random.SeedSequence().entropy
+    seed(render_seed)
 
     world, cam = scenes.final_scene(aspect_ratio, time0, time1)
-    background = Color(0, 0, 0)
+    # Quantized, flattened BVH for scenes too large for the object tree
+    # from utils.compact_bvh import CompactBVH
+    # world = CompactBVH(world, time0, time1, bits=16)
+    background: Union[Color, EnvironmentMap] = Color(0, 0, 0)
+    # Light the scene with an HDR sky, float data as .npy or .pfm
+    # background = EnvironmentMap.from_file("sky.npy")
+    environment = background if isinstance(background, EnvironmentMap) \
+        else None
+    # Sample the scene's lights directly at diffuse hits
+    lights: Optional[LightList] = LightList.from_world(world, environment)
+    # Pick lights by their estimated contribution in many-light scenes
+    # from utils.light_tree import LightTree
+    # lights = LightTree.from_world(world, environment)
+
+    use_aovs = write_aovs or denoise_strength > 0
+    if use_aovs:
+        assign_ids(world)
 
     print("Start rendering.")
     start_time = time.time()
 
     n_processer = multiprocessing.cpu_count()
-    img_list: List[Img] = Parallel(n_jobs=n_processer, verbose=10)(
-        delayed(scan_line)(
-            j, background, world, cam,
-            image_width, image_height,
-            samples_per_pixel, max_depth
-        ) for j in range(image_height-1, -1, -1)
-    )
+    if render_mode == "heatmap":
+        cost_list: List[np.ndarray] = Parallel(
+            n_jobs=n_processer, verbose=10
+        )(
+            delayed(scan_line_cost)(
+                j, background, world, cam,
+                image_width, image_height,
+                samples_per_pixel, max_depth
+            ) for j in range(image_height-1, -1, -1)
+        )
+        save_cost(np.concatenate(cost_list), "./output")
+        end_time = time.time()
+        print(f"\nDone. Total time: {round(end_time - start_time, 1)} s.")
+        return
+
+    # Only a radiance render touches the checkpoint, once the image size
+    # is final
+    settings = {
+        "width": image_width, "height": image_height,
+        "max_depth": max_depth, "samples_per_pass": samples_per_pass
+    }
+    checkpoint = Checkpoint.resume(args.checkpoint, settings) \
+        if args.resume \
+        else Checkpoint.create(args.checkpoint, settings, render_seed)
+
+    # Passes of samples_per_pass samples, each saved when it finishes.
+    # A stream per first sample and row keeps resumed passes fresh.
+    done = checkpoint.samples_done()
+    for first in range(done, samples_per_pixel, samples_per_pass):
+        samples = min(samples_per_pass, samples_per_pixel - first)
+        # AOVs come from the first pass that runs with them on
+        pass_aovs = use_aovs and not checkpoint.has_aovs()
+        line_list: List[Tuple[Img, Optional[np.ndarray]]] = Parallel(
+            n_jobs=n_processer, verbose=10
+        )(
+            delayed(scan_line)(
+                j, background, world, cam,
+                image_width, image_height,
+                samples, max_depth, lights, pass_aovs,
+                (checkpoint.seed, first, j)
+            ) for j in range(image_height-1, -1, -1)
+        )
+        if pass_aovs:
+            checkpoint.save_aovs(np.concatenate([
+                line_aovs for _, line_aovs in line_list
+            ]))
+        checkpoint.add(np.concatenate([img.accum for img, _ in line_list]))
+        print(f"\nCheckpoint: {first + samples} of {samples_per_pixel} "
+              f"samples.")
 
     final_img = Img(image_width, image_height)
-    final_img.set_array(
-        np.concatenate([img.frame for img in img_list])
-    )
+    final_img.set_accumulation(np.array(checkpoint.accum))
+    # Linear sums and counts, to merge with or tone map later
+    final_img.save_linear("./output.npy")
+    color = final_img.linear()
+    aovs = checkpoint.load_aovs() if use_aovs else None
+    if use_aovs and aovs is None:
+        # A finished render resumed with AOVs newly turned on
+        print(f"\nNo AOVs in {args.checkpoint}, raise samples_per_pixel "
+              f"to record them. Not writing or denoising them.")
+    if aovs is not None:
+        if write_aovs:
+            save_aovs(aovs, "./output_aovs.npz")
+        if denoise_strength > 0:
+            color = atrous(
+                color, aovs[..., AOV_CHANNELS["albedo"]],
+                aovs[..., AOV_CHANNELS["normal"]],
+                aovs[..., AOV_CHANNELS["depth"]][..., 0], denoise_strength
+            )
+    final_img.encode(color, exposure)
 
     end_time = time.time()
     print(f"\nDone. Total time: {round(end_time - start_time, 1)} s.")
@@ -0,0 +1,81 @@
+import numpy as np  # type: ignore
+import argparse
+from typing import Optional, Tuple, Union
+from main import ray_color
+from utils.vec3 import Vec3, Point3, Color
+from utils.ray import Ray
+from utils.hittable_list import HittableList
+from utils.aarect import XZRect
+from utils.material import Lambertian, DiffuseLight
+from utils.texture import SolidColor
+from utils.light_list import LightList
+from utils.environment import EnvironmentMap
+from utils.rtweekend import seed
+
+
+def floor_scene() -> HittableList:
+    # A white floor under a small square light
+    world = HittableList()
+    world.add(XZRect(-10, 10, -10, 10, 0, Lambertian(SolidColor(1, 1, 1))))
+    world.add(XZRect(-0.5, 0.5, -0.5, 0.5, 1,
+                     DiffuseLight(SolidColor(4, 4, 4))))
+    return world
+
+
+def estimate(world: HittableList, background: Union[Color, EnvironmentMap],
+             lights: Optional[LightList], depth: int,
+             samples: int) -> Tuple[float, float]:
+    # Mean and standard error of the light reflected toward a camera ray
+    # looking straight down at the floor under the light
+    values = np.empty(samples)
+    for s in range(samples):
+        r = Ray(Point3(0.2, 0.5, 0.1), Vec3(0, -1, 0))
+        values[s] = ray_color(r, background, world, depth, lights).x()
+    return values.mean(), values.std() / np.sqrt(samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check that light sampling with MIS agrees with plain "
+                    "BSDF sampling at every bounce limit."
+    )
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--sigmas", type=float, default=4,
+                        help="allowed difference in standard errors")
+    args = parser.parse_args()
+
+    seed(0)
+    world = floor_scene()
+    # A sky brighter toward +x, so its sampling is not uniform
+    sky = np.ones((16, 32, 3))
+    sky[:, :8] = 4
+    backgrounds: Tuple[Union[Color, EnvironmentMap], ...] = (
+        Color(0, 0, 0), EnvironmentMap(sky)
+    )
+    failed = False
+    for background in backgrounds:
+        environment = background \
+            if isinstance(background, EnvironmentMap) else None
+        lights = LightList.from_world(world, environment)
+        print("Light and sky:" if environment else "Light only:")
+        for depth in range(1, args.max_depth + 1):
+            bsdf, bsdf_error = estimate(
+                world, background, None, depth, args.samples
+            )
+            mis, mis_error = estimate(
+                world, background, lights, depth, args.samples
+            )
+            error = np.hypot(bsdf_error, mis_error)
+            ok = abs(mis - bsdf) <= args.sigmas * max(error, 1e-12)
+            failed = failed or not ok
+            print(f"  depth {depth}: BSDF {bsdf:.4f} +- {bsdf_error:.4f}, "
+                  f"MIS {mis:.4f} +- {mis_error:.4f} "
+                  f"{'ok' if ok else 'MISMATCH'}")
+    if failed:
+        print("Light sampling disagrees with BSDF sampling.")
+        raise ValueError
+
+
+if __name__ == "__main__":
+    main()
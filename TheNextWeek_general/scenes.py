@@ -6,10 +6,11 @@ from utils.hittable_list import HittableList
 from utils.camera import Camera
 from utils.material import Lambertian, Metal, Dielectric, DiffuseLight
 from utils.rtweekend import random_float
-from utils.bvh import BVHNode
+from utils.bvh import BVHNode, MotionBVHNode
 from utils.texture import SolidColor, CheckerTexture, NoiseTexture, ImageTexture
 from utils.aarect import XYRect, XZRect, YZRect
-from utils.hittable import Hittable, FlipFace, RotateY, Translate
+from utils.hittable import Hittable, FlipFace, RotateY, Translate, Instance
+from utils.transform import Transform
 from utils.box import Box
 from utils.constant_medium import ConstantMedium
 
@@ -106,7 +107,7 @@ def random_scene(aspect_ratio: float, time0: float, time1: float) \
     material_3 = Metal(Color(0.7, 0.6, 0.5), 0)
     world.add(Sphere(Point3(4, 1, 0), 1, material_3))
 
-    world_bvh = BVHNode(world.objects, time0, time1)
+    world_bvh = MotionBVHNode(world.objects, time0, time1, leaf_size=16)
 
     lookfrom = Point3(13, 2, 3)
     lookat = Point3(0, 0, 0)
@@ -226,6 +227,51 @@ def simple_light(aspect_ratio: float, time0: float, time1: float) \
     return world_bvh, cam
 
 
+def many_lights(aspect_ratio: float, time0: float, time1: float) \
+        -> Tuple[BVHNode, Camera]:
+    world = HittableList()
+
+    ground_material = Lambertian(SolidColor(0.5, 0.5, 0.5))
+    world.add(Sphere(Point3(0, -1000, 0), 1000, ground_material))
+    world.add(Sphere(
+        Point3(0, 1, 0), 1, Lambertian(SolidColor(0.4, 0.2, 0.1))
+    ))
+    world.add(Sphere(Point3(4, 1, 0), 1, Metal(Color(0.7, 0.6, 0.5), 0)))
+
+    # A field of small lamps of random colors, balls and floating tiles
+    for a in range(-11, 11):
+        for b in range(-11, 11):
+            emit = SolidColor(Color.random(0.5, 1) * 4)
+            if random_float() < 0.8:
+                center = Point3(
+                    a + 0.9*random_float(), random_float(0.1, 3),
+                    b + 0.9*random_float()
+                )
+                world.add(Sphere(center, 0.1, DiffuseLight(emit)))
+            else:
+                x = a + 0.9*random_float()
+                z = b + 0.9*random_float()
+                world.add(XZRect(
+                    x, x + 0.3, z, z + 0.3, random_float(2, 4),
+                    DiffuseLight(emit)
+                ))
+
+    world_bvh = BVHNode(world.objects, time0, time1, leaf_size=16)
+
+    lookfrom = Point3(13, 2, 3)
+    lookat = Point3(0, 0, 0)
+    vup = Vec3(0, 1, 0)
+    vfov = 20
+    dist_to_focus: float = 10
+    aperture: float = 0
+    cam = Camera(
+        lookfrom, lookat, vup, vfov, aspect_ratio, aperture, dist_to_focus,
+        time0, time1
+    )
+
+    return world_bvh, cam
+
+
 def cornell_box(aspect_ratio: float, time0: float, time1: float) \
         -> Tuple[BVHNode, Camera]:
     world = HittableList()
@@ -330,10 +376,11 @@ def final_scene(aspect_ratio: float, time0: float, time1: float) \
     ns = 1000
     for j in range(ns):
         boxes2.add(Sphere(Point3.random(0, 165), 10, white))
-    world.add(Translate(
-        RotateY(
-            BVHNode(boxes2.objects, time0, time1), 15
-        ), Vec3(-100, 270, 395)
+    foam = BVHNode(boxes2.objects, time0, time1, leaf_size=16)
+    world.add(Instance(
+        foam,
+        Transform.translate(Vec3(-100, 270, 395)) @ Transform.rotate_y(15),
+        time0, time1
     ))
 
     world_bvh = BVHNode(world.objects, time0, time1)
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from typing import Optional
 from utils.vec3 import Vec3, Point3
 from utils.ray import Ray
 
@@ -8,6 +9,7 @@ class AABB:
                  _max: Point3 = Point3()) -> None:
         self._min = _min
         self._max = _max
+        self.bounds = (_min.e.tolist(), _max.e.tolist())
 
     def min(self) -> Point3:
         return self._min
@@ -32,17 +34,28 @@ class AABB:
         return True
 
     def hit(self, r: Ray, tmin: float, tmax: float) -> bool:
+        return self.hit_distance(r, tmin, tmax) is not None
+
+    def hit_distance(self, r: Ray, tmin: float, tmax: float) \
+            -> Optional[float]:
+        # Entry distance of the ray into the box, or None on a miss
+        origin = r.orig_list
         for i in range(3):
-            invD: float = 1 / r.direction()[i]
-            t0: float = (self.min()[i] - r.origin()[i]) * invD
-            t1: float = (self.max()[i] - r.origin()[i]) * invD
-            if invD < 0:
-                t0, t1 = t1, t0
-            tmin = max(t0, tmin)
-            tmax = min(t1, tmax)
+            near = self.bounds[r.sign[i]][i]
+            far = self.bounds[1 - r.sign[i]][i]
+            t0: float = (near - origin[i]) * r.inv_dir[i]
+            t1: float = (far - origin[i]) * r.inv_dir[i]
+            if t0 > tmin:
+                tmin = t0
+            if t1 < tmax:
+                tmax = t1
             if tmax <= tmin:
-                return False
-        return True
+                return None
+        return tmin
+
+    def surface_area(self) -> float:
+        d = self.max() - self.min()
+        return 2 * (d.x()*d.y() + d.y()*d.z() + d.z()*d.x())
 
     @staticmethod
     def surrounding_box(box0: AABB, box1: AABB) -> AABB:
@@ -57,3 +70,19 @@ class AABB:
             max(box0.max().z(), box1.max().z())
         )
         return AABB(small, big)
+
+    @staticmethod
+    def overlap_box(box0: AABB, box1: AABB) -> Optional[AABB]:
+        small = Point3(
+            max(box0.min().x(), box1.min().x()),
+            max(box0.min().y(), box1.min().y()),
+            max(box0.min().z(), box1.min().z())
+        )
+        big = Point3(
+            min(box0.max().x(), box1.max().x()),
+            min(box0.max().y(), box1.max().y()),
+            min(box0.max().z(), box1.max().z())
+        )
+        if (big.e < small.e).any():
+            return None
+        return AABB(small, big)
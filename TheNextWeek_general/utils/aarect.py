@@ -1,9 +1,22 @@
+import numpy as np  # type: ignore
 from typing import Optional
 from utils.hittable import Hittable, HitRecord
 from utils.vec3 import Vec3, Point3
 from utils.ray import Ray
 from utils.aabb import AABB
 from utils.material import Material
+from utils.rtweekend import random_float
+
+
+def area_pdf(rect: Hittable, area: float, origin: Point3,
+             direction: Vec3) -> float:
+    # Density of a uniform point on the rect, seen as a solid angle
+    rec = rect.hit(Ray(origin, direction), 0.001, np.inf)
+    if rec is None:
+        return 0
+    distance_squared = rec.t**2 * direction.length_squared()
+    cosine = abs(direction @ rec.normal) / direction.length()
+    return distance_squared / (cosine * area)
 
 
 class XYRect(Hittable):
@@ -25,12 +38,20 @@ class XYRect(Hittable):
         if (x < self.x0) or (x > self.x1) or (y < self.y0) or (y > self.y1):
             return None
 
-        rec = HitRecord(r.at(t), t, self.material)
+        rec = HitRecord(r.at(t), t, self.material, self.object_id)
         rec.set_face_normal(r, Vec3(0, 0, 1))
         rec.u = (x - self.x0) / (self.x1 - self.x0)
         rec.v = (y - self.y0) / (self.y1 - self.y0)
         return rec
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        t = (self.k - r.origin().z()) / r.direction().z()
+        if t < t_min or t > t_max:
+            return False
+        x = r.origin().x() + t*r.direction().x()
+        y = r.origin().y() + t*r.direction().y()
+        return self.x0 <= x <= self.x1 and self.y0 <= y <= self.y1
+
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         output_box = AABB(
             Point3(self.x0, self.y0, self.k-0.0001),
@@ -38,6 +59,17 @@ class XYRect(Hittable):
         )
         return output_box
 
+    def pdf_value(self, origin: Point3, direction: Vec3) -> float:
+        area = (self.x1 - self.x0) * (self.y1 - self.y0)
+        return area_pdf(self, area, origin, direction)
+
+    def random(self, origin: Point3) -> Vec3:
+        random_point = Point3(
+            random_float(self.x0, self.x1), random_float(self.y0, self.y1),
+            self.k
+        )
+        return random_point - origin
+
 
 class XZRect(Hittable):
     def __init__(self, x0: float, x1: float, z0: float,
@@ -58,12 +90,20 @@ class XZRect(Hittable):
         if (x < self.x0) or (x > self.x1) or (z < self.z0) or (z > self.z1):
             return None
 
-        rec = HitRecord(r.at(t), t, self.material)
+        rec = HitRecord(r.at(t), t, self.material, self.object_id)
         rec.set_face_normal(r, Vec3(0, 1, 0))
         rec.u = (x - self.x0) / (self.x1 - self.x0)
         rec.v = (z - self.z0) / (self.z1 - self.z0)
         return rec
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        t = (self.k - r.origin().y()) / r.direction().y()
+        if t < t_min or t > t_max:
+            return False
+        x = r.origin().x() + t*r.direction().x()
+        z = r.origin().z() + t*r.direction().z()
+        return self.x0 <= x <= self.x1 and self.z0 <= z <= self.z1
+
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         output_box = AABB(
             Point3(self.x0, self.k-0.0001, self.z0),
@@ -71,6 +111,17 @@ class XZRect(Hittable):
         )
         return output_box
 
+    def pdf_value(self, origin: Point3, direction: Vec3) -> float:
+        area = (self.x1 - self.x0) * (self.z1 - self.z0)
+        return area_pdf(self, area, origin, direction)
+
+    def random(self, origin: Point3) -> Vec3:
+        random_point = Point3(
+            random_float(self.x0, self.x1), self.k,
+            random_float(self.z0, self.z1)
+        )
+        return random_point - origin
+
 
 class YZRect(Hittable):
     def __init__(self, y0: float, y1: float, z0: float,
@@ -91,15 +142,34 @@ class YZRect(Hittable):
         if (y < self.y0) or (y > self.y1) or (z < self.z0) or (z > self.z1):
             return None
 
-        rec = HitRecord(r.at(t), t, self.material)
+        rec = HitRecord(r.at(t), t, self.material, self.object_id)
         rec.set_face_normal(r, Vec3(1, 0, 0))
         rec.u = (y - self.y0) / (self.y1 - self.y0)
         rec.v = (z - self.z0) / (self.z1 - self.z0)
         return rec
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        t = (self.k - r.origin().x()) / r.direction().x()
+        if t < t_min or t > t_max:
+            return False
+        y = r.origin().y() + t*r.direction().y()
+        z = r.origin().z() + t*r.direction().z()
+        return self.y0 <= y <= self.y1 and self.z0 <= z <= self.z1
+
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         output_box = AABB(
             Point3(self.k-0.0001, self.y0, self.z0),
             Point3(self.k+0.0001, self.y1, self.z1)
         )
         return output_box
+
+    def pdf_value(self, origin: Point3, direction: Vec3) -> float:
+        area = (self.y1 - self.y0) * (self.z1 - self.z0)
+        return area_pdf(self, area, origin, direction)
+
+    def random(self, origin: Point3) -> Vec3:
+        random_point = Point3(
+            self.k, random_float(self.y0, self.y1),
+            random_float(self.z0, self.z1)
+        )
+        return random_point - origin
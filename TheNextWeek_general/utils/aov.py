@@ -0,0 +1,99 @@
+import numpy as np  # type: ignore
+from typing import Dict, Set
+from utils.ray import Ray
+from utils.hittable import (
+    Hittable, HitRecord, FlipFace, Translate, RotateY, Instance
+)
+from utils.hittable_list import HittableList
+from utils.bvh import BVHNode
+from utils.compact_bvh import CompactBVH
+from utils.leaf_group import LeafGroup
+from utils.constant_medium import ConstantMedium
+
+
+# Channels of the per-pixel output variables, taken at the first hit
+AOV_CHANNELS: Dict[str, slice] = {
+    "albedo": slice(0, 3),
+    "normal": slice(3, 6),
+    "depth": slice(6, 7),
+    "material_id": slice(7, 8),
+    "object_id": slice(8, 9),
+}
+AOV_SIZE = 9
+
+
+def assign_ids(world: Hittable) -> None:
+    """
+    Number the primitives and materials of the scene in walk order, so
+    hits can report them. The ids are plain attributes and travel with
+    the scene to the render processes.
+    """
+    seen: Set[int] = set()
+    materials: Dict[int, int] = dict()
+
+    def walk(obj: Hittable) -> None:
+        if isinstance(obj, HittableList):
+            children = obj.objects
+        elif isinstance(obj, BVHNode):
+            children = [obj.left, obj.right]
+        elif isinstance(obj, LeafGroup):
+            children = obj.objects
+        elif isinstance(obj, CompactBVH):
+            children = obj.primitives
+        elif isinstance(obj, (FlipFace, Translate, RotateY, Instance)):
+            children = [obj.obj]
+        else:
+            if id(obj) in seen:
+                return
+            seen.add(id(obj))
+            obj.object_id = len(seen) - 1
+            material = obj.phase_function \
+                if isinstance(obj, ConstantMedium) else obj.material
+            if id(material) not in materials:
+                materials[id(material)] = len(materials)
+                material.material_id = materials[id(material)]
+            return
+        for child in children:
+            walk(child)
+
+    walk(world)
+
+
+def new_aovs(length: int, albedo: float = 1) -> np.ndarray:
+    # What a miss leaves: the given albedo, no normal, no depth, id -1
+    aovs = np.zeros((length, AOV_SIZE), dtype=np.float64)
+    aovs[:, AOV_CHANNELS["albedo"]] = albedo
+    aovs[:, AOV_CHANNELS["depth"]] = np.inf
+    aovs[:, AOV_CHANNELS["material_id"]] = -1
+    aovs[:, AOV_CHANNELS["object_id"]] = -1
+    return aovs
+
+
+def record_hit(aov: np.ndarray, r: Ray, rec: HitRecord) -> None:
+    aov[0, AOV_CHANNELS["albedo"]] = rec.material.albedo_value(rec).e
+    aov[0, AOV_CHANNELS["normal"]] = rec.normal.e
+    aov[0, AOV_CHANNELS["depth"]] = rec.t * r.direction().length()
+    aov[0, AOV_CHANNELS["material_id"]] = rec.material.material_id
+    aov[0, AOV_CHANNELS["object_id"]] = rec.object_id
+
+
+def accumulate(total: np.ndarray, sample: np.ndarray) -> None:
+    # Albedo and normal are summed over the samples, depth and ids come
+    # from the nearest first hit
+    total[:, :6] += sample[:, :6]
+    nearer = sample[:, 6] < total[:, 6]
+    total[nearer, 6:] = sample[nearer, 6:]
+
+
+def finish(total: np.ndarray, samples_per_pixel: int) -> np.ndarray:
+    total[..., :6] /= samples_per_pixel
+    return total
+
+
+def save_aovs(aovs: np.ndarray, path: str) -> None:
+    # One float array per variable, depth and ids as (h, w)
+    np.savez(path, **{
+        name: np.squeeze(aovs[..., channels], axis=-1)
+        if channels.stop - channels.start == 1 else aovs[..., channels]
+        for name, channels in AOV_CHANNELS.items()
+    })
@@ -1,34 +1,74 @@
-from typing import Optional
-from utils.hittable import Hittable, HitRecord, FlipFace
-from utils.hittable_list import HittableList
-from utils.vec3 import Point3
+from typing import Optional, Tuple
+import numpy as np  # type: ignore
+from utils.hittable import Hittable, HitRecord
+from utils.vec3 import Vec3, Point3
 from utils.material import Material
-from utils.aarect import XYRect, XZRect, YZRect
 from utils.ray import Ray
 from utils.aabb import AABB
 
 
 class Box(Hittable):
+    # In-plane (u, v) axes of the face across each axis, as in the rects
+    UV_AXES = ((1, 2), (0, 2), (0, 1))
+
     def __init__(self, p0: Point3, p1: Point3, mat: Material) -> None:
         self.box_min = p0
         self.box_max = p1
+        self.material = mat
+        self.bounds = (p0.e.tolist(), p1.e.tolist())
 
-        self.sides = HittableList()
-        self.sides.add(XYRect(p0.x(), p1.x(), p0.y(), p1.y(), p1.z(), mat))
-        self.sides.add(
-            FlipFace(XYRect(p0.x(), p1.x(), p0.y(), p1.y(), p0.z(), mat))
-        )
-        self.sides.add(XZRect(p0.x(), p1.x(), p0.z(), p1.z(), p1.y(), mat))
-        self.sides.add(
-            FlipFace(XZRect(p0.x(), p1.x(), p0.z(), p1.z(), p0.y(), mat))
-        )
-        self.sides.add(YZRect(p0.y(), p1.y(), p0.z(), p1.z(), p1.x(), mat))
-        self.sides.add(
-            FlipFace(YZRect(p0.y(), p1.y(), p0.z(), p1.z(), p0.x(), mat))
-        )
+    def slab(self, r: Ray) -> Tuple[float, int, float, int]:
+        # Entry and exit distance of the ray line, with the axis of each
+        origin = r.orig_list
+        t_near = -np.inf
+        t_far = np.inf
+        axis_near = axis_far = -1
+        for i in range(3):
+            t0 = (self.bounds[r.sign[i]][i] - origin[i]) * r.inv_dir[i]
+            t1 = (self.bounds[1 - r.sign[i]][i] - origin[i]) * r.inv_dir[i]
+            if t0 > t_near:
+                t_near = t0
+                axis_near = i
+            if t1 < t_far:
+                t_far = t1
+                axis_far = i
+        return t_near, axis_near, t_far, axis_far
 
     def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
-        return self.sides.hit(r, t_min, t_max)
+        t_near, axis_near, t_far, axis_far = self.slab(r)
+        if t_far < t_near:
+            return None
+
+        # The entry face is the min side of an axis the ray runs up along
+        if t_min <= t_near <= t_max and axis_near >= 0:
+            t = t_near
+            axis = axis_near
+            side = 1 if r.sign[axis] else -1
+        elif t_min <= t_far <= t_max and axis_far >= 0:
+            t = t_far
+            axis = axis_far
+            side = -1 if r.sign[axis] else 1
+        else:
+            return None
+
+        point = r.at(t)
+        outward_normal = Vec3()
+        outward_normal[axis] = side
+
+        rec = HitRecord(point, t, self.material, self.object_id)
+        rec.set_face_normal(r, outward_normal)
+        axis_u, axis_v = self.UV_AXES[axis]
+        rec.u = (point[axis_u] - self.bounds[0][axis_u]) \
+            / (self.bounds[1][axis_u] - self.bounds[0][axis_u])
+        rec.v = (point[axis_v] - self.bounds[0][axis_v]) \
+            / (self.bounds[1][axis_v] - self.bounds[0][axis_v])
+        return rec
+
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        t_near, _, t_far, _ = self.slab(r)
+        return t_near <= t_far and (
+            t_min <= t_near <= t_max or t_min <= t_far <= t_max
+        )
 
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         return AABB(self.box_min, self.box_max)
@@ -2,12 +2,25 @@ from typing import Optional, List, Callable
 from utils.hittable import Hittable, HitRecord
 from utils.ray import Ray
 from utils.aabb import AABB
+from utils.vec3 import Point3
 from utils.hittable_list import HittableList
 from utils.rtweekend import random_int
+from utils.stats import traversal_stats
+from utils.leaf_group import LeafGroup
 
 
 class BVHNode(Hittable):
-    def __init__(self, objects: List[Hittable], time0: float, time1: float):
+    # Relative costs for choosing between batched leaves and further splits,
+    # in units of one scalar primitive hit call
+    TRAVERSAL_COST = 0.1
+    BATCH_CALL_COST = 2.0
+    BATCH_PRIMITIVE_COST = 0.02
+
+    def __init__(self, objects: List[Hittable], time0: float, time1: float,
+                 leaf_size: int = 1):
+        """
+        leaf_size: the most primitives a batched leaf may hold
+        """
         axis = random_int(0, 2)
         key_func: Callable[[Hittable], float] = self.key_func(axis)
 
@@ -24,8 +37,12 @@ class BVHNode(Hittable):
         else:
             sorted_objects = sorted(objects, key=key_func)
             mid = int(length / 2)
-            self.left = BVHNode(sorted_objects[0:mid], time0, time1)
-            self.right = BVHNode(sorted_objects[mid:length], time0, time1)
+            self.left = self.build(
+                sorted_objects[0:mid], time0, time1, leaf_size
+            )
+            self.right = self.build(
+                sorted_objects[mid:length], time0, time1, leaf_size
+            )
 
         box_left = self.left.bounding_box(time0, time1)
         box_right = self.right.bounding_box(time0, time1)
@@ -33,21 +50,88 @@ class BVHNode(Hittable):
             print("No bounding box in bvh_node constructor.")
             raise ValueError
         self.box = AABB.surrounding_box(box_left, box_right)
+        self.axis = axis
+        children = [self.left] if self.left is self.right \
+            else [self.left, self.right]
+        self.leaf_count = sum(
+            len(child) if isinstance(child, LeafGroup) else 1
+            for child in children if not isinstance(child, BVHNode)
+        )
 
     def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
-        if not self.box.hit(r, t_min, t_max):
+        traversal_stats.box_tests += 1
+        if not self.box_hit(r, t_min, t_max):
             return None
+        traversal_stats.primitive_tests += self.leaf_count
+
+        # Children are sorted along the split axis. Visit the nearer one
+        # first, so the box test of the far one is cut off at its hit.
+        if r.sign[self.axis]:
+            near, far = self.right, self.left
+        else:
+            near, far = self.left, self.right
+
+        rec_near = near.hit(r, t_min, t_max)
+        if far is near:
+            return rec_near
+        rec_far = far.hit(r, t_min, t_max if rec_near is None else rec_near.t)
+
+        if rec_far is not None:
+            return rec_far
+        return rec_near
 
-        rec_l = self.left.hit(r, t_min, t_max)
-        rec_r = self.right.hit(r, t_min, t_max if rec_l is None else rec_l.t)
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        traversal_stats.box_tests += 1
+        if not self.box_hit(r, t_min, t_max):
+            return False
+        traversal_stats.primitive_tests += self.leaf_count
 
-        if rec_r is not None:
-            return rec_r
-        return rec_l
+        # Any blocker ends the search, so the visiting order does not matter
+        if self.left.occluded(r, t_min, t_max):
+            return True
+        return self.right is not self.left and \
+            self.right.occluded(r, t_min, t_max)
 
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         return self.box
 
+    def box_hit(self, r: Ray, t_min: float, t_max: float) -> bool:
+        return self.box.hit(r, t_min, t_max)
+
+    @classmethod
+    def build(cls, objects: List[Hittable], time0: float, time1: float,
+              leaf_size: int) -> Hittable:
+        if 1 < len(objects) <= leaf_size:
+            group = LeafGroup.from_objects(objects, time0, time1)
+            if group is not None and \
+                    cls.batch_cost(group, time0, time1) <= \
+                    cls.split_cost(group, time0, time1):
+                return group
+        return cls(objects, time0, time1, leaf_size)
+
+    @classmethod
+    def batch_cost(cls, group: LeafGroup, time0: float, time1: float) \
+            -> float:
+        return cls.BATCH_CALL_COST + cls.BATCH_PRIMITIVE_COST * len(group)
+
+    @classmethod
+    def split_cost(cls, group: LeafGroup, time0: float, time1: float) \
+            -> float:
+        # SAH estimate of a median split whose halves test one by one
+        area = group.box.surface_area()
+        if area <= 0:
+            return cls.TRAVERSAL_COST + len(group)
+        mid = int(len(group) / 2)
+        cost = cls.TRAVERSAL_COST
+        for half in (group.objects[:mid], group.objects[mid:]):
+            box = half[0].bounding_box(time0, time1)
+            for obj in half[1:]:
+                box = AABB.surrounding_box(box, obj.bounding_box(time0, time1))
+            cost += (
+                box.surface_area() / area * (cls.TRAVERSAL_COST + len(half))
+            )
+        return cost
+
     @staticmethod
     def key_func(axis: int) -> Callable[[Hittable], float]:
 
@@ -59,3 +143,69 @@ class BVHNode(Hittable):
             return box.min().e[axis]
 
         return key
+
+
+class MotionBVHNode(BVHNode):
+    """
+    A BVHNode keeping its box at the start and at the end of the shutter.
+    Each ray is tested against the box blended to its own time instead of
+    the box swept over the whole interval. Children moving linearly have
+    exact boxes at both ends, so the blend stays conservative in between.
+    """
+    def __init__(self, objects: List[Hittable], time0: float, time1: float,
+                 leaf_size: int = 1):
+        super().__init__(objects, time0, time1, leaf_size)
+        self.time0 = time0
+        self.time1 = time1
+        self.bounds0 = self.children_box(time0).bounds
+        bounds1 = self.children_box(time1).bounds
+        self.bounds_delta = [
+            [b1 - b0 for b0, b1 in zip(side0, side1)]
+            for side0, side1 in zip(self.bounds0, bounds1)
+        ]
+
+    def children_box(self, time: float) -> AABB:
+        box_left = self.left.bounding_box(time, time)
+        box_right = self.right.bounding_box(time, time)
+        if box_left is None or box_right is None:
+            print("No bounding box in MotionBVHNode constructor.")
+            raise ValueError
+        return AABB.surrounding_box(box_left, box_right)
+
+    def shutter_position(self, time: float) -> float:
+        if self.time1 == self.time0:
+            return 0
+        s = (time - self.time0) / (self.time1 - self.time0)
+        return min(max(s, 0), 1)
+
+    def box_at(self, time: float) -> AABB:
+        s = self.shutter_position(time)
+        return AABB(*[
+            Point3(*[b + s*d for b, d in zip(side, delta)])
+            for side, delta in zip(self.bounds0, self.bounds_delta)
+        ])
+
+    def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
+        return AABB.surrounding_box(self.box_at(t0), self.box_at(t1))
+
+    def box_hit(self, r: Ray, t_min: float, t_max: float) -> bool:
+        s = self.shutter_position(r.time())
+        origin = r.orig_list
+        for i in range(3):
+            near = r.sign[i]
+            far = 1 - near
+            t0 = (
+                self.bounds0[near][i] + s*self.bounds_delta[near][i]
+                - origin[i]
+            ) * r.inv_dir[i]
+            t1 = (
+                self.bounds0[far][i] + s*self.bounds_delta[far][i]
+                - origin[i]
+            ) * r.inv_dir[i]
+            if t0 > t_min:
+                t_min = t0
+            if t1 < t_max:
+                t_max = t1
+            if t_max <= t_min:
+                return False
+        return True
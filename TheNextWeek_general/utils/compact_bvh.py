@@ -0,0 +1,165 @@
+import numpy as np  # type: ignore
+from typing import Optional, List, Tuple
+from utils.hittable import Hittable, HitRecord
+from utils.ray import Ray
+from utils.aabb import AABB
+from utils.bvh import BVHNode
+from utils.stats import traversal_stats
+
+
+class CompactBVH(Hittable):
+    """
+    A flattened copy of a BVHNode tree.
+    Child bounds are quantized relative to the parent box into 8 or 16 bits
+    and packed into contiguous arrays. Decoding always rounds outwards, so
+    the decoded boxes are conservative and never drop a hit.
+    """
+    EMPTY = np.iinfo(np.int32).min
+
+    def __init__(self, root: BVHNode, time0: float, time1: float,
+                 bits: int = 16) -> None:
+        if bits == 8:
+            self.dtype = np.uint8
+        elif bits == 16:
+            self.dtype = np.uint16
+        else:
+            print("CompactBVH only supports 8 or 16 bits.")
+            raise ValueError
+        self.levels: int = 2**bits - 1
+
+        self.primitives: List[Hittable] = list()
+        children: List[Tuple[int, int]] = list()
+        bounds: List[np.ndarray] = list()
+
+        self.box = root.bounding_box(time0, time1)
+        self.root_min: np.ndarray = self.box.min().e.copy()
+        self.root_max: np.ndarray = self.box.max().e.copy()
+
+        def flatten(node: BVHNode, lo: np.ndarray, hi: np.ndarray) -> int:
+            idx = len(children)
+            children.append((self.EMPTY, self.EMPTY))
+            bounds.append(np.zeros((2, 6), dtype=self.dtype))
+
+            sides = [node.left] if node.left is node.right \
+                else [node.left, node.right]
+            refs = [self.EMPTY, self.EMPTY]
+            for side, child in enumerate(sides):
+                child_box = child.bounding_box(time0, time1)
+                if child_box is None:
+                    print("No bounding box in CompactBVH constructor.")
+                    raise ValueError
+                q_min, q_max = self.quantize(lo, hi, child_box)
+                bounds[idx][side] = np.concatenate([q_min, q_max])
+                c_lo, c_hi = self.decode(lo, hi, bounds[idx][side])
+                if isinstance(child, BVHNode):
+                    refs[side] = flatten(child, c_lo, c_hi)
+                else:
+                    refs[side] = -(len(self.primitives) + 1)
+                    self.primitives.append(child)
+            children[idx] = (refs[0], refs[1])
+            return idx
+
+        flatten(root, self.root_min, self.root_max)
+        self.children: np.ndarray = np.array(children, dtype=np.int32)
+        self.bounds: np.ndarray = np.array(bounds, dtype=self.dtype)
+
+    def quantize(self, lo: np.ndarray, hi: np.ndarray, box: AABB) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        scale = (hi - lo) / self.levels
+        safe_scale = np.where(scale > 0, scale, 1)
+        q_min = np.floor((box.min().e - lo) / safe_scale)
+        q_max = np.ceil((box.max().e - lo) / safe_scale)
+        q_min = np.clip(q_min, 0, self.levels)
+        q_max = np.clip(q_max, 0, self.levels)
+
+        # Step outwards once more if rounding made the decoded box too small
+        q_min = np.where(
+            (lo + q_min * scale > box.min().e) & (q_min > 0), q_min - 1, q_min
+        )
+        q_max = np.where(
+            (lo + q_max * scale < box.max().e) & (q_max < self.levels),
+            q_max + 1, q_max
+        )
+        return q_min.astype(self.dtype), q_max.astype(self.dtype)
+
+    def decode(self, lo: np.ndarray, hi: np.ndarray, q: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        scale = (hi - lo) / self.levels
+        return lo + q[:3] * scale, lo + q[3:] * scale
+
+    def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
+        if not self.box.hit(r, t_min, t_max):
+            return None
+
+        origin: np.ndarray = r.origin().e
+        inv_dir: np.ndarray = np.array(r.inv_dir)
+
+        rec: Optional[HitRecord] = None
+        stack = [(0, self.root_min, self.root_max)]
+        while stack:
+            node, lo, hi = stack.pop()
+            for side in range(2):
+                ref = self.children[node, side]
+                if ref == self.EMPTY:
+                    continue
+                c_lo, c_hi = self.decode(lo, hi, self.bounds[node, side])
+                traversal_stats.box_tests += 1
+                if not self.slab_hit(origin, inv_dir, c_lo, c_hi,
+                                     t_min, t_max):
+                    continue
+                if ref >= 0:
+                    stack.append((ref, c_lo, c_hi))
+                    continue
+                traversal_stats.primitive_tests += 1
+                temp_rec = self.primitives[-ref - 1].hit(r, t_min, t_max)
+                if temp_rec is not None:
+                    rec = temp_rec
+                    t_max = temp_rec.t
+        return rec
+
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        if not self.box.hit(r, t_min, t_max):
+            return False
+
+        origin: np.ndarray = r.origin().e
+        inv_dir: np.ndarray = np.array(r.inv_dir)
+
+        stack = [(0, self.root_min, self.root_max)]
+        while stack:
+            node, lo, hi = stack.pop()
+            for side in range(2):
+                ref = self.children[node, side]
+                if ref == self.EMPTY:
+                    continue
+                c_lo, c_hi = self.decode(lo, hi, self.bounds[node, side])
+                traversal_stats.box_tests += 1
+                if not self.slab_hit(origin, inv_dir, c_lo, c_hi,
+                                     t_min, t_max):
+                    continue
+                if ref >= 0:
+                    stack.append((ref, c_lo, c_hi))
+                    continue
+                traversal_stats.primitive_tests += 1
+                if self.primitives[-ref - 1].occluded(r, t_min, t_max):
+                    return True
+        return False
+
+    def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
+        return self.box
+
+    def nbytes(self) -> int:
+        return (
+            self.children.nbytes + self.bounds.nbytes
+            + self.root_min.nbytes + self.root_max.nbytes
+        )
+
+    @staticmethod
+    def slab_hit(origin: np.ndarray, inv_dir: np.ndarray,
+                 lo: np.ndarray, hi: np.ndarray,
+                 t_min: float, t_max: float) -> bool:
+        t0 = (lo - origin) * inv_dir
+        t1 = (hi - origin) * inv_dir
+        # fmin / fmax skip the NaNs of a ray lying exactly in a slab plane
+        t_near = max(np.fmax.reduce(np.fmin(t0, t1)), t_min)
+        t_far = min(np.fmin.reduce(np.fmax(t0, t1)), t_max)
+        return t_far > t_near
@@ -42,7 +42,7 @@ class ConstantMedium(Hittable):
 
         t = rec1.t + hit_distance / ray_length
         p = r.at(t)
-        rec = HitRecord(p, t, self.phase_function)
+        rec = HitRecord(p, t, self.phase_function, self.object_id)
         rec.normal = Vec3(1, 0, 0)
         rec.front_face = True
 
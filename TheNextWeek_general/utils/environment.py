@@ -0,0 +1,148 @@
+import numpy as np  # type: ignore
+from PIL import Image  # type: ignore
+from typing import Tuple
+from utils.vec3 import Vec3, Color
+from utils.img import read_pfm
+from utils.rtweekend import random_float
+
+
+class EnvironmentMap:
+    """
+    Linear radiance around the scene in an equirectangular (h, w, 3) float
+    array, mapped like the sphere uvs: +y at the top row, u running with
+    the longitude. A 2D CDF over the pixels, a marginal over the rows and a
+    conditional within each row, lets light sampling aim at bright parts
+    of the sky.
+    """
+    def __init__(self, data: np.ndarray, scale: float = 1) -> None:
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim != 3 or data.shape[2] != 3:
+            print("Environment map needs an (h, w, 3) array.")
+            raise ValueError
+        self.data = data * scale
+        self.height, self.width, _ = self.data.shape
+
+        # Pixels weighted by luminance and by the solid angle of their row
+        rows = (np.arange(self.height) + 0.5) / self.height
+        sin_theta = np.sin(np.pi * rows)
+        weight = self.data.mean(axis=2) * sin_theta[:, np.newaxis]
+        row_weight = weight.sum(axis=1)
+        self.total = row_weight.sum()
+        if self.total <= 0:
+            print("Environment map is black, nothing to sample.")
+            raise ValueError
+        self.pmf = weight / self.total
+        self.marginal_cdf = np.concatenate(
+            [[0], np.cumsum(row_weight) / self.total]
+        )
+        self.marginal_cdf[-1] = 1
+        conditional = np.cumsum(weight, axis=1) / np.where(
+            row_weight > 0, row_weight, 1
+        )[:, np.newaxis]
+        conditional[row_weight > 0, -1] = 1
+        self.conditional_cdf = np.concatenate(
+            [np.zeros((self.height, 1)), conditional], axis=1
+        )
+        # Offsetting row j's CDF by j makes all rows one sorted array, so
+        # a single search finds the column in any row
+        self.flat_cdf = (
+            self.conditional_cdf + np.arange(self.height)[:, np.newaxis]
+        ).ravel()
+
+    @classmethod
+    def from_file(cls, filename: str, scale: float = 1) \
+            -> "EnvironmentMap":
+        # Float data as .npy or .pfm, anything else is an 8-bit image
+        # stored with the gamma 2 encoding Img.save writes
+        if filename.endswith(".npy"):
+            return cls(np.load(filename), scale)
+        if filename.endswith(".pfm"):
+            return cls(read_pfm(filename), scale)
+        data = np.asarray(Image.open(filename).convert("RGB")) / 255
+        return cls(data**2, scale)
+
+    @staticmethod
+    def to_uv(directions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        unit = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+        phi = np.arctan2(unit[:, 2], unit[:, 0])
+        theta = np.arcsin(np.clip(unit[:, 1], -1, 1))
+        return 1 - (phi + np.pi) / (2 * np.pi), (theta + np.pi/2) / np.pi
+
+    @staticmethod
+    def from_uv(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        phi = np.pi - 2 * np.pi * u
+        theta = np.pi * v - np.pi/2
+        return np.stack([
+            np.cos(theta) * np.cos(phi), np.sin(theta),
+            np.cos(theta) * np.sin(phi)
+        ], axis=1)
+
+    def pixels(self, directions: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        # Row and column of each direction
+        u, v = self.to_uv(directions)
+        i = np.clip((u * self.width).astype(np.int64), 0, self.width - 1)
+        j = np.clip(
+            ((1 - v) * self.height).astype(np.int64), 0, self.height - 1
+        )
+        return j, i
+
+    def lookup(self, directions: np.ndarray) -> np.ndarray:
+        # Radiance arriving along each of the (n, 3) directions
+        j, i = self.pixels(directions)
+        return self.data[j, i]
+
+    def sample(self, u1: np.ndarray, u2: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Unit directions (n, 3) and their solid angle pdfs for uniform u1
+        and u2, the row from u1 and the column within it from u2. What is
+        left of each number after the search places the direction inside
+        its pixel.
+        """
+        j = np.searchsorted(self.marginal_cdf, u1, side="right") - 1
+        j = np.clip(j, 0, self.height - 1)
+        i = np.searchsorted(self.flat_cdf, u2 + j, side="right") - 1 \
+            - j * (self.width + 1)
+        i = np.clip(i, 0, self.width - 1)
+
+        row_lo = self.marginal_cdf[j]
+        row_width = self.marginal_cdf[j + 1] - row_lo
+        col_lo = self.conditional_cdf[j, i]
+        col_width = self.conditional_cdf[j, i + 1] - col_lo
+        du = np.clip((u2 - col_lo) / np.where(col_width > 0, col_width, 1),
+                     0, 1)
+        dv = np.clip((u1 - row_lo) / np.where(row_width > 0, row_width, 1),
+                     0, 1)
+        u = (i + du) / self.width
+        v = 1 - (j + dv) / self.height
+        directions = self.from_uv(u, v)
+        return directions, self.density(j, i, v)
+
+    def density(self, j: np.ndarray, i: np.ndarray, v: np.ndarray) \
+            -> np.ndarray:
+        # The pmf spread over the pixel, then from the uv square to the
+        # sphere, where du dv covers 2 pi**2 cos(latitude) of solid angle
+        cos_latitude = np.cos(np.pi * v - np.pi/2)
+        return np.where(
+            cos_latitude > 0,
+            self.pmf[j, i] * self.width * self.height
+            / (2 * np.pi**2 * np.where(cos_latitude > 0, cos_latitude, 1)),
+            0
+        )
+
+    def pdf(self, directions: np.ndarray) -> np.ndarray:
+        j, i = self.pixels(directions)
+        return self.density(j, i, self.to_uv(directions)[1])
+
+    def value(self, direction: Vec3) -> Color:
+        return Color(*self.lookup(direction.e[np.newaxis])[0])
+
+    def pdf_value(self, direction: Vec3) -> float:
+        return float(self.pdf(direction.e[np.newaxis])[0])
+
+    def random(self) -> Vec3:
+        directions, _ = self.sample(
+            np.array([random_float()]), np.array([random_float()])
+        )
+        return Vec3(*directions[0])
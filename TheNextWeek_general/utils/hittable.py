@@ -5,6 +5,7 @@ from typing import Optional
 from utils.vec3 import Vec3, Point3
 from utils.ray import Ray
 from utils.aabb import AABB
+from utils.transform import Transform
 from utils.rtweekend import degrees_to_radians
 
 import typing
@@ -13,10 +14,12 @@ if typing.TYPE_CHECKING:
 
 
 class HitRecord:
-    def __init__(self, point: Point3, t: float, mat: Material) -> None:
+    def __init__(self, point: Point3, t: float, mat: Material,
+                 object_id: int = -1) -> None:
         self.p = point
         self.t = t
         self.material = mat
+        self.object_id = object_id
         self.normal: Vec3
         self.front_face: bool
         self.u: float = 0
@@ -29,6 +32,8 @@ class HitRecord:
 
 
 class Hittable(ABC):
+    object_id = -1  # set by aov.assign_ids
+
     @abstractmethod
     def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
         return NotImplemented
@@ -37,6 +42,17 @@ class Hittable(ABC):
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         return NotImplemented
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        # Any hit in (t_min, t_max) will do, override to skip the record
+        return self.hit(r, t_min, t_max) is not None
+
+    def pdf_value(self, origin: Point3, direction: Vec3) -> float:
+        # Solid angle density of random() from origin, for light sampling
+        return 0
+
+    def random(self, origin: Point3) -> Vec3:
+        return Vec3(1, 0, 0)
+
 
 class FlipFace(Hittable):
     def __init__(self, obj: Hittable):
@@ -49,6 +65,9 @@ class FlipFace(Hittable):
         rec.front_face = not rec.front_face
         return rec
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        return self.obj.occluded(r, t_min, t_max)
+
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         return self.obj.bounding_box(t0, t1)
 
@@ -70,6 +89,10 @@ class Translate(Hittable):
         rec.set_face_normal(moved_r, rec.normal)
         return rec
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        moved_r = Ray(r.origin() - self.offset, r.direction(), r.time())
+        return self.obj.occluded(moved_r, t_min, t_max)
+
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         box = self.obj.bounding_box(t0, t1)
         if box is None:
@@ -113,7 +136,7 @@ class RotateY(Hittable):
 
         self.bbox = AABB(point_min, point_max)
 
-    def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
+    def rotate_ray(self, r: Ray) -> Ray:
         origin = r.origin().copy()
         direction = r.direction().copy()
 
@@ -124,7 +147,10 @@ class RotateY(Hittable):
         direction[2] = \
             self.sin_theta*r.direction()[0] + self.cos_theta*r.direction()[2]
 
-        rotated_r = Ray(origin, direction, r.time())
+        return Ray(origin, direction, r.time())
+
+    def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
+        rotated_r = self.rotate_ray(r)
         rec = self.obj.hit(rotated_r, t_min, t_max)
         if rec is None:
             return None
@@ -144,5 +170,41 @@ class RotateY(Hittable):
 
         return rec
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        return self.obj.occluded(self.rotate_ray(r), t_min, t_max)
+
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         return self.bbox
+
+
+class Instance(Hittable):
+    """
+    Places a shared object, usually a BVHNode, in the world through an
+    affine transform. Rays are moved into object space instead of copying
+    the geometry, so any number of instances cost its memory only once.
+    """
+    def __init__(self, obj: Hittable, transform: Transform,
+                 time0: float = 0, time1: float = 1) -> None:
+        self.obj = obj
+        self.transform = transform
+        box = obj.bounding_box(time0, time1)
+        if box is None:
+            print("No bounding box in Instance constructor.")
+            raise ValueError
+        self.box = transform.box(box)
+
+    def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
+        # Directions are not renormalized, so t is the same in both spaces
+        rec = self.obj.hit(self.transform.inverse_ray(r), t_min, t_max)
+        if rec is None:
+            return None
+        rec.p = r.at(rec.t)
+        # The stored normal already faces the ray, front_face stays valid
+        rec.normal = self.transform.normal(rec.normal)
+        return rec
+
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        return self.obj.occluded(self.transform.inverse_ray(r), t_min, t_max)
+
+    def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
+        return self.box
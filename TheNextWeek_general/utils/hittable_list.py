@@ -28,6 +28,9 @@ class HittableList(Hittable):
 
         return rec
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        return any(obj.occluded(r, t_min, t_max) for obj in self.objects)
+
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         if not self.objects:
             return None
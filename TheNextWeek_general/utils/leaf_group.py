@@ -0,0 +1,181 @@
+from __future__ import annotations
+import numpy as np  # type: ignore
+from typing import Optional, List, Tuple
+from utils.vec3 import Vec3
+from utils.ray import Ray
+from utils.hittable import Hittable, HitRecord
+from utils.aabb import AABB
+from utils.sphere import Sphere
+from utils.moving_sphere import MovingSphere
+from utils.aarect import XYRect, XZRect, YZRect
+
+
+class LeafGroup(Hittable):
+    """
+    A BVH leaf holding several primitives of one kind as small arrays,
+    intersected with a single vectorized call.
+    """
+    def __init__(self, objects: List[Hittable], time0: float, time1: float) \
+            -> None:
+        self.objects = objects
+        self.box_times = (time0, time1)
+        self.box: AABB = self.objects_box(time0, time1)
+
+    def objects_box(self, t0: float, t1: float) -> AABB:
+        boxes = [obj.bounding_box(t0, t1) for obj in self.objects]
+        box = boxes[0]
+        for other in boxes[1:]:
+            box = AABB.surrounding_box(box, other)
+        return box
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
+        if (t0, t1) == self.box_times:
+            return self.box
+        return self.objects_box(t0, t1)
+
+    @staticmethod
+    def from_objects(objects: List[Hittable], time0: float, time1: float) \
+            -> Optional[LeafGroup]:
+        # Only primitives of one batchable kind can share a leaf
+        if all(isinstance(obj, (Sphere, MovingSphere)) for obj in objects):
+            return SphereGroup(objects, time0, time1)
+        for rect_type in (XYRect, XZRect, YZRect):
+            if all(type(obj) is rect_type for obj in objects):
+                return RectGroup(objects, time0, time1)
+        return None
+
+
+class SphereGroup(LeafGroup):
+    def __init__(self, objects: List[Hittable], time0: float, time1: float) \
+            -> None:
+        super().__init__(objects, time0, time1)
+        n = len(objects)
+        self.center0 = np.empty((n, 3), dtype=np.float64)
+        self.center1 = np.empty((n, 3), dtype=np.float64)
+        self.time0 = np.zeros(n, dtype=np.float64)
+        self.time1 = np.ones(n, dtype=np.float64)
+        self.radius = np.empty(n, dtype=np.float64)
+        self.static = np.empty(n, dtype=bool)
+        for i, obj in enumerate(objects):
+            if isinstance(obj, MovingSphere):
+                self.center0[i] = obj.center0.e
+                self.center1[i] = obj.center1.e
+                self.time0[i] = obj.time0
+                self.time1[i] = obj.time1
+            else:
+                self.center0[i] = self.center1[i] = obj.center.e
+            self.radius[i] = obj.radius
+            self.static[i] = isinstance(obj, Sphere)
+        self.moving = bool((self.center0 != self.center1).any())
+        self.radius_squared = self.radius**2
+        self.materials = [obj.material for obj in objects]
+
+    def centers(self, r: Ray) -> np.ndarray:
+        if not self.moving:
+            return self.center0
+        s = (r.time() - self.time0) / (self.time1 - self.time0)
+        return self.center0 + s[:, np.newaxis] * (self.center1 - self.center0)
+
+    def roots(self, r: Ray, center: np.ndarray, t_min: float, t_max: float) \
+            -> Optional[np.ndarray]:
+        # Nearest root in (t_min, t_max) per sphere, inf where there is none
+        oc = r.origin().e - center
+        direction = r.direction().e
+        a: float = direction @ direction
+        half_b = oc @ direction
+        c = (oc * oc).sum(axis=1) - self.radius_squared
+        discriminant = half_b**2 - a*c
+
+        candidate = discriminant > 0
+        if not candidate.any():
+            return None
+        root = np.sqrt(np.where(candidate, discriminant, 0))
+        t_0 = (-half_b - root) / a
+        t_1 = (-half_b + root) / a
+        t_0_ok = candidate & (t_min < t_0) & (t_0 < t_max)
+        t_1_ok = candidate & (t_min < t_1) & (t_1 < t_max)
+        return np.where(t_0_ok, t_0, np.where(t_1_ok, t_1, np.inf))
+
+    def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
+        center = self.centers(r)
+        t = self.roots(r, center, t_min, t_max)
+        if t is None:
+            return None
+
+        i = int(np.argmin(t))
+        if t[i] == np.inf:
+            return None
+        point = r.at(t[i])
+        outward_normal: Vec3 = (point - Vec3(*center[i])) / self.radius[i]
+        rec = HitRecord(
+            point, t[i], self.materials[i], self.objects[i].object_id
+        )
+        rec.set_face_normal(r, outward_normal)
+        if self.static[i]:
+            rec.u, rec.v = Sphere.get_sphere_uv(outward_normal)
+        return rec
+
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        t = self.roots(r, self.centers(r), t_min, t_max)
+        return t is not None and bool((t < np.inf).any())
+
+
+class RectGroup(LeafGroup):
+    # (first in-plane axis, second in-plane axis, normal axis)
+    AXES = {XYRect: (0, 1, 2), XZRect: (0, 2, 1), YZRect: (1, 2, 0)}
+
+    def __init__(self, objects: List[Hittable], time0: float, time1: float) \
+            -> None:
+        super().__init__(objects, time0, time1)
+        self.axis_a, self.axis_b, self.axis_k = self.AXES[type(objects[0])]
+        bounds = np.array([
+            [getattr(obj, name) for name in self.bound_names(obj)]
+            for obj in objects
+        ], dtype=np.float64)
+        self.a0, self.a1, self.b0, self.b1, self.k = bounds.T
+        self.normal = Vec3(*np.eye(3)[self.axis_k])
+        self.materials = [obj.material for obj in objects]
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        origin = r.origin().e
+        direction = r.direction().e
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (self.k - origin[self.axis_k]) / direction[self.axis_k]
+        a = origin[self.axis_a] + t*direction[self.axis_a]
+        b = origin[self.axis_b] + t*direction[self.axis_b]
+        inside = (
+            (t >= t_min) & (t <= t_max)
+            & (a >= self.a0) & (a <= self.a1)
+            & (b >= self.b0) & (b <= self.b1)
+        )
+        return t, a, b, inside
+
+    def hit(self, r: Ray, t_min: float, t_max: float) -> Optional[HitRecord]:
+        t, a, b, inside = self.intersect(r, t_min, t_max)
+        if not inside.any():
+            return None
+
+        t = np.where(inside, t, np.inf)
+        i = int(np.argmin(t))
+        rec = HitRecord(
+            r.at(t[i]), t[i], self.materials[i], self.objects[i].object_id
+        )
+        rec.set_face_normal(r, self.normal)
+        rec.u = (a[i] - self.a0[i]) / (self.a1[i] - self.a0[i])
+        rec.v = (b[i] - self.b0[i]) / (self.b1[i] - self.b0[i])
+        return rec
+
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        return bool(self.intersect(r, t_min, t_max)[3].any())
+
+    @staticmethod
+    def bound_names(obj: Hittable) -> List[str]:
+        if isinstance(obj, XYRect):
+            return ["x0", "x1", "y0", "y1", "k"]
+        if isinstance(obj, XZRect):
+            return ["x0", "x1", "z0", "z1", "k"]
+        return ["y0", "y1", "z0", "z1", "k"]
@@ -0,0 +1,181 @@
+from typing import List, Optional, Set, Tuple
+import numpy as np  # type: ignore
+from utils.vec3 import Vec3, Point3, Color
+from utils.ray import Ray
+from utils.hittable import Hittable, HitRecord, FlipFace
+from utils.hittable_list import HittableList
+from utils.bvh import BVHNode
+from utils.compact_bvh import CompactBVH
+from utils.leaf_group import LeafGroup
+from utils.aarect import XYRect, XZRect, YZRect
+from utils.sphere import Sphere
+from utils.material import Material, DiffuseLight
+from utils.environment import EnvironmentMap
+from utils.rtweekend import random_int, random_float
+
+
+def mis_weight(pdf: float, other_pdf: float, power: float = 2) -> float:
+    # Power heuristic, the balance heuristic with power 1
+    if pdf <= 0:
+        return 0
+    return pdf**power / (pdf**power + other_pdf**power)
+
+
+class LightList:
+    """
+    The emitters of a scene that can be sampled directly, picked uniformly.
+    Emission from the materials in covered is found by light sampling
+    after a diffuse hit, so the integrator must not add it again when a
+    bounce from that hit runs into the light.
+    An environment map is sampled as one more light, taking half the
+    samples when there are shapes too.
+    """
+    SHAPES = (XYRect, XZRect, YZRect, Sphere)
+
+    def __init__(self, lights: List[Hittable],
+                 environment: Optional[EnvironmentMap] = None) -> None:
+        self.lights = lights
+        self.covered: Set[int] = {id(light.material) for light in lights}
+        self.environment = environment
+        if environment is None:
+            self.environment_probability = 0.0
+        else:
+            self.environment_probability = 0.5 if lights else 1.0
+
+    def __len__(self) -> int:
+        return len(self.lights)
+
+    @classmethod
+    def from_world(cls, world: Hittable,
+                   environment: Optional[EnvironmentMap] = None) \
+            -> "LightList":
+        # Walk the scene down to its shapes. An emitter behind a transform
+        # can't be sampled, and neither can anything sharing its material.
+        lights: List[Hittable] = list()
+        unsampled: Set[int] = set()
+
+        def walk(obj: Hittable) -> None:
+            if isinstance(obj, HittableList):
+                children = obj.objects
+            elif isinstance(obj, BVHNode):
+                children = [obj.left] if obj.left is obj.right \
+                    else [obj.left, obj.right]
+            elif isinstance(obj, LeafGroup):
+                children = obj.objects
+            elif isinstance(obj, CompactBVH):
+                children = obj.primitives
+            elif isinstance(obj, FlipFace):
+                children = [obj.obj]
+            else:
+                material: Optional[Material] = getattr(obj, "material", None)
+                if isinstance(material, DiffuseLight):
+                    if isinstance(obj, LightList.SHAPES):
+                        lights.append(obj)
+                    else:
+                        unsampled.add(id(material))
+                return
+            for child in children:
+                walk(child)
+
+        walk(world)
+        return cls([
+            light for light in lights if id(light.material) not in unsampled
+        ], environment)
+
+    def covers(self, material: Material) -> bool:
+        return id(material) in self.covered
+
+    def pick(self, origin: Point3) -> Tuple[Hittable, float]:
+        # A light to sample from origin, with its selection probability
+        return self.lights[random_int(0, len(self.lights) - 1)], \
+            1 / len(self.lights)
+
+    def shape_pdf(self, origin: Point3, direction: Vec3) -> float:
+        if not self.lights:
+            return 0
+        return sum(
+            light.pdf_value(origin, direction) for light in self.lights
+        ) / len(self.lights)
+
+    def pdf_value(self, origin: Point3, direction: Vec3) -> float:
+        # Density of the whole light sampling strategy, not just of the
+        # light that produced direction
+        pdf = 0.0
+        if self.environment_probability < 1:
+            pdf += (1 - self.environment_probability) \
+                * self.shape_pdf(origin, direction)
+        if self.environment is not None:
+            pdf += self.environment_probability \
+                * self.environment.pdf_value(direction)
+        return pdf
+
+    def blocked_emission(self, to_light: Ray, t_max: float,
+                         world: Hittable) -> Optional[Color]:
+        """
+        None when nothing is in the way of to_light before t_max, else
+        what the first thing hit sends back: its emission if it is a
+        covered light, black if not. pdf_value counts every light a
+        direction reaches, so a light in front of the sampled one or of
+        the sky must still be added.
+        """
+        if not world.occluded(to_light, 0.001, t_max):
+            return None
+        blocker = world.hit(to_light, 0.001, t_max)
+        if blocker is None or not self.covers(blocker.material):
+            return Color(0, 0, 0)
+        return blocker.material.emitted(blocker.u, blocker.v, blocker.p)
+
+    def sample_direct(self, r_in: Ray, rec: HitRecord,
+                      world: Hittable) -> Optional[Color]:
+        """
+        One light sample of the direct light leaving rec toward r_in, None
+        if the material can't be lit this way. It carries its MIS weight
+        against the BSDF sample taken at the same hit.
+        """
+        if not self.lights and self.environment is None:
+            return None
+        if self.environment is not None \
+                and random_float() < self.environment_probability:
+            return self.sample_environment(r_in, rec, world)
+        light, _ = self.pick(rec.p)
+        direction = light.random(rec.p)
+        f = rec.material.bsdf(r_in, rec, direction)
+        if f is None:
+            return None
+
+        to_light = Ray(rec.p, direction, r_in.time())
+        light_rec = light.hit(to_light, 0.001, np.inf)
+        pdf = self.pdf_value(rec.p, direction)
+        if light_rec is None or pdf <= 0:
+            return Color(0, 0, 0)
+        # Stop short of the light itself
+        emitted = self.blocked_emission(
+            to_light, light_rec.t * (1 - 1e-6), world
+        )
+        if emitted is None:
+            emitted = light_rec.material.emitted(
+                light_rec.u, light_rec.v, light_rec.p
+            )
+        weight = mis_weight(
+            pdf, rec.material.scattering_pdf(r_in, rec, to_light)
+        )
+        return f * emitted * (weight / pdf)
+
+    def sample_environment(self, r_in: Ray, rec: HitRecord,
+                           world: Hittable) -> Optional[Color]:
+        # The sky is lit only where nothing in the scene is in the way
+        direction = self.environment.random()
+        f = rec.material.bsdf(r_in, rec, direction)
+        if f is None:
+            return None
+        to_light = Ray(rec.p, direction, r_in.time())
+        pdf = self.pdf_value(rec.p, direction)
+        if pdf <= 0:
+            return Color(0, 0, 0)
+        emitted = self.blocked_emission(to_light, np.inf, world)
+        if emitted is None:
+            emitted = self.environment.value(direction)
+        weight = mis_weight(
+            pdf, rec.material.scattering_pdf(r_in, rec, to_light)
+        )
+        return f * emitted * (weight / pdf)
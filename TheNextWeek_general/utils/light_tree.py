@@ -0,0 +1,156 @@
+import numpy as np  # type: ignore
+from typing import List, Optional, Tuple
+from utils.vec3 import Vec3, Point3
+from utils.ray import Ray
+from utils.hittable import Hittable
+from utils.aabb import AABB
+from utils.sphere import Sphere
+from utils.light_list import LightList
+from utils.environment import EnvironmentMap
+from utils.rtweekend import random_float
+
+
+def light_power(light: Hittable) -> float:
+    # Emitted luminance times area, the mean of the emission texture is
+    # taken at the middle of the light
+    if isinstance(light, Sphere):
+        area = 4 * np.pi * light.radius**2
+        center = light.center
+    else:
+        lo, hi = light.bounding_box(0, 1).bounds
+        extent = sorted(np.subtract(hi, lo))
+        area = extent[1] * extent[2]
+        center = Point3(*np.add(lo, hi) / 2)
+    color = light.material.emitted(0.5, 0.5, center)
+    return area * float(np.mean(color.e))
+
+
+class LightTree(LightList):
+    """
+    A binary tree over the lights, each node holding the bounds and total
+    power of its lights. Picking walks down from the root and takes each
+    child in proportion to power / distance**2 from the shading point,
+    the distance kept at least the half-diagonal of the child's bounds.
+    The emitters shine from both faces, so there are no orientation
+    bounds to add.
+    Nodes are stored as flat arrays, so select() can walk a whole batch
+    of points down the tree at once.
+    """
+    def __init__(self, lights: List[Hittable],
+                 environment: Optional[EnvironmentMap] = None) -> None:
+        super().__init__(lights, environment)
+        if not lights:
+            return
+        boxes = [light.bounding_box(0, 1) for light in lights]
+        light_lo = np.array([box.bounds[0] for box in boxes])
+        light_hi = np.array([box.bounds[1] for box in boxes])
+        power = np.array([light_power(light) for light in lights])
+
+        lo: List[np.ndarray] = list()
+        hi: List[np.ndarray] = list()
+        node_power: List[float] = list()
+        # children, or -1 and the light index for a leaf
+        children: List[Tuple[int, int]] = list()
+
+        def build(items: np.ndarray) -> int:
+            node = len(children)
+            lo.append(light_lo[items].min(axis=0))
+            hi.append(light_hi[items].max(axis=0))
+            node_power.append(power[items].sum())
+            children.append((-1, int(items[0])))
+            if len(items) == 1:
+                return node
+            centroid = (light_lo[items] + light_hi[items]) / 2
+            axis = int(np.argmax(np.ptp(centroid, axis=0)))
+            items = items[np.argsort(centroid[:, axis], kind="stable")]
+            half = len(items) // 2
+            left = build(items[:half])
+            right = build(items[half:])
+            children[node] = (left, right)
+            return node
+
+        build(np.arange(len(lights)))
+        self.lo: np.ndarray = np.array(lo)
+        self.hi: np.ndarray = np.array(hi)
+        self.center: np.ndarray = (self.lo + self.hi) / 2
+        self.radius_squared: np.ndarray = \
+            ((self.hi - self.lo)**2).sum(axis=1) / 4
+        self.power: np.ndarray = np.array(node_power)
+        self.children: np.ndarray = np.array(children, dtype=np.int64)
+        self.boxes = [
+            AABB(Point3(*lo), Point3(*hi)) for lo, hi in zip(self.lo, self.hi)
+        ]
+
+    def importance(self, points: np.ndarray, nodes: np.ndarray) \
+            -> np.ndarray:
+        distance_squared = ((points - self.center[nodes])**2).sum(axis=1)
+        return self.power[nodes] \
+            / np.maximum(distance_squared, self.radius_squared[nodes])
+
+    def left_probability(self, points: np.ndarray, nodes: np.ndarray) \
+            -> np.ndarray:
+        left = self.children[nodes, 0]
+        right = self.children[nodes, 1]
+        importance_left = self.importance(points, left)
+        total = importance_left + self.importance(points, right)
+        return np.where(
+            total > 0, importance_left / np.where(total > 0, total, 1), 0.5
+        )
+
+    def select(self, points: np.ndarray, u: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Light index and selection probability for each of the (n, 3)
+        points, with u uniform in [0, 1) driving the choices. The same u
+        is rescaled at each level, so one number per point suffices.
+        """
+        nodes = np.zeros(len(points), dtype=np.int64)
+        pmf = np.ones(len(points))
+        u = u.copy()
+        inner = self.children[nodes, 0] >= 0
+        while inner.any():
+            idx = np.where(inner)[0]
+            p_left = self.left_probability(points[idx], nodes[idx])
+            go_left = u[idx] < p_left
+            nodes[idx] = np.where(
+                go_left, self.children[nodes[idx], 0],
+                self.children[nodes[idx], 1]
+            )
+            pmf[idx] *= np.where(go_left, p_left, 1 - p_left)
+            u[idx] = np.where(
+                go_left, u[idx] / np.where(p_left > 0, p_left, 1),
+                (u[idx] - p_left) / np.where(p_left < 1, 1 - p_left, 1)
+            )
+            u[idx] = np.clip(u[idx], 0, np.nextafter(1, 0))
+            inner = self.children[nodes, 0] >= 0
+        return self.children[nodes, 1], pmf
+
+    def pick(self, origin: Point3) -> Tuple[Hittable, float]:
+        light_idx, pmf = self.select(
+            origin.e[np.newaxis], np.array([random_float()])
+        )
+        return self.lights[light_idx[0]], float(pmf[0])
+
+    def shape_pdf(self, origin: Point3, direction: Vec3) -> float:
+        # Only lights whose subtree bounds the ray crosses can have made
+        # the direction
+        if not self.lights:
+            return 0
+        r = Ray(origin, direction)
+        point = origin.e[np.newaxis]
+        pdf = 0.0
+        stack = [(0, 1.0)]
+        while stack:
+            node, pmf = stack.pop()
+            if not self.boxes[node].hit(r, 0.001, np.inf):
+                continue
+            left, right = self.children[node]
+            if left < 0:
+                pdf += pmf * self.lights[right].pdf_value(origin, direction)
+                continue
+            p_left = float(
+                self.left_probability(point, np.array([node]))[0]
+            )
+            stack.append((left, pmf * p_left))
+            stack.append((right, pmf * (1 - p_left)))
+        return pdf
@@ -6,9 +6,12 @@ from utils.vec3 import Vec3, Color, Point3
 from utils.hittable import HitRecord
 from utils.rtweekend import random_float
 from utils.texture import Texture
+from utils.onb import ONB
 
 
 class Material(ABC):
+    material_id = -1  # set by aov.assign_ids
+
     @abstractmethod
     def scatter(self, r_in: Ray, rec: HitRecord) \
             -> Optional[Tuple[Ray, Color]]:
@@ -17,31 +20,102 @@ class Material(ABC):
     def emitted(self, u: float, v: float, p: Point3) -> Color:
         return Color(0, 0, 0)
 
+    def albedo_value(self, rec: HitRecord) -> Color:
+        # Surface color at the hit, the texture a denoiser keeps sharp
+        return Color(1, 1, 1)
+
+    def bsdf(self, r_in: Ray, rec: HitRecord, direction: Vec3) \
+            -> Optional[Color]:
+        # BSDF times the cosine toward direction, used to weigh sampled
+        # lights. None for materials light sampling can't handle.
+        return None
+
+    def scattering_pdf(self, r_in: Ray, rec: HitRecord,
+                       scattered: Ray) -> float:
+        # Solid angle density of scatter() producing scattered, 0 for
+        # specular materials that have none
+        return 0
+
+    def sample(self, r_in: Ray, rec: HitRecord) \
+            -> Optional[Tuple[Vec3, float, Color]]:
+        # A scattered direction with its pdf and bsdf value, None when the
+        # material only has scatter()
+        return None
+
+    def scatter_sample(self, r_in: Ray, rec: HitRecord) \
+            -> Optional[Tuple[Ray, Color]]:
+        # scatter() for materials implementing sample()
+        sample = self.sample(r_in, rec)
+        if sample is None:
+            return None
+        direction, pdf, f = sample
+        return Ray(rec.p, direction, r_in.time()), f / pdf
+
 
 class Lambertian(Material):
     def __init__(self, a: Texture) -> None:
         self.albedo = a
 
+    def albedo_value(self, rec: HitRecord) -> Color:
+        return self.albedo.value(rec.u, rec.v, rec.p)
+
     def scatter(self, r_in: Ray, rec: HitRecord) \
             -> Optional[Tuple[Ray, Color]]:
+        return self.scatter_sample(r_in, rec)
+
+    def sample(self, r_in: Ray, rec: HitRecord) \
+            -> Optional[Tuple[Vec3, float, Color]]:
         if not rec.front_face:
             return None
-        scatter_direction: Vec3 = rec.normal + Vec3.random_unit_vector()
-        scattered = Ray(rec.p, scatter_direction, r_in.time())
-        attenuation = self.albedo.value(rec.u, rec.v, rec.p)
-        return scattered, attenuation
+        direction = ONB(rec.normal).local(Vec3.random_cosine_direction())
+        cosine = rec.normal @ direction
+        if cosine <= 0:
+            return None
+        albedo = self.albedo.value(rec.u, rec.v, rec.p)
+        return direction, cosine / np.pi, albedo * (cosine / np.pi)
+
+    def bsdf(self, r_in: Ray, rec: HitRecord, direction: Vec3) \
+            -> Optional[Color]:
+        cosine = rec.normal @ direction.unit_vector()
+        if cosine <= 0:
+            return Color(0, 0, 0)
+        return self.albedo.value(rec.u, rec.v, rec.p) * (cosine / np.pi)
+
+    def scattering_pdf(self, r_in: Ray, rec: HitRecord,
+                       scattered: Ray) -> float:
+        cosine = rec.normal @ scattered.direction().unit_vector()
+        return max(cosine, 0) / np.pi
 
 
 class Hemisphere(Material):
     def __init__(self, a: Color) -> None:
         self.albedo = a
 
+    def albedo_value(self, rec: HitRecord) -> Color:
+        return self.albedo
+
     def scatter(self, r_in: Ray, rec: HitRecord) \
             -> Optional[Tuple[Ray, Color]]:
-        scatter_direction: Vec3 = Vec3.random_in_hemisphere(rec.normal)
-        scattered = Ray(rec.p, scatter_direction)
-        attenuation = self.albedo
-        return scattered, attenuation
+        return self.scatter_sample(r_in, rec)
+
+    def sample(self, r_in: Ray, rec: HitRecord) \
+            -> Optional[Tuple[Vec3, float, Color]]:
+        # Uniform directions weighted by a flat albedo / 2 pi, which
+        # keeps the plain albedo as attenuation
+        direction = Vec3.random_in_hemisphere(rec.normal).unit_vector()
+        return direction, 1 / (2 * np.pi), self.albedo / (2 * np.pi)
+
+    def bsdf(self, r_in: Ray, rec: HitRecord, direction: Vec3) \
+            -> Optional[Color]:
+        if rec.normal @ direction <= 0:
+            return Color(0, 0, 0)
+        return self.albedo / (2 * np.pi)
+
+    def scattering_pdf(self, r_in: Ray, rec: HitRecord,
+                       scattered: Ray) -> float:
+        if rec.normal @ scattered.direction() <= 0:
+            return 0
+        return 1 / (2 * np.pi)
 
 
 class Metal(Material):
@@ -49,6 +123,9 @@ class Metal(Material):
         self.albedo = a
         self.fuzz = f if f < 1 else 1
 
+    def albedo_value(self, rec: HitRecord) -> Color:
+        return self.albedo
+
     def scatter(self, r_in: Ray, rec: HitRecord) \
             -> Optional[Tuple[Ray, Color]]:
         reflected: Vec3 = r_in.direction().unit_vector().reflect(rec.normal) \
@@ -113,8 +190,25 @@ class Isotropic(Material):
     def __init__(self, a: Texture) -> None:
         self.albedo = a
 
+    def albedo_value(self, rec: HitRecord) -> Color:
+        return self.albedo.value(rec.u, rec.v, rec.p)
+
     def scatter(self, r_in: Ray, rec: HitRecord) \
             -> Optional[Tuple[Ray, Color]]:
-        scattered = Ray(rec.p, Vec3.random_in_unit_sphere(), r_in.time())
-        attenuation = self.albedo.value(rec.u, rec.v, rec.p)
-        return scattered, attenuation
+        return self.scatter_sample(r_in, rec)
+
+    def sample(self, r_in: Ray, rec: HitRecord) \
+            -> Optional[Tuple[Vec3, float, Color]]:
+        albedo = self.albedo.value(rec.u, rec.v, rec.p)
+        return (
+            Vec3.random_unit_vector(), 1 / (4 * np.pi),
+            albedo / (4 * np.pi)
+        )
+
+    def bsdf(self, r_in: Ray, rec: HitRecord, direction: Vec3) \
+            -> Optional[Color]:
+        return self.albedo.value(rec.u, rec.v, rec.p) / (4 * np.pi)
+
+    def scattering_pdf(self, r_in: Ray, rec: HitRecord,
+                       scattered: Ray) -> float:
+        return 1 / (4 * np.pi)
@@ -41,12 +41,26 @@ class MovingSphere(Hittable):
                 (point - self.center(r.time())) / self.radius
             )
 
-            rec = HitRecord(point, t, self.material)
+            rec = HitRecord(point, t, self.material, self.object_id)
             rec.set_face_normal(r, outward_normal)
             return rec
 
         return None
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        oc: Vec3 = r.origin() - self.center(r.time())
+        a: float = r.direction().length_squared()
+        half_b: float = oc @ r.direction()
+        c: float = oc.length_squared() - self.radius**2
+        discriminant: float = half_b**2 - a*c
+        if discriminant <= 0:
+            return False
+        root: float = np.sqrt(discriminant)
+        return (
+            t_min < (-half_b - root) / a < t_max
+            or t_min < (-half_b + root) / a < t_max
+        )
+
     def center(self, time: float) -> Point3:
         return (
             self.center0 + (
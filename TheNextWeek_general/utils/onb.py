@@ -0,0 +1,16 @@
+from utils.vec3 import Vec3
+
+
+class ONB:
+    """
+    Orthonormal basis around w, for turning directions sampled around the
+    z axis into directions around a normal.
+    """
+    def __init__(self, n: Vec3) -> None:
+        self.w = n.unit_vector()
+        a = Vec3(0, 1, 0) if abs(self.w.x()) > 0.9 else Vec3(1, 0, 0)
+        self.v = self.w.cross(a).unit_vector()
+        self.u = self.w.cross(self.v)
+
+    def local(self, a: Vec3) -> Vec3:
+        return self.u * a.x() + self.v * a.y() + self.w * a.z()
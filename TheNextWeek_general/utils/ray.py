@@ -1,3 +1,5 @@
+import numpy as np  # type: ignore
+from typing import List
 from utils.vec3 import Vec3, Point3
 
 
@@ -8,6 +10,11 @@ class Ray:
         self.orig = origin
         self.dir = direction
         self.tm = time
+        # Precomputed for the slab tests of the acceleration structures
+        self.orig_list: List[float] = origin.e.tolist()
+        with np.errstate(divide="ignore"):
+            self.inv_dir: List[float] = (1 / direction.e).tolist()
+        self.sign: List[int] = [int(d < 0) for d in self.inv_dir]
 
     def origin(self) -> Point3:
         return self.orig
@@ -3,6 +3,15 @@ rng = np.random.default_rng()
 
 
 # Utility Functions
+def seed(entropy: int, *key: int) -> None:
+    # Restart the stream from entropy, a separate one for each key, so
+    # every (pass, row) of a render draws the same numbers in any process
+    global rng
+    rng = np.random.default_rng(
+        np.random.SeedSequence(entropy, spawn_key=key)
+    )
+
+
 def degrees_to_radians(degrees: float) -> float:
     return degrees * np.pi / 180
 
@@ -5,6 +5,8 @@ from utils.ray import Ray
 from utils.hittable import Hittable, HitRecord
 from utils.material import Material
 from utils.aabb import AABB
+from utils.rtweekend import random_float
+from utils.onb import ONB
 
 
 class Sphere(Hittable):
@@ -35,13 +37,27 @@ class Sphere(Hittable):
             point: Point3 = r.at(t)
             outward_normal: Vec3 = (point - self.center) / self.radius
 
-            rec = HitRecord(point, t, self.material)
+            rec = HitRecord(point, t, self.material, self.object_id)
             rec.set_face_normal(r, outward_normal)
             rec.u, rec.v = self.get_sphere_uv(outward_normal)
             return rec
 
         return None
 
+    def occluded(self, r: Ray, t_min: float, t_max: float) -> bool:
+        oc: Vec3 = r.origin() - self.center
+        a: float = r.direction().length_squared()
+        half_b: float = oc @ r.direction()
+        c: float = oc.length_squared() - self.radius**2
+        discriminant: float = half_b**2 - a*c
+        if discriminant <= 0:
+            return False
+        root: float = np.sqrt(discriminant)
+        return (
+            t_min < (-half_b - root) / a < t_max
+            or t_min < (-half_b + root) / a < t_max
+        )
+
     def bounding_box(self, t0: float, t1: float) -> Optional[AABB]:
         radius_vec = Vec3(*[self.radius]*3)
         return AABB(
@@ -49,6 +65,33 @@ class Sphere(Hittable):
             self.center + radius_vec
         )
 
+    def pdf_value(self, origin: Point3, direction: Vec3) -> float:
+        if self.hit(Ray(origin, direction), 0.001, np.inf) is None:
+            return 0
+        cos_theta_max = self.cos_theta_max(origin)
+        if cos_theta_max is None:
+            return 0
+        return 1 / (2 * np.pi * (1 - cos_theta_max))
+
+    def random(self, origin: Point3) -> Vec3:
+        # Uniform over the cone of directions the sphere covers
+        cos_theta_max = self.cos_theta_max(origin)
+        if cos_theta_max is None:
+            return Vec3.random_unit_vector()
+        z = 1 + random_float() * (cos_theta_max - 1)
+        phi = 2 * np.pi * random_float()
+        sin_theta = np.sqrt(1 - z**2)
+        return ONB(self.center - origin).local(
+            Vec3(np.cos(phi) * sin_theta, np.sin(phi) * sin_theta, z)
+        )
+
+    def cos_theta_max(self, origin: Point3) -> Optional[float]:
+        # None from inside the sphere, where there is no cone
+        distance_squared = (self.center - origin).length_squared()
+        if distance_squared <= self.radius**2:
+            return None
+        return np.sqrt(1 - self.radius**2 / distance_squared)
+
     @staticmethod
     def get_sphere_uv(p: Vec3) -> Tuple[float, float]:
         phi: float = np.arctan2(p.z(), p.x())
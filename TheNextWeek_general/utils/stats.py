@@ -0,0 +1,21 @@
+from typing import List
+
+
+class TraversalStats:
+    """
+    Counters bumped by the acceleration structures during traversal.
+    Each worker process keeps its own copy, reset it before measuring.
+    """
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.box_tests: int = 0
+        self.primitive_tests: int = 0
+        self.bounces: int = 0
+
+    def snapshot(self) -> List[int]:
+        return [self.box_tests, self.primitive_tests, self.bounces]
+
+
+traversal_stats = TraversalStats()
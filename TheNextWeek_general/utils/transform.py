@@ -0,0 +1,75 @@
+from __future__ import annotations
+import numpy as np  # type: ignore
+from typing import Tuple
+from utils.vec3 import Vec3, Point3
+from utils.ray import Ray
+from utils.aabb import AABB
+from utils.rtweekend import degrees_to_radians
+
+
+class Transform:
+    """
+    An affine 4x4 transform with its inverse computed once.
+    Compose with @, the right-hand transform is applied first.
+    """
+    def __init__(self, matrix: np.ndarray) -> None:
+        self.matrix: np.ndarray = matrix
+        self.inverse: np.ndarray = np.linalg.inv(matrix)
+        self.inverse_linear: np.ndarray = self.inverse[:3, :3].copy()
+        self.inverse_offset: np.ndarray = self.inverse[:3, 3].copy()
+        # Normals go through the inverse transpose of the linear part
+        self.normal_matrix: np.ndarray = self.inverse[:3, :3].T
+
+    def __matmul__(self, other: Transform) -> Transform:
+        return Transform(self.matrix @ other.matrix)
+
+    def point(self, p: Point3) -> Point3:
+        return Point3(*(self.matrix[:3, :3] @ p.e + self.matrix[:3, 3]))
+
+    def vector(self, v: Vec3) -> Vec3:
+        return Vec3(*(self.matrix[:3, :3] @ v.e))
+
+    def normal(self, n: Vec3) -> Vec3:
+        return Vec3(*(self.normal_matrix @ n.e)).unit_vector()
+
+    def inverse_ray(self, r: Ray) -> Ray:
+        origin = self.inverse_linear @ r.origin().e + self.inverse_offset
+        direction = self.inverse_linear @ r.direction().e
+        return Ray(Point3(*origin), Vec3(*direction), r.time())
+
+    def box(self, box: AABB) -> AABB:
+        corners = np.array([
+            [box.max()[0] if i else box.min()[0],
+             box.max()[1] if j else box.min()[1],
+             box.max()[2] if k else box.min()[2]]
+            for i in range(2) for j in range(2) for k in range(2)
+        ])
+        moved = corners @ self.matrix[:3, :3].T + self.matrix[:3, 3]
+        return AABB(Point3(*moved.min(axis=0)), Point3(*moved.max(axis=0)))
+
+    @staticmethod
+    def identity() -> Transform:
+        return Transform(np.eye(4))
+
+    @staticmethod
+    def translate(offset: Vec3) -> Transform:
+        matrix = np.eye(4)
+        matrix[:3, 3] = offset.e
+        return Transform(matrix)
+
+    @staticmethod
+    def scale(factor: Tuple[float, float, float]) -> Transform:
+        return Transform(np.diag([*factor, 1.0]))
+
+    @staticmethod
+    def rotate_y(angle: float) -> Transform:
+        # Same sense as RotateY
+        radians = degrees_to_radians(angle)
+        cos_theta = np.cos(radians)
+        sin_theta = np.sin(radians)
+        matrix = np.eye(4)
+        matrix[0, 0] = cos_theta
+        matrix[0, 2] = sin_theta
+        matrix[2, 0] = -sin_theta
+        matrix[2, 2] = cos_theta
+        return Transform(matrix)
@@ -1,7 +1,6 @@
 from __future__ import annotations
 import numpy as np  # type: ignore
 from typing import Union
-from copy import deepcopy
 from utils.rtweekend import random_float, random_float_list
 
 
@@ -28,7 +27,7 @@ class Vec3:
         return f"{self.e[0]} {self.e[1]} {self.e[2]}"
 
     def copy(self) -> Vec3:
-        return deepcopy(self)
+        return Vec3(*self.e)
 
     def length_squared(self) -> float:
         return self.e @ self.e
@@ -126,6 +125,17 @@ class Vec3:
         else:
             return -in_unit_sphere
 
+    @staticmethod
+    def random_cosine_direction() -> Vec3:
+        # Around +z with density cos(theta) / pi
+        r1: float = random_float()
+        r2: float = random_float()
+        phi: float = 2 * np.pi * r1
+        return Vec3(
+            np.cos(phi) * np.sqrt(r2), np.sin(phi) * np.sqrt(r2),
+            np.sqrt(1 - r2)
+        )
+
     @staticmethod
     def random_in_unit_disk():
         while True: